@@ -0,0 +1,5 @@
+"""
+Standalone benchmarks for the `gutensearch` package. Each module
+can be run as a script from the root of the repository, for example
+`python -m benchmarks.tokenizer --path data/`.
+"""
@@ -0,0 +1,127 @@
+"""
+Compares the storage backends (see `gutensearch.backend`) on the same
+corpus: the time taken to load every document, and the latency of word,
+word pattern and document searches. The SQLite database is written to
+a temporary file, while the Postgres database is the one configured by
+the `POSTGRES_*` environment variables, so use a scratch database and
+pass `--truncate` to start each run from empty tables.
+"""
+
+import random
+import statistics
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import psycopg2  # type: ignore
+
+from gutensearch import database
+from gutensearch.backend import Backend, PostgresBackend, SQLiteBackend
+from gutensearch.database import dbconfig
+from gutensearch.load import find_documents
+from gutensearch.parse import document_id, parse_document_counts
+
+
+def latency(search: Callable[[str], object], args: List[str]) -> Dict[str, float]:
+    timings = []
+    for a in args:
+        start = time.perf_counter()
+        search(a)
+        timings.append(time.perf_counter() - start)
+
+    timings.sort()
+    return {
+        "p50": 1000 * statistics.median(timings),
+        "p99": 1000 * timings[min(len(timings) - 1, int(0.99 * len(timings)))],
+    }
+
+
+def benchmark(
+    name: str, backend: Backend, files: List[Path], queries: int, seed: int
+) -> None:
+    start = time.perf_counter()
+    backend.load(parse_document_counts(f) for f in files)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<10} load {elapsed:8.2f}s")
+
+    rng = random.Random(seed)
+    words = backend.query_distinct_words(sort=True)
+    sample = [rng.choice(words) for _ in range(queries)]
+    patterns = [w[:2] + "%" for w in sample]
+    documents = [document_id(f) for f in rng.choices(files, k=queries)]
+
+    searches = {
+        "word": (lambda w: backend.search_word(w, limit=10), sample),
+        "pattern": (lambda p: backend.search_word(p, limit=10), patterns),
+        "document": (lambda d: backend.search_document(d, 4, 10), documents),
+    }
+    for search, (fn, args) in searches.items():
+        result = latency(fn, args)
+        print(
+            f"{name:<10} {search:<9} p50 {result['p50']:7.2f}ms"
+            f"  p99 {result['p99']:7.2f}ms"
+        )
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--path",
+        help="The path to the directory containing the documents",
+        default=Path("data"),
+        type=Path,
+    )
+    parser.add_argument(
+        "--limit",
+        help="Only benchmark a limited number of documents",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--queries",
+        help="The number of searches of each kind to time",
+        type=int,
+        default=200,
+    )
+    parser.add_argument(
+        "--truncate",
+        help="Empty the Postgres tables before loading (destroys existing data!)",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--skip-postgres",
+        help="Only benchmark the SQLite backend",
+        action="store_true",
+        default=False,
+    )
+    args = parser.parse_args()
+
+    # measure the database itself, rather than the result cache
+    database.CACHE.size = 0
+
+    files = sorted(find_documents(args.path))
+    files = files[: args.limit]
+    print(f"{len(files)} documents")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sqlite = SQLiteBackend(Path(tmp) / "gutensearch.db")
+        benchmark("sqlite", sqlite, files, args.queries, seed=0)
+        sqlite.close()
+
+    if args.skip_postgres:
+        return
+
+    if args.truncate:
+        con = psycopg2.connect(**dbconfig())
+        with con, con.cursor() as cur:
+            cur.execute("TRUNCATE TABLE words, distinct_words")
+        con.close()
+
+    benchmark("postgres", PostgresBackend("flat"), files, args.queries, seed=0)
+
+
+if __name__ == "__main__":
+    main()
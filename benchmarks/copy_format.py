@@ -0,0 +1,193 @@
+"""
+Compares the text and binary formats of the Postgres `COPY` command (see
+`gutensearch.pgcopy`) used to load the `words` table. First, checks that
+the binary rows decode back to the parsed word counts, including words
+longer than 255 bytes, non-ASCII words and large counts. Then, for each
+format, measures the client CPU time spent encoding every row, and the
+time taken by the database configured by the `POSTGRES_*` environment
+variables to ingest the rows with `COPY`, in batches of `--batch-size`
+rows. The rows are copied into a temporary table, which is read back to
+check that both formats store exactly the same rows, so no existing
+data is changed.
+"""
+
+import time
+from argparse import ArgumentParser
+from array import array
+from pathlib import Path
+from typing import Any, List, Tuple
+
+import psycopg2  # type: ignore
+
+from gutensearch.database import dbconfig
+from gutensearch.load import copy_buffer, find_documents, write_rows
+from gutensearch.parse import DocumentCounts, parse_document_counts
+from gutensearch.pgcopy import (
+    BINARY_HEADER,
+    BINARY_TRAILER,
+    copy_binary,
+    decode_rows,
+    encode_distinct_words,
+)
+
+TEMPORARY_TABLE = """
+CREATE TEMPORARY TABLE words_copy (
+    word VARCHAR NOT NULL,
+    document_id BIGINT NOT NULL,
+    count INT NOT NULL
+)
+""".strip()
+
+
+def rows_of(documents: List[DocumentCounts]) -> List[Tuple[str, int, int]]:
+    return [
+        (w, doc.document_id, c)
+        for doc in documents
+        for w, c in zip(doc.words, doc.counts)
+    ]
+
+
+def check_round_trip(documents: List[DocumentCounts]) -> None:
+    edge_cases = DocumentCounts(
+        2**40,
+        ["a", "x" * 300, "naïve", "日本語", "z" * 255, "y" * 256],
+        array("I", [1, 4095, 4096, 2**31 - 1, 0, 7]),
+    )
+    documents = documents + [edge_cases, DocumentCounts(1, [], array("I"))]
+
+    data = b"".join(doc.copy_binary() for doc in documents)
+    decoded = decode_rows(
+        BINARY_HEADER + data + BINARY_TRAILER, ["text", "int8", "int4"]
+    )
+    assert decoded == rows_of(documents), "words rows do not round-trip"
+
+    words = sorted({w for doc in documents for w in doc.words})
+    data = encode_distinct_words(words)
+    decoded = decode_rows(BINARY_HEADER + data + BINARY_TRAILER, ["text"])
+    assert decoded == [(w,) for w in words], "distinct_words rows do not round-trip"
+
+    print(f"round trip ok: {len(rows_of(documents))} rows, {len(words)} words")
+
+
+def encode(
+    documents: List[DocumentCounts], copy_format: str, batch_size: int
+) -> Tuple[List[Any], float]:
+    start = time.process_time()
+    batches = []
+    fio, rows = copy_buffer(copy_format), 0
+    for doc in documents:
+        write_rows(fio, doc, copy_format)
+        rows += len(doc.words)
+        if rows >= batch_size:
+            batches.append(fio)
+            fio, rows = copy_buffer(copy_format), 0
+    if rows > 0:
+        batches.append(fio)
+
+    return batches, time.process_time() - start
+
+
+def ingest(con: Any, batches: List[Any], copy_format: str) -> Tuple[float, float]:
+    with con.cursor() as cur:
+        cur.execute("TRUNCATE TABLE words_copy")
+        con.commit()
+
+        wall, cpu = time.perf_counter(), time.process_time()
+        for fio in batches:
+            fio.seek(0)
+            if copy_format == "binary":
+                copy_binary(cur, fio, "words_copy")
+            else:
+                cur.copy_from(fio, "words_copy")
+        con.commit()
+
+    return time.perf_counter() - wall, time.process_time() - cpu
+
+
+def stored_rows(con: Any) -> List[Tuple[str, int, int]]:
+    with con.cursor() as cur:
+        cur.execute("SELECT word, document_id, count FROM words_copy")
+        rows = sorted(cur.fetchall())
+    con.commit()
+    return rows
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--path",
+        help="The path to the directory containing the documents",
+        default=Path("data"),
+        type=Path,
+    )
+    parser.add_argument(
+        "--limit",
+        help="Only benchmark a limited number of documents",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--batch-size",
+        help="The number of rows written by a single COPY",
+        type=int,
+        default=1_000_000,
+    )
+    parser.add_argument(
+        "--repeat",
+        help="The number of times each format is timed (the best time is kept)",
+        type=int,
+        default=3,
+    )
+    parser.add_argument(
+        "--skip-postgres",
+        help="Only check the round trip and time the encoders",
+        action="store_true",
+        default=False,
+    )
+    args = parser.parse_args()
+
+    files = find_documents(args.path)[: args.limit]
+    documents = [parse_document_counts(f) for f in files]
+    rows = sum(len(doc.words) for doc in documents)
+    print(f"{len(documents)} documents, {rows} rows")
+
+    check_round_trip(documents)
+
+    con = None
+    if not args.skip_postgres:
+        con = psycopg2.connect(**dbconfig())
+        with con.cursor() as cur:
+            cur.execute(TEMPORARY_TABLE)
+        con.commit()
+
+    stored = {}
+    for copy_format in ("text", "binary"):
+        timings = [
+            encode(documents, copy_format, args.batch_size) for _ in range(args.repeat)
+        ]
+        batches = timings[0][0]
+        encoding = min(t for _, t in timings)
+        size = sum(len(fio.getvalue()) for fio in batches)
+        line = (
+            f"{copy_format:<7} encode {encoding:6.2f}s cpu"
+            f" ({1e9 * encoding / rows:5.0f}ns/row)  {size / 2**20:7.1f} MiB"
+        )
+
+        if con is not None:
+            copies = [ingest(con, batches, copy_format) for _ in range(args.repeat)]
+            wall = min(w for w, _ in copies)
+            cpu = min(c for _, c in copies)
+            line += f"  copy {wall:6.2f}s ({rows / wall:9.0f} rows/s, {cpu:5.2f}s client cpu)"
+            stored[copy_format] = stored_rows(con)
+
+        print(line)
+
+    if con is not None:
+        assert stored["text"] == stored["binary"], "stored rows differ"
+        assert stored["binary"] == sorted(rows_of(documents)), "stored rows differ"
+        print("stored rows ok: both formats store the same rows")
+        con.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+Generates a synthetic corpus of Project Gutenberg-like documents, without
+any network access, so benchmarks can be reproduced anywhere. Words are
+drawn from a generated vocabulary following a Zipf distribution (the rank
+`r` word is drawn with probability proportional to `1 / r^s`), which is
+roughly how words are distributed in natural language. The length of each
+document follows a log-normal distribution, and the text is laid out in
+sentences, lines and paragraphs, with punctuation, numbers, capitalized
+words and a Project Gutenberg style header and footer, so the tokenizers
+see the same kind of input as with real documents. The same parameters
+and seed always generate exactly the same corpus.
+"""
+
+import math
+import random
+from argparse import ArgumentParser
+from itertools import accumulate
+from pathlib import Path
+from typing import List, NamedTuple
+
+# the most common English words, used as the highest ranked words
+COMMON_WORDS = (
+    "the of and to a in that he was it his i with as had for you not be her "
+    "is but at on she him they all by so this have from which said my were "
+    "me one there are what when we their no if an been would them or could"
+).split()
+
+SYLLABLES = (
+    "ba be bi bo bu ca ce ci co cu da de di do du fa fe fi fo ga ge gi go "
+    "ha he hi ho la le li lo lu ma me mi mo mu na ne ni no nu pa pe pi po "
+    "ra re ri ro ru sa se si so su ta te ti to tu va ve vi vo wa we wi ya "
+    "ar er ir or ur an en in on un al el il ol st th sh ch ng ck"
+).split()
+
+PUNCTUATION = [".", ".", ".", "!", "?", ";"]
+
+
+class Corpus(NamedTuple):
+    """
+    A generated corpus
+
+    Parameters:
+        path: The directory holding the documents
+        documents: The number of documents
+        words: The total number of words in every document
+        bytes: The total size of every document
+    """
+
+    path: Path
+    documents: int
+    words: int
+    bytes: int
+
+
+def make_vocabulary(size: int, seed: int = 0) -> List[str]:
+    """
+    Generate a vocabulary of distinct, pronounceable words, ordered by rank
+
+    Parameters:
+        size: The number of words
+        seed: The seed of the random number generator
+
+    Returns:
+        The words, from the most to the least frequent
+    """
+    rng = random.Random(seed)
+    words = list(dict.fromkeys(COMMON_WORDS))[:size]
+    seen = set(words)
+    while len(words) < size:
+        # rarer words tend to be longer
+        n = 1 + min(int(rng.expovariate(1.0) + len(words) ** 0.15), 6)
+        w = "".join(rng.choice(SYLLABLES) for _ in range(n))
+        if w not in seen:
+            seen.add(w)
+            words.append(w)
+
+    return words
+
+
+def write_document(
+    path: Path,
+    id_: int,
+    vocabulary: List[str],
+    weights: List[float],
+    length: int,
+    rng: random.Random,
+) -> int:
+    """
+    Write a single document of `length` words drawn from the vocabulary
+
+    Returns:
+        The number of bytes written
+    """
+    words = rng.choices(vocabulary, cum_weights=weights, k=length)
+
+    lines = [
+        f"The Project Gutenberg EBook of Synthetic Volume {id_}",
+        "",
+        f"Release Date: January {1 + id_ % 28}, {1990 + id_ % 30} [EBook #{id_}]",
+        "",
+        "*** START OF THIS PROJECT GUTENBERG EBOOK ***",
+        "",
+    ]
+    line: List[str] = []
+    sentence = 0
+    for i, w in enumerate(words):
+        if sentence == 0:
+            w = w.capitalize()
+            sentence = rng.randint(5, 25)
+        elif rng.random() < 0.01:
+            w = str(rng.randint(1, 1900))
+
+        sentence -= 1
+        if sentence == 0:
+            w += rng.choice(PUNCTUATION)
+        elif rng.random() < 0.08:
+            w += ","
+        line.append(w)
+
+        if len(line) >= 12:
+            lines.append(" ".join(line))
+            line = []
+            if rng.random() < 0.15:
+                lines.append("")
+
+    lines.append(" ".join(line))
+    lines += ["", f"End of the Project Gutenberg EBook #{id_}", ""]
+
+    data = "\n".join(lines).encode("utf-8")
+    path.write_bytes(data)
+    return len(data)
+
+
+def generate_corpus(
+    path: Path,
+    documents: int = 200,
+    words: int = 5000,
+    vocabulary: int = 50_000,
+    exponent: float = 1.1,
+    seed: int = 0,
+) -> Corpus:
+    """
+    Generate a corpus of `{id}.txt` documents, with ids starting at 1
+
+    Parameters:
+        path: The directory to write the documents to
+        documents: The number of documents
+        words: The average number of words in a document
+        vocabulary: The number of distinct words to draw from
+        exponent: The exponent `s` of the Zipf distribution
+        seed: The seed of the random number generator
+
+    Returns:
+        The generated corpus
+    """
+    path.mkdir(parents=True, exist_ok=True)
+    ranked = make_vocabulary(vocabulary, seed)
+    weights = list(accumulate(1 / (r**exponent) for r in range(1, len(ranked) + 1)))
+
+    # a log-normal distribution with the given mean
+    sigma = 0.8
+    mu = math.log(words) - sigma**2 / 2
+
+    total_words = 0
+    total_bytes = 0
+    for id_ in range(1, documents + 1):
+        # every document has its own generator, so a document does
+        # not depend on how many documents are generated
+        rng = random.Random(f"{seed}-{id_}")
+        length = max(1, int(rng.lognormvariate(mu, sigma)))
+        total_bytes += write_document(
+            path / f"{id_}.txt", id_, ranked, weights, length, rng
+        )
+        total_words += length
+
+    return Corpus(path, documents, total_words, total_bytes)
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--path",
+        help="The path to the directory to write the documents to",
+        default=Path("corpus"),
+        type=Path,
+    )
+    parser.add_argument(
+        "--documents", help="The number of documents", type=int, default=200
+    )
+    parser.add_argument(
+        "--words",
+        help="The average number of words in a document",
+        type=int,
+        default=5000,
+    )
+    parser.add_argument(
+        "--vocabulary",
+        help="The number of distinct words to draw from",
+        type=int,
+        default=50_000,
+    )
+    parser.add_argument(
+        "--exponent",
+        help="The exponent of the Zipf distribution of the words",
+        type=float,
+        default=1.1,
+    )
+    parser.add_argument(
+        "--seed", help="The seed of the random number generator", type=int, default=0
+    )
+    args = parser.parse_args()
+
+    corpus = generate_corpus(
+        args.path,
+        args.documents,
+        args.words,
+        args.vocabulary,
+        args.exponent,
+        args.seed,
+    )
+    print(
+        f"{corpus.documents} documents, {corpus.words} words, "
+        f"{corpus.bytes / 1e6:.1f} MB in {corpus.path}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+Measures the download engine (see `gutensearch.download`) against a local
+stand-in for the aleph mirror: an HTTP server serving generated documents
+with the same directory layout, adding a fixed latency to every response
+and failing a fraction of the requests with `503 Service Unavailable`
+(optionally with a `Retry-After` header).
+Each configuration downloads the same documents into a temporary directory,
+checks the saved files and metadata against the served documents, and
+reports the throughput and the request rate seen by the server.
+"""
+
+import asyncio
+import json
+import random
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from gutensearch.download import Downloader, download_documents
+
+
+class MirrorHandler(SimpleHTTPRequestHandler):
+    """
+    Serves the generated mirror, with the latency and failures
+    set on the server
+    """
+
+    def do_GET(self) -> None:
+        server = self.server
+        with server.lock:  # type: ignore
+            server.requests.append(time.monotonic())  # type: ignore
+            fail = server.rng.random() < server.failure_rate  # type: ignore
+
+        time.sleep(server.latency)  # type: ignore
+        if fail:
+            self.send_response(503)
+            if server.retry_after is not None:  # type: ignore
+                self.send_header("Retry-After", str(server.retry_after))  # type: ignore
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        super().do_GET()
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+def generate_mirror(
+    root: Path, ids: List[int], missing: float, seed: int
+) -> Dict[int, str]:
+    """
+    Write a document for each id (except a `missing` fraction of them)
+    in the layout of the aleph mirror, e.g. `1/2/123/123-0.txt`
+    (or `0/7/7-0.txt` for single digit ids)
+
+    Returns:
+        The text of each document that can be downloaded
+    """
+    rng = random.Random(seed)
+    words = ["the", "and", "whale", "sea", "ship", "captain", "white", "night"]
+    documents = {}
+    for i in ids:
+        if rng.random() < missing:
+            continue
+
+        directory = root.joinpath(*(str(i)[:-1] or "0"), str(i))
+        directory.mkdir(parents=True)
+        text = " ".join(rng.choices(words, k=2000))
+        # the engine prefers `{id}-0.txt` over `{id}-8.txt`
+        (directory / f"{i}-0.txt").write_text(text)
+        (directory / f"{i}-8.txt").write_text(text.upper())
+        documents[i] = text
+
+    return documents
+
+
+def start_mirror(
+    root: Path,
+    latency: float,
+    failure_rate: float,
+    retry_after: Optional[int] = None,
+    seed: int = 0,
+) -> ThreadingHTTPServer:
+    """
+    Serve the generated mirror from a background thread, on a free port
+    of the local host (see `MirrorHandler`), until `shutdown` is called
+
+    Returns:
+        The server, which records the time of every request in `requests`
+    """
+    handler = partial(MirrorHandler, directory=str(root))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()  # type: ignore
+    server.rng = random.Random(seed)  # type: ignore
+    server.latency = latency  # type: ignore
+    server.failure_rate = failure_rate  # type: ignore
+    server.retry_after = retry_after  # type: ignore
+    server.requests = []  # type: ignore
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run(
+    url: str,
+    ids: List[int],
+    concurrency: int,
+    rate: float,
+    retries: int,
+    backoff: float,
+) -> Path:
+    path = Path(tempfile.mkdtemp())
+    meta: Dict[str, Dict[str, str]] = {}
+    downloader = Downloader(url, concurrency, rate, retries, backoff)
+    try:
+        asyncio.run(download_documents(path, ids, meta, downloader, concurrency))
+    finally:
+        downloader.close()
+
+    (path / ".meta.json").write_text(json.dumps(meta))
+    return path
+
+
+def check(path: Path, documents: Dict[int, str]) -> int:
+    """
+    Compare the downloaded documents and metadata with the served ones
+
+    Returns:
+        The number of documents that were not downloaded
+    """
+    meta = json.loads((path / ".meta.json").read_text())
+    for key, entry in meta.items():
+        assert Path(entry["filepath"]).read_text() == documents[int(key)], key
+        assert entry["url"].endswith(f"/{key}/"), entry["url"]
+
+    return len(documents) - len(meta)
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--documents",
+        help="The number of document ids to download",
+        type=int,
+        default=200,
+    )
+    parser.add_argument(
+        "--latency",
+        help="The number of seconds the mirror takes to respond",
+        type=float,
+        default=0.05,
+    )
+    parser.add_argument(
+        "--failure-rate",
+        help="The fraction of requests failed with a 503 response",
+        type=float,
+        default=0.05,
+    )
+    parser.add_argument(
+        "--missing",
+        help="The fraction of document ids without a document (404)",
+        type=float,
+        default=0.1,
+    )
+    parser.add_argument(
+        "--rate",
+        help="The rate limit (requests per second) of the rate-limited runs",
+        type=float,
+        default=20.0,
+    )
+    parser.add_argument(
+        "--concurrency",
+        help="The number of concurrent fetches of the concurrent runs",
+        type=int,
+        default=16,
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        ids = list(range(10, 10 + args.documents))
+        documents = generate_mirror(Path(root), ids, args.missing, seed=0)
+
+        server = start_mirror(Path(root), args.latency, args.failure_rate)
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+
+        print(f"{len(documents)} documents ({len(ids)} ids)")
+        configurations = [
+            ("sequential", 1, 0.0),
+            (f"{args.concurrency} concurrent", args.concurrency, 0.0),
+            (
+                f"{args.concurrency} concurrent, {args.rate:g}/s",
+                args.concurrency,
+                args.rate,
+            ),
+        ]
+        for name, concurrency, rate in configurations:
+            server.requests = []  # type: ignore
+            start = time.perf_counter()
+            path = run(url, ids, concurrency, rate, retries=5, backoff=0.05)
+            elapsed = time.perf_counter() - start
+
+            failed = check(path, documents)
+            requests = server.requests  # type: ignore
+            # the request rate over any one second window
+            peak = max(sum(1 for t in requests if s <= t < s + 1) for s in requests)
+            print(
+                f"{name:<28} {elapsed:7.2f}s  {len(documents) / elapsed:7.1f} docs/s"
+                f"  {len(requests) / elapsed:7.1f} req/s (peak {peak}/s)"
+                f"  {failed} failed"
+            )
+
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Compares the cost of sending parsed documents from the worker processes
+to the parent process in `gutensearch load`, using either the original
+list of dictionaries returned by `parse_document`, or the compact
+`DocumentCounts` format returned by `parse_document_counts`. For each
+format this reports the number of (pickled) bytes transferred, and the
+CPU time spent by the parent unpickling the results and formatting
+them as rows for `COPY`.
+"""
+
+import pickle
+import time
+from argparse import ArgumentParser
+from io import StringIO
+from pathlib import Path
+from typing import Any, Callable, List
+
+from gutensearch.load import find_documents
+from gutensearch.parse import parse_document, parse_document_counts
+
+
+def format_records(results: List[Any]) -> str:
+    with StringIO() as fio:
+        for records in results:
+            for d in records:
+                text = "\t".join(str(v) for v in d.values())
+                fio.write(text + "\n")
+        return fio.getvalue()
+
+
+def format_counts(results: List[Any]) -> str:
+    with StringIO() as fio:
+        for doc in results:
+            fio.write(doc.copy_text())
+        return fio.getvalue()
+
+
+def measure(payloads: List[bytes], fmt: Callable[[List[Any]], str]) -> float:
+    start = time.process_time()
+    fmt([pickle.loads(p) for p in payloads])
+    return time.process_time() - start
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--path",
+        help="The path to the directory containing the documents",
+        default=Path("data"),
+        type=Path,
+    )
+    parser.add_argument(
+        "--limit",
+        help="Only benchmark a limited number of documents",
+        type=int,
+        default=100,
+    )
+    args = parser.parse_args()
+
+    files = sorted(find_documents(args.path))
+    files = files[: args.limit]
+    print(f"documents: {len(files)}")
+
+    # multiprocessing pickles results using the highest protocol
+    protocol = pickle.HIGHEST_PROTOCOL
+    records = [pickle.dumps(parse_document(f), protocol) for f in files]
+    counts = [pickle.dumps(parse_document_counts(f), protocol) for f in files]
+
+    print("format\tbytes\tparent_cpu_s")
+    for name, payloads, fmt in [
+        ("records", records, format_records),
+        ("counts", counts, format_counts),
+    ]:
+        size = sum(len(p) for p in payloads)
+        print(f"{name}\t{size}\t{measure(payloads, fmt):.3f}")
+
+
+if __name__ == "__main__":
+    main()
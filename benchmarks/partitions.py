@@ -0,0 +1,172 @@
+"""
+Compares loading the `words` table of the database configured by the
+`POSTGRES_*` environment variables with a single `COPY` connection
+against several parallel writers, both into a plain table and into a
+table partitioned by word (hash) or by document id (range), see
+`gutensearch.load.parallel_records`. For each configuration, reports the
+load time, the latency of word and document searches, and whether the
+query plan of each search only scans a single partition. Every run
+replaces the `words` table, so only use this with a scratch database
+and pass `--scratch` to confirm it.
+"""
+
+import random
+import statistics
+import sys
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Any, Callable, List, Optional
+
+import psycopg2  # type: ignore
+
+from gutensearch import database
+from gutensearch.backend import PostgresBackend
+from gutensearch.database import dbconfig
+from gutensearch.load import find_documents, scan_documents
+from gutensearch.parse import document_id, parse_document_counts
+
+# the unpartitioned `words` table, as created by `schema.sql`
+PLAIN_WORDS_TABLE = """
+CREATE TABLE words (
+    word VARCHAR NOT NULL,
+    document_id BIGINT NOT NULL,
+    count INT NOT NULL
+)
+""".strip()
+
+
+def reset(con: Any) -> None:
+    with con.cursor() as cur:
+        cur.execute("DROP TABLE IF EXISTS words")
+        cur.execute(PLAIN_WORDS_TABLE)
+        cur.execute("TRUNCATE TABLE distinct_words, documents")
+    con.commit()
+
+
+def latency(search: Callable[[Any], object], args: List[Any]) -> float:
+    timings = []
+    for a in args:
+        start = time.perf_counter()
+        search(a)
+        timings.append(time.perf_counter() - start)
+
+    return 1000 * statistics.median(timings)
+
+
+def partitions_scanned(con: Any, sql: str, param: Any) -> int:
+    with con.cursor() as cur:
+        cur.execute(f"EXPLAIN {sql}", (param,))
+        plan = "\n".join(row[0] for row in cur.fetchall())
+    con.commit()
+
+    # every scan of a table names the table, e.g. `Index Scan on words_3`
+    return plan.count(" on words")
+
+
+def benchmark(
+    name: str,
+    con: Any,
+    files: List[Path],
+    writers: int,
+    partitions: int,
+    partition_by: str,
+    words: Optional[List[str]],
+    queries: int,
+) -> List[str]:
+    reset(con)
+    entries = scan_documents(files)
+    backend = PostgresBackend("flat", writers, partitions, partition_by)
+
+    start = time.perf_counter()
+    backend.load((parse_document_counts(f) for f in files), files=entries)
+    elapsed = time.perf_counter() - start
+
+    rng = random.Random(0)
+    if words is None:
+        words = backend.query_distinct_words(sort=True)
+    sample = [rng.choice(words) for _ in range(queries)]
+    ids = [document_id(f) for f in rng.choices(files, k=queries)]
+
+    word = latency(lambda w: backend.search_word(w, limit=10), sample)
+    doc = latency(lambda d: backend.search_document(d, None, 10), ids)
+    word_scans = partitions_scanned(
+        con, "SELECT * FROM words WHERE word = %s", sample[0]
+    )
+    doc_scans = partitions_scanned(
+        con, "SELECT * FROM words WHERE document_id = %s", ids[0]
+    )
+
+    print(
+        f"{name:<28} load {elapsed:7.2f}s  word p50 {word:6.2f}ms "
+        f"({word_scans} scanned)  document p50 {doc:6.2f}ms ({doc_scans} scanned)"
+    )
+    return words
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--path",
+        help="The path to the directory containing the documents",
+        default=Path("data"),
+        type=Path,
+    )
+    parser.add_argument(
+        "--limit",
+        help="Only benchmark a limited number of documents",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--partitions",
+        help="The number of partitions (and parallel writers)",
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        "--queries",
+        help="The number of searches of each kind to time",
+        type=int,
+        default=200,
+    )
+    parser.add_argument(
+        "--scratch",
+        help="Confirm that the database is a scratch database (destroys existing data!)",
+        action="store_true",
+        default=False,
+    )
+    args = parser.parse_args()
+
+    if not args.scratch:
+        print("Every run replaces the words table, pass --scratch to confirm")
+        sys.exit(1)
+
+    # measure the database itself, rather than the result cache
+    database.CACHE.size = 0
+
+    files = find_documents(args.path)[: args.limit]
+    print(f"{len(files)} documents")
+
+    n = args.partitions
+    configurations = [
+        ("single writer", 1, 0, "word"),
+        (f"{n} writers", n, 0, "word"),
+        (f"{n} hash partitions (word)", n, n, "word"),
+        (f"{n} range partitions (id)", n, n, "document_id"),
+    ]
+
+    con = psycopg2.connect(**dbconfig())
+    words = None
+    try:
+        for name, writers, partitions, partition_by in configurations:
+            words = benchmark(
+                name, con, files, writers, partitions, partition_by, words, args.queries
+            )
+            database.close_pool()
+    finally:
+        con.close()
+
+
+if __name__ == "__main__":
+    main()
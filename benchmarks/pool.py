@@ -0,0 +1,87 @@
+"""
+Measures the latency of word searches (see `gutensearch.database.search_word`)
+against the database configured by the `POSTGRES_*` environment variables,
+both with the process-wide connection pool and with a new connection opened
+for every search (`POSTGRES_POOL_SIZE=0`). Each configuration runs the same
+searches one after another, and then concurrently from several threads,
+and reports the p50 and p99 latency of a single search.
+"""
+
+import random
+import statistics
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from gutensearch import database
+
+
+def timed_search(word: str) -> float:
+    start = time.perf_counter()
+    database.search_word(word, limit=10)
+    return time.perf_counter() - start
+
+
+def run(words: List[str], threads: int) -> List[float]:
+    if threads <= 1:
+        return [timed_search(w) for w in words]
+
+    with ThreadPoolExecutor(threads) as executor:
+        return list(executor.map(timed_search, words))
+
+
+def report(name: str, timings: List[float], elapsed: float) -> None:
+    timings = sorted(timings)
+    p50 = 1000 * statistics.median(timings)
+    p99 = 1000 * timings[min(len(timings) - 1, int(0.99 * len(timings)))]
+    print(
+        f"{name:<24} p50 {p50:7.2f}ms  p99 {p99:7.2f}ms"
+        f"  {len(timings) / elapsed:8.0f} searches/s"
+    )
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--lookups",
+        help="The number of searches to time for each configuration",
+        type=int,
+        default=1000,
+    )
+    parser.add_argument(
+        "--threads",
+        help="The number of threads searching concurrently",
+        type=int,
+        default=8,
+    )
+    args = parser.parse_args()
+
+    # measure the database itself, rather than the result cache
+    database.CACHE.size = 0
+
+    rng = random.Random(0)
+    vocabulary = database.query_distinct_words(sort=True)
+    words = [rng.choice(vocabulary) for _ in range(args.lookups)]
+
+    pool_size = database.POSTGRES_POOL_SIZE or args.threads
+    for pooled in (False, True):
+        database.close_pool()
+        database.POSTGRES_POOL_SIZE = pool_size if pooled else 0
+
+        for threads in (1, args.threads):
+            # warm up the pool and the prepared statements
+            run(words[: 2 * threads], threads)
+
+            start = time.perf_counter()
+            timings = run(words, threads)
+            elapsed = time.perf_counter() - start
+
+            mode = "sequential" if threads == 1 else f"{threads} threads"
+            report(f"{'pool' if pooled else 'no pool'}, {mode}", timings, elapsed)
+
+    database.close_pool()
+
+
+if __name__ == "__main__":
+    main()
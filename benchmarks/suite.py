@@ -0,0 +1,595 @@
+"""
+Runs the reproducible benchmark suite of `gutensearch` on a synthetic
+corpus (see `benchmarks.corpus`), so that results can be compared between
+versions and machines. Times both tokenizers, `parse_document`, the whole
+`gutensearch load` pipeline (`gutensearch.cli.load_main`), word searches
+(exact, pattern, fuzzy and boolean), `closest_match` and document searches, and
+writes every result as JSON (to stdout, or to `--output`).
+
+By default, the documents are loaded into a temporary SQLite database
+standing in for Postgres, so nothing but Python is needed. Pass
+`--backend postgres --scratch` to use the Postgres database configured
+by the `POSTGRES_*` environment variables instead, which is emptied
+before every load, so only use it with a scratch database (and add
+`--rank` to also time ranked word searches, see `gutensearch.rank`, or
+`--positions` to also time phrase and NEAR queries and report the size of
+the positional index, see `gutensearch.positions`, or `--similar` to
+build the embedded inverted index and time searches for similar
+documents, see `gutensearch.similar`). Pass
+`--baseline` with the JSON output of an earlier run to compare each
+result with it, and exit with an error if any result regressed by more
+than `--tolerance`.
+"""
+
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+# keep the database file and fuzzy index away from the user's own
+# (both are read when `gutensearch` is first imported)
+WORKDIR = Path(tempfile.mkdtemp(prefix="gutensearch-benchmark-"))
+os.environ.setdefault("GUTENSEARCH_SQLITE", str(WORKDIR / "gutensearch.db"))
+os.environ.setdefault("GUTENSEARCH_FUZZY_INDEX", str(WORKDIR / "fuzzy.idx"))
+
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser, Namespace
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Sequence
+
+import psycopg2  # type: ignore
+
+from benchmarks.corpus import generate_corpus
+from gutensearch import database
+from gutensearch.backend import SQLITE_PATH, get_backend
+from gutensearch.cli import load_main, make_parser
+from gutensearch.database import (
+    GUTENSEARCH_SCHEMA,
+    WORDS_TABLES,
+    dbconfig,
+)
+from gutensearch.fuzzy import FUZZY_INDEX_PATH
+from gutensearch.index import InvertedIndex, build_index
+from gutensearch.load import find_documents
+from gutensearch.parse import (
+    TOKENIZERS,
+    chunktokenize,
+    closest_match,
+    document_id,
+    open_document,
+    parse_document,
+    parse_word_count,
+)
+from gutensearch.rank import RANKINGS
+from gutensearch.similar import np
+
+# the results compared with `--baseline`, and whether higher is better
+COMPARED = {
+    "seconds": False,
+    "p50_ms": False,
+    "mb_per_s": True,
+    "documents_per_s": True,
+    "rows_per_s": True,
+}
+
+
+def best_of(repeat: int, fn: Callable[[], Any]) -> float:
+    """
+    Time a function a few times
+
+    Returns:
+        The shortest time taken, in seconds
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+
+    return min(timings)
+
+
+def latency(search: Callable[[Any], object], args: Sequence[Any]) -> Dict[str, float]:
+    """
+    Time a search once for each argument
+
+    Returns:
+        The percentiles and mean of the latency of a single search, in milliseconds
+    """
+    timings = []
+    for a in args:
+        start = time.perf_counter()
+        search(a)
+        timings.append(1000 * (time.perf_counter() - start))
+
+    timings.sort()
+
+    def percentile(p: float) -> float:
+        return timings[min(len(timings) - 1, int(p * len(timings)))]
+
+    return {
+        "n": len(timings),
+        "p50_ms": statistics.median(timings),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "mean_ms": statistics.mean(timings),
+    }
+
+
+def misspell(word: str, rng: random.Random) -> str:
+    """
+    Replace, drop or insert a single letter of the word
+    """
+    i = rng.randrange(len(word))
+    letter = rng.choice("abcdefghijklmnopqrstuvwxyz")
+    edit = rng.randrange(3)
+    if edit == 0:
+        return word[:i] + letter + word[i + 1 :]
+    if edit == 1 and len(word) > 2:
+        return word[:i] + word[i + 1 :]
+    return word[:i] + letter + word[i:]
+
+
+def empty_database(backend: str) -> None:
+    """
+    Start the next load from an empty database
+    """
+    if backend == "sqlite":
+        for suffix in ("", "-wal", "-shm"):
+            Path(f"{SQLITE_PATH}{suffix}").unlink(missing_ok=True)
+        return
+
+    con = psycopg2.connect(**dbconfig())
+    with con, con.cursor() as cur:
+        cur.execute("TRUNCATE TABLE words, distinct_words, documents")
+        cur.execute("DROP TABLE IF EXISTS word_positions")
+    con.close()
+
+
+def benchmark_tokenizers(files: List[Path], repeat: int) -> Dict[str, Any]:
+    size = sum(f.stat().st_size for f in files) / 1e6
+    tokens = sum(sum(parse_word_count(f).values()) for f in files)
+
+    results = {}
+    for tokenizer in sorted(TOKENIZERS):
+        seconds = best_of(
+            repeat,
+            lambda tokenizer=tokenizer: [parse_word_count(f, tokenizer) for f in files],
+        )
+        results[f"tokenize.{tokenizer}"] = {
+            "seconds": seconds,
+            "mb_per_s": size / seconds,
+            "tokens_per_s": tokens / seconds,
+        }
+
+    return results
+
+
+def benchmark_parse(files: List[Path], repeat: int) -> Dict[str, Any]:
+    seconds = best_of(repeat, lambda: [parse_document(f) for f in files])
+    per_document = latency(parse_document, files)
+    return {
+        "parse_document": {
+            "seconds": seconds,
+            "documents_per_s": len(files) / seconds,
+            **per_document,
+        }
+    }
+
+
+def benchmark_load(args: Namespace, corpus: Path, rows: int) -> Dict[str, Any]:
+    argv = [
+        "load",
+        "--path",
+        str(corpus),
+        "--backend",
+        args.backend,
+        "--fuzzy-index",
+        str(FUZZY_INDEX_PATH),
+        "--log-level",
+        "warning",
+    ]
+    if args.multiprocessing:
+        argv.append("--multiprocessing")
+    if args.stream:
+        argv.append("--stream")
+    if args.rank:
+        argv.append("--rank")
+    if args.positions:
+        argv.append("--positions")
+    load_args = make_parser().parse_args(argv)
+
+    def load() -> None:
+        empty_database(args.backend)
+        load_main(load_args)
+
+    seconds = best_of(args.repeat_load, load)
+    return {
+        "load": {
+            "seconds": seconds,
+            "documents_per_s": len(find_documents(corpus)) / seconds,
+            "rows": rows,
+            "rows_per_s": rows / seconds,
+        }
+    }
+
+
+def benchmark_searches(args: Namespace, files: List[Path]) -> Dict[str, Any]:
+    backend = get_backend(args.backend)
+    rng = random.Random(args.seed)
+
+    vocabulary = backend.query_distinct_words(sort=True)
+    words = [rng.choice(vocabulary) for _ in range(args.queries)]
+    patterns = [w[:3] + "%" for w in words]
+    misspelled = [misspell(w, rng) for w in words]
+    queries = [
+        f"{a} AND {b} NOT {c}"
+        for a, b, c in zip(words, rng.sample(words, len(words)), patterns)
+    ]
+    ids = [document_id(f) for f in rng.choices(files, k=args.queries)]
+
+    # `closest_match` compares the word with every word in the vocabulary
+    matches = misspelled[: max(1, args.queries // 10)]
+
+    results = {
+        "search_word.exact": latency(lambda w: backend.search_word(w, limit=10), words),
+        "search_word.pattern": latency(
+            lambda p: backend.search_word(p, limit=10), patterns
+        ),
+        "search_word.fuzzy": latency(
+            lambda w: backend.search_word(w, fuzzy=True, limit=10), misspelled
+        ),
+        "search_word.boolean": latency(
+            lambda q: backend.search_word(q, limit=10), queries
+        ),
+        "closest_match": latency(lambda w: closest_match(w, vocabulary), matches),
+        "search_document": latency(lambda d: backend.search_document(d, None, 10), ids),
+    }
+    if args.rank:
+        for rank in sorted(RANKINGS):
+            results[f"search_word.{rank}"] = latency(
+                lambda w, rank=rank: backend.search_word(w, limit=10, rank=rank), words
+            )
+    if args.positions:
+        phrases = [sample_phrase(f, rng) for f in rng.choices(files, k=args.queries)]
+        near = [f"{a} NEAR/5 {b}" for a, b in zip(words, rng.sample(words, len(words)))]
+        results["search_word.phrase"] = latency(
+            lambda p: backend.search_word(f'"{p}"', limit=10), phrases
+        )
+        results["search_word.near"] = latency(
+            lambda q: backend.search_word(q, limit=10), near
+        )
+    backend.close()
+    return results
+
+
+def sample_phrase(path: Path, rng: random.Random, length: int = 2) -> str:
+    """
+    Pick a phrase of consecutive words from a document, which occurs at least once
+    """
+    with open_document(path) as f:
+        tokens = list(chunktokenize(f))
+
+    i = rng.randrange(max(1, len(tokens) - length))
+    return " ".join(tokens[i : i + length])
+
+
+def benchmark_positions() -> Dict[str, Any]:
+    """
+    Measure the size of the positional index, relative to the `words` table
+    """
+    con = psycopg2.connect(**dbconfig())
+    with con, con.cursor() as cur:
+        cur.execute(
+            """
+            SELECT pg_total_relation_size('words'),
+                   pg_total_relation_size('word_positions'),
+                   (SELECT SUM(count) FROM words),
+                   (SELECT SUM(length(positions)) FROM word_positions)
+            """
+        )
+        words, positions, tokens, packed = cur.fetchone()
+    con.close()
+
+    return {
+        "positions.storage": {
+            "words_bytes": words,
+            "positions_bytes": positions,
+            "overhead": positions / words,
+            "packed_bytes_per_position": float(packed) / float(tokens),
+        }
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> int:
+    """
+    Print the change of every result since the baseline
+
+    Returns:
+        The number of results that regressed by more than the tolerance
+    """
+    regressions = 0
+    for name, result in results.items():
+        before = baseline.get("results", {}).get(name, {})
+        for metric, higher_is_better in COMPARED.items():
+            if metric not in result or not before.get(metric):
+                continue
+
+            change = result[metric] / before[metric] - 1
+            regressed = -change if higher_is_better else change
+            flag = ""
+            if regressed > tolerance:
+                flag = "  REGRESSION"
+                regressions += 1
+            print(f"{name:<22} {metric:<16} {change:+8.1%}{flag}", file=sys.stderr)
+
+    return regressions
+
+
+def git_commit() -> str:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent,
+        )
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def benchmark_similar(args: Namespace, files: List[Path]) -> Dict[str, Any]:
+    """
+    Build the embedded inverted index, and time searches for the documents
+    similar to a document, reporting the size of the TF-IDF vectors
+    relative to the rest of the index
+    """
+    path = WORKDIR / "index"
+    con = psycopg2.connect(**dbconfig())
+    try:
+        start = time.perf_counter()
+        build_index(con, path, WORDS_TABLES[GUTENSEARCH_SCHEMA])
+        seconds = time.perf_counter() - start
+    finally:
+        con.close()
+
+    rng = random.Random(args.seed)
+    ids = [document_id(f) for f in rng.choices(files, k=args.queries)]
+
+    index = InvertedIndex(path)
+    try:
+        search = latency(lambda d: index.search_similar(d, 10), ids)
+    finally:
+        index.close()
+
+    sizes = {f.name: f.stat().st_size for f in path.iterdir()}
+    vectors = sizes["terms.weights"] + sizes["documents.norms"]
+    return {
+        "build_index": {"seconds": seconds},
+        "search_similar": {**search, "numpy": np is not None},
+        "similar.storage": {
+            "index_bytes": sum(sizes.values()),
+            "vectors_bytes": vectors,
+            "overhead": vectors / (sum(sizes.values()) - vectors),
+        },
+    }
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--path",
+        help="Benchmark the documents in this directory instead of a generated corpus",
+        default=None,
+        type=Path,
+    )
+    parser.add_argument(
+        "--documents", help="The number of generated documents", type=int, default=200
+    )
+    parser.add_argument(
+        "--words",
+        help="The average number of words in a generated document",
+        type=int,
+        default=5000,
+    )
+    parser.add_argument(
+        "--vocabulary",
+        help="The number of distinct words in the generated corpus",
+        type=int,
+        default=50_000,
+    )
+    parser.add_argument(
+        "--exponent",
+        help="The exponent of the Zipf distribution of the generated words",
+        type=float,
+        default=1.1,
+    )
+    parser.add_argument(
+        "--seed",
+        help="The seed of the corpus and of the search arguments",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--backend",
+        help="The storage backend to load into and search from",
+        choices=["sqlite", "postgres"],
+        default="sqlite",
+    )
+    parser.add_argument(
+        "--scratch",
+        help="Confirm that the Postgres database is a scratch database "
+        "(destroys existing data!)",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--multiprocessing",
+        help="Load using multiple cores",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--stream",
+        help="Load in fixed-size batches while documents are parsed",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--rank",
+        help="Load the ranking statistics and time ranked word searches "
+        "(postgres only)",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--positions",
+        help="Load the positional index, report its size and time phrase "
+        "and NEAR queries (postgres only)",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--similar",
+        help="Build the inverted index and time searches for similar "
+        "documents (postgres only)",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--queries",
+        help="The number of searches of each kind to time",
+        type=int,
+        default=200,
+    )
+    parser.add_argument(
+        "--repeat",
+        help="The number of times the tokenizers and parser are timed "
+        "(the best run is kept)",
+        type=int,
+        default=3,
+    )
+    parser.add_argument(
+        "--repeat-load",
+        help="The number of times the load is timed (the best run is kept)",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--output",
+        help="The path to write the JSON results to (default: stdout)",
+        default=None,
+        type=Path,
+    )
+    parser.add_argument(
+        "--baseline",
+        help="The JSON results of an earlier run to compare with",
+        default=None,
+        type=Path,
+    )
+    parser.add_argument(
+        "--tolerance",
+        help="The relative slowdown (e.g. 0.2 for 20%%) above which a result "
+        "is reported as a regression",
+        type=float,
+        default=0.2,
+    )
+    args = parser.parse_args()
+
+    # measure the database itself, rather than the result cache
+    database.CACHE.size = 0
+
+    try:
+        if args.backend == "postgres" and not args.scratch:
+            print("Every load empties the Postgres tables, pass --scratch to confirm")
+            sys.exit(1)
+        if args.rank and args.backend != "postgres":
+            print("Ranked searches are only supported by postgres")
+            sys.exit(1)
+        if args.positions and args.backend != "postgres":
+            print("Phrase and NEAR queries are only supported by postgres")
+            sys.exit(1)
+        if args.similar and args.backend != "postgres":
+            print("The inverted index can only be built from postgres")
+            sys.exit(1)
+
+        corpus = args.path
+        corpus_info: Dict[str, Any] = {"path": str(corpus)}
+        if corpus is None:
+            generated = generate_corpus(
+                WORKDIR / "corpus",
+                args.documents,
+                args.words,
+                args.vocabulary,
+                args.exponent,
+                args.seed,
+            )
+            corpus = generated.path
+            corpus_info = {
+                "generated": True,
+                "documents": generated.documents,
+                "words": generated.words,
+                "bytes": generated.bytes,
+                "vocabulary": args.vocabulary,
+                "exponent": args.exponent,
+                "seed": args.seed,
+            }
+
+        files = sorted(find_documents(corpus), key=document_id)
+        rows = sum(len(parse_word_count(f)) for f in files)
+        corpus_info.update(
+            documents=len(files),
+            bytes=sum(f.stat().st_size for f in files),
+            rows=rows,
+        )
+
+        results: Dict[str, Any] = {}
+        stages = [
+            ("tokenizers", lambda: benchmark_tokenizers(files, args.repeat)),
+            ("parse", lambda: benchmark_parse(files, args.repeat)),
+            ("load", lambda: benchmark_load(args, corpus, rows)),
+            ("searches", lambda: benchmark_searches(args, files)),
+        ]
+        if args.positions:
+            stages.append(("positions", benchmark_positions))
+        if args.similar:
+            stages.append(("similar", lambda: benchmark_similar(args, files)))
+        for stage, run in stages:
+            print(f"Running benchmark: {stage}", file=sys.stderr)
+            results.update(run())
+
+        report = {
+            "version": 1,
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "backend": args.backend,
+            "corpus": corpus_info,
+            "results": results,
+        }
+        text = json.dumps(report, indent=2)
+        if args.output is not None:
+            args.output.write_text(text + "\n")
+        else:
+            print(text)
+
+        if args.baseline is not None:
+            baseline = json.loads(args.baseline.read_text())
+            if compare(results, baseline, args.tolerance) > 0:
+                sys.exit(1)
+    finally:
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Measures the throughput (in MB/s per core) of each tokenizer engine
+available in `gutensearch.parse` over a directory of documents.
+"""
+
+import os
+import time
+from argparse import ArgumentParser
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List
+
+from gutensearch.load import find_documents
+from gutensearch.parse import TOKENIZERS, parse_word_count
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--path",
+        help="The path to the directory containing the documents",
+        default=Path("data"),
+        type=Path,
+    )
+    parser.add_argument(
+        "--limit",
+        help="Only benchmark a limited number of documents",
+        type=int,
+        default=100,
+    )
+    parser.add_argument(
+        "--repeat",
+        help="Number of times to repeat each benchmark (the best run is kept)",
+        type=int,
+        default=3,
+    )
+    args = parser.parse_args()
+
+    files: List[Path] = sorted(find_documents(args.path))[: args.limit]
+    size = sum(os.path.getsize(f) for f in files) / 1e6
+    print(f"documents: {len(files)}, size: {size:.1f} MB")
+
+    results: Dict[str, List[Counter]] = {}
+    print("engine\twall_s\tcpu_s\tmb_per_s_per_core")
+    for name in sorted(TOKENIZERS, reverse=True):
+        best_wall, best_cpu = float("inf"), float("inf")
+        for _ in range(args.repeat):
+            wall, cpu = time.perf_counter(), time.process_time()
+            counts = [parse_word_count(f, name) for f in files]
+            best_wall = min(best_wall, time.perf_counter() - wall)
+            best_cpu = min(best_cpu, time.process_time() - cpu)
+
+        results[name] = counts
+        print(f"{name}\t{best_wall:.3f}\t{best_cpu:.3f}\t{size / best_cpu:.2f}")
+
+    # every engine must produce exactly the same word counts
+    if results["lazy"] != results["chunked"]:
+        raise SystemExit("error: tokenizer outputs differ")
+
+
+if __name__ == "__main__":
+    main()
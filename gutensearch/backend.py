@@ -0,0 +1,894 @@
+"""
+This module provides a common interface over the storage backends
+that the word counts can be loaded into and searched from: the
+project Postgres database (see `gutensearch.database`), or a single
+SQLite database file, which needs no database server at all and
+is convenient for small deployments and CI.
+"""
+
+import os
+import sqlite3
+import logging
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from functools import lru_cache
+from pathlib import Path
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+import psycopg2  # type: ignore
+
+from . import database
+from .boolean import boolean_sql, is_boolean_query
+from .database import is_pattern
+from .index import TermRecord, build_index
+from .fuzzy import FUZZY_INDEX_PATH, build_fuzzy_index, load_fuzzy_index
+from .metrics import METRICS, phase
+from .load import (
+    BATCH_SIZE,
+    QUEUE_SIZE,
+    DocumentFile,
+    IncrementalPlan,
+    PARTITION_KEYS,
+    has_position_table,
+    incremental_records,
+    load_records,
+    parallel_records,
+    read_manifest,
+    stream_records,
+    write_fuzzy_index,
+)
+from .pgcopy import COPY_FORMATS
+from .parse import Candidate, DocumentCounts, closest_match, closest_matches
+from .positions import is_positional_query
+
+# the storage backend used by default, either `postgres` or `sqlite`
+GUTENSEARCH_BACKEND = os.getenv("GUTENSEARCH_BACKEND", "postgres")
+
+BACKENDS = {
+    "postgres",
+    "sqlite",
+}
+
+# the default location of the SQLite database file
+SQLITE_PATH = Path(
+    os.getenv(
+        "GUTENSEARCH_SQLITE", str(Path.home() / ".gutensearch" / "gutensearch.db")
+    )
+)
+
+# the SQLite equivalent of the `flat` layout in `schema.sql`
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS words (
+    word TEXT NOT NULL,
+    document_id INTEGER NOT NULL,
+    count INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS distinct_words (
+    word TEXT NOT NULL PRIMARY KEY
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS documents (
+    document_id INTEGER PRIMARY KEY,
+    digest TEXT NOT NULL,
+    size INTEGER NOT NULL
+);
+""".strip()
+
+# the same two indexes on the `words` table as the Postgres `flat` layout
+SQLITE_INDEXES = {
+    "idx_words_word": "words (word)",
+    "idx_words_id": "words (document_id)",
+}
+
+
+class Backend(ABC):
+    """
+    The interface shared by every storage backend. Every search returns
+    records with the `word`, `document_id` and `count` fields, in the
+    same order regardless of the backend.
+
+    Attributes:
+        fuzzy_index: The path to the fuzzy word matching index of the
+            database (see `gutensearch.fuzzy`), written by `write_fuzzy_index`
+            and used by fuzzy searches
+    """
+
+    fuzzy_index: Path
+
+    @abstractmethod
+    def query(
+        self, sql: str, params: Any = None, limit: Optional[int] = None
+    ) -> List[NamedTuple]:
+        """
+        Execute a read-only query and return the results.
+        See `gutensearch.database.query`.
+
+        Parameters:
+            sql: The SQL query to execute, in the backend's own dialect
+            params: Data to bind to parameters in the query
+            limit: Return only the first `n` records from the result
+
+        Returns:
+            A list of records where each record is an instance of a `NamedTuple`
+        """
+
+    @abstractmethod
+    def search_word(
+        self,
+        word: str,
+        fuzzy: bool = False,
+        limit: Optional[int] = None,
+        rank: Optional[str] = None,
+    ) -> List[NamedTuple]:
+        """
+        Search for every document with the given word (or SQL string pattern).
+        See `gutensearch.database.search_word`.
+        """
+
+    def search_words(
+        self, words: Sequence[str], fuzzy: bool = False, limit: Optional[int] = None
+    ) -> List[NamedTuple]:
+        """
+        Search for the documents of many words (or word patterns) at once.
+        See `gutensearch.database.search_words`. By default, each word
+        is searched for separately.
+        """
+        return [
+            TermRecord(w, *r)
+            for w in words
+            for r in self.search_word(w, fuzzy and not is_pattern(w), limit)
+        ]
+
+    @abstractmethod
+    def search_boolean(
+        self, query: str, limit: Optional[int] = None
+    ) -> List[NamedTuple]:
+        """
+        Search for every document matching a boolean query over several
+        words, such as `river AND fish NOT whale`.
+        See `gutensearch.database.search_boolean`.
+        """
+
+    @abstractmethod
+    def search_document(
+        self, id_: int, min_length: Optional[int] = None, limit: Optional[int] = None
+    ) -> List[NamedTuple]:
+        """
+        Search for every word in the given document.
+        See `gutensearch.database.search_document`.
+        """
+
+    @abstractmethod
+    def query_distinct_words(self, sort: bool = False) -> List[str]:
+        """
+        Retrieve a list of every distinct word.
+        See `gutensearch.database.query_distinct_words`.
+        """
+
+    @abstractmethod
+    def fuzzy_candidates(self, word: str, limit: int = 10) -> List[Candidate]:
+        """
+        Find the closest matching words to the given word.
+        See `gutensearch.database.fuzzy_candidates`.
+        """
+
+    @abstractmethod
+    def load(
+        self,
+        documents: Iterable[DocumentCounts],
+        stream: bool = False,
+        batch_size: int = BATCH_SIZE,
+        queue_size: int = QUEUE_SIZE,
+        files: Sequence[DocumentFile] = (),
+        document_ids: Optional[Sequence[int]] = None,
+    ) -> None:
+        """
+        Bulk load the word counts of the parsed documents, and
+        rebuild the distinct words and the indexes afterwards
+
+        Parameters:
+            documents: The parsed documents to load
+            stream: Write the documents in fixed-size batches while they are parsed
+            batch_size: The number of rows written at a time when streaming
+            queue_size: The maximum number of batches waiting to be written
+            files: The documents to add to the manifest of loaded documents
+            document_ids: The ids of the documents to load, known before they
+                are parsed, used to choose the bounds of range partitions
+                (defaults to the ids of `files`)
+        """
+
+    @abstractmethod
+    def manifest(self) -> Dict[int, Tuple[str, int]]:
+        """
+        Read the manifest of loaded documents.
+        See `gutensearch.load.read_manifest`.
+        """
+
+    @abstractmethod
+    def load_incremental(
+        self,
+        documents: Iterable[DocumentCounts],
+        plan: IncrementalPlan,
+        batch_size: int = BATCH_SIZE,
+        queue_size: int = QUEUE_SIZE,
+        analyze: bool = True,
+    ) -> None:
+        """
+        Load only the new or changed documents, replacing the rows of
+        the changed documents. See `gutensearch.load.incremental_records`.
+
+        Parameters:
+            documents: The parsed new or changed documents
+            plan: The documents to load, see `gutensearch.load.plan_incremental`
+            batch_size: The number of rows written at a time
+            queue_size: The maximum number of batches waiting to be written
+            analyze: Update the statistics of the tables once loaded
+        """
+
+    def has_positions(self) -> bool:
+        """
+        Check whether the positional index has been built (see
+        `gutensearch.positions`), in which case every load must parse the
+        positions of the documents to keep it up to date. By default,
+        backends have no positional index.
+        """
+        return False
+
+    @abstractmethod
+    def write_fuzzy_index(self, path: Path) -> None:
+        """
+        Build the fuzzy word matching index (see `gutensearch.fuzzy`)
+        from every distinct word
+
+        Parameters:
+            path: The path of the index file to write
+        """
+
+    @abstractmethod
+    def write_index(self, path: Path) -> None:
+        """
+        Build the embedded inverted index (see `gutensearch.index`)
+        from the word counts
+
+        Parameters:
+            path: The directory to save the index to
+        """
+
+    def close(self) -> None:
+        """
+        Release any connections held by the backend
+        """
+
+
+class PostgresBackend(Backend):
+    """
+    The project Postgres database, configured using the `POSTGRES_*`
+    environment variables (see `gutensearch.database.dbconfig`)
+
+    Parameters:
+        schema: The database layout to load into, see `gutensearch.database.SCHEMAS`
+        writers: The number of connections copying rows at once during a load
+        partitions: The number of partitions of the `words` table to create
+            before a load, if any (see `gutensearch.load.partition_words`)
+        partition_by: The partition key, one of `gutensearch.load.PARTITION_KEYS`
+        copy_format: The format rows are written in during a load,
+            one of `gutensearch.pgcopy.COPY_FORMATS`
+        rank: Build the ranking statistics during a load (see `gutensearch.rank`)
+        positions: Write the positional index during a load (see
+            `gutensearch.positions`), the documents must be parsed with
+            their positions
+        fuzzy_index: The path to the fuzzy word matching index
+
+    Raises:
+        ValueError: If parallel writers or partitions are requested
+            with a layout other than `flat`, or the format is unknown
+    """
+
+    def __init__(
+        self,
+        schema: str = database.GUTENSEARCH_SCHEMA,
+        writers: int = 1,
+        partitions: int = 0,
+        partition_by: str = "word",
+        copy_format: str = "text",
+        rank: bool = False,
+        positions: bool = False,
+        fuzzy_index: Path = FUZZY_INDEX_PATH,
+    ):
+        if schema != "flat" and (writers > 1 or partitions > 1):
+            raise ValueError(
+                f"Parallel writers and partitions need the flat layout, not: {schema}"
+            )
+        if partition_by not in PARTITION_KEYS:
+            raise ValueError(f"Unknown partition key: {partition_by}")
+        if copy_format not in COPY_FORMATS:
+            raise ValueError(f"Unknown COPY format: {copy_format}")
+
+        self.schema = schema
+        self.writers = writers
+        self.partitions = partitions
+        self.partition_by = partition_by
+        self.copy_format = copy_format
+        self.rank = rank
+        self.positions = positions
+        self.fuzzy_index = fuzzy_index
+
+    def query(
+        self, sql: str, params: Any = None, limit: Optional[int] = None
+    ) -> List[NamedTuple]:
+        return database.query(sql, params, limit)
+
+    def search_word(
+        self,
+        word: str,
+        fuzzy: bool = False,
+        limit: Optional[int] = None,
+        rank: Optional[str] = None,
+    ) -> List[NamedTuple]:
+        return database.search_word(word, fuzzy, limit, rank, self.fuzzy_index)
+
+    def search_words(
+        self, words: Sequence[str], fuzzy: bool = False, limit: Optional[int] = None
+    ) -> List[NamedTuple]:
+        return database.search_words(words, fuzzy, limit, self.fuzzy_index)
+
+    def search_boolean(
+        self, query: str, limit: Optional[int] = None
+    ) -> List[NamedTuple]:
+        return database.search_boolean(query, limit)
+
+    def search_document(
+        self, id_: int, min_length: Optional[int] = None, limit: Optional[int] = None
+    ) -> List[NamedTuple]:
+        return database.search_document(id_, min_length, limit)
+
+    def query_distinct_words(self, sort: bool = False) -> List[str]:
+        return database.query_distinct_words(sort)
+
+    def fuzzy_candidates(self, word: str, limit: int = 10) -> List[Candidate]:
+        return database.fuzzy_candidates(word, limit, self.fuzzy_index)
+
+    def load(
+        self,
+        documents: Iterable[DocumentCounts],
+        stream: bool = False,
+        batch_size: int = BATCH_SIZE,
+        queue_size: int = QUEUE_SIZE,
+        files: Sequence[DocumentFile] = (),
+        document_ids: Optional[Sequence[int]] = None,
+    ) -> None:
+        if self.writers > 1 or self.partitions > 1:
+            parallel_records(
+                lambda: psycopg2.connect(**database.dbconfig()),
+                documents,
+                self.writers,
+                batch_size,
+                queue_size,
+                files,
+                self.partitions,
+                self.partition_by,
+                self.copy_format,
+                self.rank,
+                self.positions,
+                document_ids,
+            )
+            return
+
+        # the connection is not used as a context manager, since
+        # that would wrap `VACUUM` in a transaction
+        con = psycopg2.connect(**database.dbconfig())
+        try:
+            if stream:
+                stream_records(
+                    con,
+                    documents,
+                    batch_size,
+                    queue_size,
+                    self.schema,
+                    files,
+                    self.copy_format,
+                    self.rank,
+                    self.positions,
+                )
+            else:
+                load_records(
+                    con,
+                    documents,
+                    self.schema,
+                    files,
+                    self.copy_format,
+                    self.rank,
+                    self.positions,
+                )
+        finally:
+            con.close()
+
+    def manifest(self) -> Dict[int, Tuple[str, int]]:
+        con = psycopg2.connect(**database.dbconfig())
+        try:
+            with con.cursor() as cur:
+                manifest = read_manifest(cur)
+            con.commit()
+        finally:
+            con.close()
+
+        return manifest
+
+    def load_incremental(
+        self,
+        documents: Iterable[DocumentCounts],
+        plan: IncrementalPlan,
+        batch_size: int = BATCH_SIZE,
+        queue_size: int = QUEUE_SIZE,
+        analyze: bool = True,
+    ) -> None:
+        con = psycopg2.connect(**database.dbconfig())
+        try:
+            incremental_records(
+                con,
+                documents,
+                plan,
+                batch_size,
+                queue_size,
+                self.schema,
+                analyze,
+                self.copy_format,
+                self.rank,
+                self.positions,
+            )
+        finally:
+            con.close()
+
+    def has_positions(self) -> bool:
+        con = psycopg2.connect(**database.dbconfig())
+        try:
+            with con.cursor() as cur:
+                exists = has_position_table(cur)
+            con.commit()
+        finally:
+            con.close()
+
+        return exists
+
+    def write_fuzzy_index(self, path: Path) -> None:
+        con = psycopg2.connect(**database.dbconfig())
+        try:
+            write_fuzzy_index(con, path, self.schema)
+        finally:
+            con.close()
+
+    def write_index(self, path: Path) -> None:
+        con = psycopg2.connect(**database.dbconfig())
+        try:
+            build_index(con, path, database.WORDS_TABLES[self.schema])
+        finally:
+            con.close()
+
+
+def namedtuple_factory(cur: sqlite3.Cursor, row: Tuple[Any, ...]) -> NamedTuple:
+    """
+    A `sqlite3` row factory that returns each row as a `NamedTuple`,
+    the same as psycopg2's `NamedTupleCursor`
+
+    Parameters:
+        cur: The cursor that fetched the row
+        row: The values of the row
+
+    Returns:
+        The row as an instance of a `NamedTuple`
+    """
+    fields = tuple(d[0] for d in cur.description)
+    return _record_type(fields)(*row)  # type: ignore
+
+
+@lru_cache(maxsize=None)
+def _record_type(fields: Tuple[str, ...]) -> Any:
+    return namedtuple("Record", fields, rename=True)
+
+
+def _limit(limit: Optional[int]) -> int:
+    # a negative `LIMIT` means no limit in SQLite
+    return -1 if limit is None else limit
+
+
+def _rows(documents: Iterable[DocumentCounts]) -> Iterator[Tuple[str, int, int]]:
+    for doc in documents:
+        METRICS.count(doc)
+        for word, count in zip(doc.words, doc.counts):
+            yield word, doc.document_id, count
+
+
+class SQLiteBackend(Backend):
+    """
+    A single SQLite database file, using the same `flat` layout and
+    indexes as the Postgres database. The database is opened in WAL mode,
+    so searches are never blocked by a load that is still in progress.
+
+    Parameters:
+        path: The path to the database file, which is created if needed
+        schema: The database layout, only `flat` is supported
+        read_only: Only search an existing database file, never create one
+        fuzzy_index: The path to the fuzzy word matching index, which is kept
+            next to the database file by default, e.g. `gutensearch.fuzzy.idx`
+
+    Raises:
+        ValueError: If a layout other than `flat` is requested
+    """
+
+    def __init__(
+        self,
+        path: Path = SQLITE_PATH,
+        schema: str = "flat",
+        read_only: bool = False,
+        fuzzy_index: Optional[Path] = None,
+    ):
+        if schema != "flat":
+            raise ValueError(
+                f"The sqlite backend only supports the flat layout, not: {schema}"
+            )
+
+        self.path = path
+        self.read_only = read_only
+        self.fuzzy_index = fuzzy_index or path.with_name(f"{path.stem}.fuzzy.idx")
+        self._con: Optional[sqlite3.Connection] = None
+
+    @property
+    def con(self) -> sqlite3.Connection:
+        """
+        The connection to the database file, opened on first use
+        and then reused by every subsequent query
+
+        Raises:
+            sqlite3.OperationalError: If the database is opened read-only
+                and the file does not exist
+        """
+        if self._con is None and self.read_only:
+            # `mode=rw` never creates the file, unlike a plain connect
+            uri = f"{self.path.resolve().as_uri()}?mode=rw"
+            try:
+                con = sqlite3.connect(uri, uri=True, isolation_level=None)
+            except sqlite3.OperationalError as e:
+                raise sqlite3.OperationalError(
+                    f"Unable to open the sqlite database: {self.path} ({e})"
+                ) from e
+            con.row_factory = namedtuple_factory
+            con.execute("PRAGMA case_sensitive_like = ON")
+            self._con = con
+
+        if self._con is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # transactions are managed explicitly, see `load`
+            con = sqlite3.connect(self.path, isolation_level=None)
+            con.row_factory = namedtuple_factory
+            con.execute("PRAGMA journal_mode = WAL")
+            # let the `word` indexes serve prefix patterns such as fish%
+            con.execute("PRAGMA case_sensitive_like = ON")
+            con.executescript(SQLITE_SCHEMA)
+            self._con = con
+
+        return self._con
+
+    def query(
+        self, sql: str, params: Any = None, limit: Optional[int] = None
+    ) -> List[NamedTuple]:
+        cur = self.con.execute(sql, params or ())
+        try:
+            if limit is not None:
+                return cur.fetchmany(limit)
+            return cur.fetchall()
+        finally:
+            cur.close()
+
+    def search_word(
+        self,
+        word: str,
+        fuzzy: bool = False,
+        limit: Optional[int] = None,
+        rank: Optional[str] = None,
+    ) -> List[NamedTuple]:
+        if rank is not None:
+            raise ValueError("Ranked search is only supported by postgres")
+
+        if is_positional_query(word):
+            raise ValueError("Phrase and NEAR queries are only supported by postgres")
+
+        if is_boolean_query(word):
+            if fuzzy:
+                raise ValueError(
+                    "Cannot search a boolean query using fuzzy word matching"
+                )
+            return self.search_boolean(word, limit)
+
+        has_pattern = is_pattern(word)
+        if has_pattern and fuzzy:
+            raise ValueError(
+                "Cannot search using both a pattern and fuzzy word matching"
+            )
+
+        if has_pattern:
+            # resolve the pattern against the distinct words first,
+            # with the same escape character as Postgres
+            sql = """
+            SELECT word,
+                   document_id,
+                   count
+              FROM words
+             WHERE word IN (
+                   SELECT word
+                     FROM distinct_words
+                    WHERE word LIKE :pattern ESCAPE '\\'
+                   )
+             ORDER BY 3 DESC
+             LIMIT :limit
+            """.strip()
+            return self.query(sql, {"pattern": word, "limit": _limit(limit)})
+
+        if fuzzy:
+            index = load_fuzzy_index(self.fuzzy_index)
+            candidates = [] if index is None else index.lookup(word, limit=1)
+            if len(candidates) > 0:
+                word = candidates[0].word
+            else:
+                word = closest_match(word, self.query_distinct_words())
+
+        sql = """
+        SELECT word,
+               document_id,
+               count
+          FROM words
+         WHERE word = :word
+         ORDER BY 3 DESC
+         LIMIT :limit
+        """.strip()
+        return self.query(sql, {"word": word, "limit": _limit(limit)})
+
+    def search_boolean(
+        self, query: str, limit: Optional[int] = None
+    ) -> List[NamedTuple]:
+        def term_sql(word: str, param: str) -> str:
+            if is_pattern(word):
+                return f"""
+                SELECT document_id,
+                       SUM(count) AS count
+                  FROM words
+                 WHERE word IN (
+                       SELECT word
+                         FROM distinct_words
+                        WHERE word LIKE :{param} ESCAPE '\\'
+                       )
+                 GROUP BY document_id
+                """.strip()
+
+            return f"SELECT document_id, count FROM words WHERE word = :{param}"
+
+        sql, params = boolean_sql(query, term_sql, lambda name: f":{name}")
+        params["limit"] = _limit(limit)
+        return self.query(sql, params)
+
+    def search_document(
+        self, id_: int, min_length: Optional[int] = None, limit: Optional[int] = None
+    ) -> List[NamedTuple]:
+        sql = """
+        SELECT word,
+               document_id,
+               count
+          FROM words
+         WHERE document_id = :id
+           AND LENGTH(word) >= :min_length
+         ORDER BY 3 DESC
+         LIMIT :limit
+        """.strip()
+        params = {"id": int(id_), "min_length": min_length or 0, "limit": _limit(limit)}
+        return self.query(sql, params)
+
+    def query_distinct_words(self, sort: bool = False) -> List[str]:
+        sql = "SELECT word FROM distinct_words"
+        # the primary key already keeps the words sorted
+        if sort:
+            sql = f"{sql} ORDER BY word"
+
+        return [r.word for r in self.query(sql)]  # type: ignore
+
+    def fuzzy_candidates(self, word: str, limit: int = 10) -> List[Candidate]:
+        index = load_fuzzy_index(self.fuzzy_index)
+        if index is not None:
+            candidates = index.lookup(word, limit)
+            if len(candidates) > 0:
+                return candidates
+
+        return closest_matches(word, self.query_distinct_words(), limit)
+
+    def load(
+        self,
+        documents: Iterable[DocumentCounts],
+        stream: bool = False,
+        batch_size: int = BATCH_SIZE,
+        queue_size: int = QUEUE_SIZE,
+        files: Sequence[DocumentFile] = (),
+        document_ids: Optional[Sequence[int]] = None,
+    ) -> None:
+        # the rows are always inserted while the documents are being
+        # parsed, since `executemany` consumes them one at a time
+        self._write(documents, files, replaced=[], rebuild=True)
+
+    def manifest(self) -> Dict[int, Tuple[str, int]]:
+        records = self.query("SELECT document_id, digest, size FROM documents")
+        return {r.document_id: (r.digest, r.size) for r in records}  # type: ignore
+
+    def load_incremental(
+        self,
+        documents: Iterable[DocumentCounts],
+        plan: IncrementalPlan,
+        batch_size: int = BATCH_SIZE,
+        queue_size: int = QUEUE_SIZE,
+        analyze: bool = True,
+    ) -> None:
+        self._write(documents, plan.files, plan.replaced, plan.rebuild, analyze)
+
+    def _write(
+        self,
+        documents: Iterable[DocumentCounts],
+        files: Sequence[DocumentFile],
+        replaced: List[int],
+        rebuild: bool,
+        analyze: bool = True,
+    ) -> None:
+        log = logging.getLogger("gutensearch.load")
+        con = self.con
+
+        # write the entire load in a single transaction
+        con.execute("PRAGMA synchronous = NORMAL")
+        con.execute("BEGIN")
+        try:
+            if len(replaced) > 0:
+                log.info(f"Deleting rows of {len(replaced)} changed documents")
+                with phase("delete"):
+                    con.executemany(
+                        "DELETE FROM words WHERE document_id = ?",
+                        [(i,) for i in replaced],
+                    )
+
+            if rebuild:
+                log.info("Temporarily dropping indexes on table: words")
+                with phase("index"):
+                    for name in SQLITE_INDEXES:
+                        con.execute(f"DROP INDEX IF EXISTS {name}")
+
+            # every new row is given a larger rowid than the existing rows
+            last = con.execute("SELECT COALESCE(MAX(rowid), 0) AS rowid FROM words")
+            rowid = last.fetchone().rowid
+
+            log.info("Writing results to database")
+            # documents parsed while inserting are counted in the parse phase
+            with phase("copy"):
+                cur = con.executemany(
+                    "INSERT INTO words (word, document_id, count) VALUES (?, ?, ?)",
+                    _rows(documents),
+                )
+            log.info(f"Finished writing {cur.rowcount} rows to database")
+
+            log.info("Writing new distinct words to database")
+            with phase("distinct_words"):
+                con.execute(
+                    """
+                    INSERT OR IGNORE INTO distinct_words
+                    SELECT DISTINCT word FROM words WHERE rowid > ?
+                    """,
+                    (rowid,),
+                )
+
+            if rebuild:
+                log.info("Recreating indexes on table: words")
+                with phase("index"):
+                    for name, columns in SQLITE_INDEXES.items():
+                        con.execute(f"CREATE INDEX {name} ON {columns}")
+
+            log.info("Updating manifest of loaded documents")
+            with phase("manifest"):
+                con.executemany(
+                    "INSERT OR REPLACE INTO documents VALUES (?, ?, ?)",
+                    [(f.document_id, f.digest, f.size) for f in files],
+                )
+
+            log.info("Committing changes to database")
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+
+        if analyze:
+            log.info("Running analyze on table: words")
+            # SQLite only needs `ANALYZE`, but it is reported as `vacuum`
+            with phase("vacuum"):
+                con.execute("ANALYZE words")
+
+    def write_fuzzy_index(self, path: Path) -> None:
+        log = logging.getLogger("gutensearch.load")
+        log.info(f"Building fuzzy word matching index: {path}")
+
+        with phase("fuzzy_index"):
+            cur = self.con.execute("SELECT word FROM distinct_words")
+            build_fuzzy_index((r.word for r in cur), path)
+            cur.close()
+
+        log.info("Finished building fuzzy word matching index")
+
+    def write_index(self, path: Path) -> None:
+        build_index(self.con, path, "words")
+
+    def close(self) -> None:
+        if self._con is not None:
+            self._con.close()
+            self._con = None
+
+
+def get_backend(
+    name: str = GUTENSEARCH_BACKEND,
+    schema: str = database.GUTENSEARCH_SCHEMA,
+    writers: int = 1,
+    partitions: int = 0,
+    partition_by: str = "word",
+    copy_format: str = "text",
+    rank: bool = False,
+    positions: bool = False,
+    read_only: bool = False,
+    fuzzy_index: Optional[Path] = None,
+) -> Backend:
+    """
+    Create the storage backend with the given name
+
+    Parameters:
+        name: One of the `BACKENDS`
+        schema: The database layout, see `gutensearch.database.SCHEMAS`
+        writers: The number of connections copying rows at once during a load
+        partitions: The number of partitions of the `words` table, if any
+        partition_by: The partition key, one of `gutensearch.load.PARTITION_KEYS`
+        copy_format: The format rows are written to postgres in,
+            one of `gutensearch.pgcopy.COPY_FORMATS`
+        rank: Build the ranking statistics during a load (see `gutensearch.rank`)
+        positions: Write the positional index during a load (see
+            `gutensearch.positions`)
+        read_only: Only search an existing database, used by the search
+            commands so that a mistyped sqlite path is never created
+        fuzzy_index: The path to the fuzzy word matching index, which
+            defaults to a separate file for each backend
+
+    Returns:
+        The storage backend
+
+    Raises:
+        ValueError: If the backend does not exist, or does not
+            support the requested options
+    """
+    if name == "postgres":
+        return PostgresBackend(
+            schema,
+            writers,
+            partitions,
+            partition_by,
+            copy_format,
+            rank,
+            positions,
+            fuzzy_index or FUZZY_INDEX_PATH,
+        )
+
+    if name == "sqlite":
+        if writers > 1 or partitions > 1 or copy_format != "text" or rank or positions:
+            raise ValueError(
+                "Parallel writers, partitions, binary COPY, ranking statistics "
+                "and the positional index are only supported by postgres"
+            )
+        return SQLiteBackend(SQLITE_PATH, schema, read_only, fuzzy_index)
+
+    raise ValueError(f"Unknown storage backend: {name}")
@@ -0,0 +1,267 @@
+"""
+This module parses boolean queries over several words, such as
+`river AND fish NOT whale` or `(whale OR fish%) AND sea`, and compiles
+them into a single SQL statement returning every matching document
+along with the combined count of the words searched for.
+
+A query is made of words (or SQL string patterns such as `fish%`),
+combined with the operators `AND`, `OR` and `NOT` (which must be upper
+case, so the words "and", "or" and "not" can still be searched for)
+and grouped with parentheses. `NOT` binds tightest, then `AND`, then
+`OR`, and words next to each other without an operator are combined
+with `AND`, so `river fish NOT whale` is the same as
+`river AND fish AND NOT whale`.
+
+Each word is compiled to its posting list (the `document_id` and `count`
+of every document it occurs in), read using the index on `words`.
+`AND` joins the posting lists on `document_id`, so the database can
+intersect them starting from the rarest one (the statistics gathered by
+`ANALYZE` after every load tell the planner how common each word is),
+`NOT` excludes documents using an anti-join, and `OR` merges the
+posting lists. The whole query, including the final ordering and limit,
+runs as a single statement.
+"""
+
+import re
+from itertools import count
+from typing import Any, Callable, Dict, NamedTuple, Tuple, Union
+
+OPERATORS = {
+    "AND",
+    "OR",
+    "NOT",
+}
+
+# parentheses, and runs of anything but whitespace and parentheses
+TOKEN_PATTERN = re.compile(r"[()]|[^\s()]+")
+
+
+class Term(NamedTuple):
+    """
+    A single word (or SQL string pattern) of a query
+    """
+
+    word: str
+
+
+class And(NamedTuple):
+    """
+    The documents matching every one of the `children`
+    """
+
+    children: Tuple["Node", ...]
+
+
+class Or(NamedTuple):
+    """
+    The documents matching any of the `children`
+    """
+
+    children: Tuple["Node", ...]
+
+
+class Not(NamedTuple):
+    """
+    The documents not matching the `child`, which can only be used
+    within an `And` along with at least one other query
+    """
+
+    child: "Node"
+
+
+Node = Union[Term, And, Or, Not]
+
+
+def is_boolean_query(text: str) -> bool:
+    """
+    Check whether a search is a boolean query rather than a single word
+    (or word pattern), i.e. whether it holds whitespace or parentheses
+
+    Parameters:
+        text: The search
+
+    Returns:
+        `True` if the search must be parsed using `parse_query`
+    """
+    return any(c.isspace() or c in "()" for c in text.strip())
+
+
+def parse_query(text: str) -> Node:
+    """
+    Parse a boolean query, such as `river AND fish NOT whale`
+
+    Parameters:
+        text: The query
+
+    Returns:
+        The parsed query, where every `And` and `Or` has at least two children
+
+    Raises:
+        ValueError: If the query is empty, or is not well formed
+    """
+    tokens = TOKEN_PATTERN.findall(text)
+    if len(tokens) == 0:
+        raise ValueError("Cannot search using an empty query")
+
+    position = 0
+
+    def peek() -> str:
+        return tokens[position] if position < len(tokens) else ""
+
+    def take(expected: str = "") -> str:
+        nonlocal position
+        token = peek()
+        if token == "" or (expected and token != expected):
+            found = f"'{token}'" if token else "the end of the query"
+            raise ValueError(f"Expected {expected or 'a word'}, found {found}: {text}")
+        position += 1
+        return token
+
+    def parse_or() -> Node:
+        children = [parse_and()]
+        while peek() == "OR":
+            take("OR")
+            children.append(parse_and())
+        return children[0] if len(children) == 1 else Or(tuple(children))
+
+    def parse_and() -> Node:
+        children = [parse_unary()]
+        # words next to each other are implicitly combined with `AND`
+        while peek() not in ("", ")", "OR"):
+            if peek() == "AND":
+                take("AND")
+            children.append(parse_unary())
+        return children[0] if len(children) == 1 else And(tuple(children))
+
+    def parse_unary() -> Node:
+        token = peek()
+        if token == "NOT":
+            take("NOT")
+            return Not(parse_unary())
+        if token == "(":
+            take("(")
+            node = parse_or()
+            take(")")
+            return node
+        if token in OPERATORS or token == ")":
+            raise ValueError(f"Expected a word, found '{token}': {text}")
+        return Term(take())
+
+    node = parse_or()
+    if position < len(tokens):
+        raise ValueError(f"Unexpected '{peek()}': {text}")
+
+    return node
+
+
+def compile_query(
+    node: Node, term_sql: Callable[[str, str], str]
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Compile a parsed query into a single SQL query selecting the
+    `document_id` and combined `count` of every matching document. The
+    counts of the words under `NOT` are never included. The SQL dialect
+    is given by the function building the posting list of a single word.
+
+    Parameters:
+        node: The parsed query
+        term_sql: A function given a word (or word pattern) and the name of
+            the parameter holding it, returning the SQL selecting the
+            `document_id` and `count` of every document it occurs in
+            (with a single row per document)
+
+    Returns:
+        The SQL, and the parameters to bind to it
+
+    Raises:
+        ValueError: If some part of the query only excludes documents,
+            e.g. `NOT whale` or `fish OR NOT whale`
+    """
+    params: Dict[str, Any] = {}
+    names = count()
+
+    def compile_node(node: Node) -> str:
+        if isinstance(node, Term):
+            param = f"term_{next(names)}"
+            params[param] = node.word
+            return term_sql(node.word, param)
+
+        if isinstance(node, Not):
+            raise ValueError("NOT must be combined with a word using AND, e.g. a NOT b")
+
+        if isinstance(node, Or):
+            branches = "\nUNION ALL\n".join(compile_node(c) for c in node.children)
+            return f"""
+            SELECT document_id,
+                   SUM(count) AS count
+              FROM ({branches}) AS o
+             GROUP BY document_id
+            """.strip()
+
+        positive = [c for c in node.children if not isinstance(c, Not)]
+        negative = [c.child for c in node.children if isinstance(c, Not)]
+        if len(positive) == 0:
+            raise ValueError("NOT must be combined with a word using AND, e.g. a NOT b")
+
+        aliases = [f"a{next(names)}" for _ in positive]
+        first = aliases[0]
+
+        joins = [f"({compile_node(positive[0])}) AS {first}"]
+        for alias, child in zip(aliases[1:], positive[1:]):
+            joins.append(
+                f"JOIN ({compile_node(child)}) AS {alias} "
+                f"ON {alias}.document_id = {first}.document_id"
+            )
+
+        excluded = []
+        for negated in negative:
+            alias = f"n{next(names)}"
+            excluded.append(
+                f"NOT EXISTS (SELECT 1 FROM ({compile_node(negated)}) AS {alias} "
+                f"WHERE {alias}.document_id = {first}.document_id)"
+            )
+
+        total = " + ".join(f"{a}.count" for a in aliases)
+        sql = f"SELECT {first}.document_id, {total} AS count\nFROM " + "\n".join(joins)
+        if len(excluded) > 0:
+            sql = f"{sql}\nWHERE " + "\n AND ".join(excluded)
+        return sql
+
+    return compile_node(node), params
+
+
+def boolean_sql(
+    text: str,
+    term_sql: Callable[[str, str], str],
+    placeholder: Callable[[str], str],
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Parse and compile a boolean query (see `compile_query`) into a single
+    SQL query selecting the query itself as the `word`, and the
+    `document_id` and combined `count` of every matching document, ordered
+    by the highest `count`, with a `limit` parameter bound by the caller
+
+    Parameters:
+        text: The query
+        term_sql: The SQL selecting the posting list of a single word,
+            see `compile_query`
+        placeholder: A function given the name of a parameter, returning its
+            placeholder in the SQL, e.g. `%(name)s`
+
+    Returns:
+        The SQL, and the parameters to bind to it (other than `limit`)
+
+    Raises:
+        ValueError: If the query is not well formed
+    """
+    sql, params = compile_query(parse_query(text), term_sql)
+    params["query"] = text
+    sql = f"""
+    SELECT {placeholder("query")} AS word,
+           r.document_id,
+           r.count
+      FROM ({sql}) AS r
+     ORDER BY r.count DESC, r.document_id
+     LIMIT {placeholder("limit")}
+    """.strip()
+    return sql, params
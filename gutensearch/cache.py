@@ -0,0 +1,367 @@
+"""
+This module provides a cache for the results of searches, so that
+repeated searches for popular words and documents do not have to go
+to the database every time. Results are kept in an in-process LRU
+cache, and optionally in an on-disk store (a SQLite file) that can be
+shared by every process on the same machine.
+
+Every entry is tagged with the __load generation__ of the database,
+a counter that is incremented by `gutensearch load` whenever new
+documents are committed. Once the generation changes, every entry
+cached before it is discarded, so searches never return stale results
+for longer than the interval between two generation checks.
+
+Every key also holds the __namespace__ of the database (its location and
+layout), so that processes searching different databases can share the
+same on-disk store, and the arguments of each search are normalized to
+their annotated types, so that e.g. `search_document("123")` and
+`search_document(123)` share the same entry.
+"""
+
+import os
+import time
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict, namedtuple
+from functools import lru_cache, wraps
+from inspect import signature
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Hashable,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+    get_type_hints,
+)
+
+# the maximum number of search results kept in memory (0 disables the cache)
+GUTENSEARCH_CACHE_SIZE = int(os.getenv("GUTENSEARCH_CACHE_SIZE", "1024"))
+
+# the path to the shared on-disk store (disabled unless set)
+GUTENSEARCH_CACHE_PATH = os.getenv("GUTENSEARCH_CACHE_PATH")
+
+# the maximum number of search results kept in the on-disk store
+GUTENSEARCH_CACHE_DISK_SIZE = int(os.getenv("GUTENSEARCH_CACHE_DISK_SIZE", "100000"))
+
+# the number of seconds between two checks of the load generation
+GUTENSEARCH_CACHE_CHECK_INTERVAL = float(
+    os.getenv("GUTENSEARCH_CACHE_CHECK_INTERVAL", "5")
+)
+
+# keys must be pickled the same way by every process sharing the store
+PICKLE_PROTOCOL = 4
+
+DISK_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    key BLOB NOT NULL PRIMARY KEY,
+    generation INTEGER NOT NULL,
+    value BLOB NOT NULL
+)
+""".strip()
+
+# the arguments annotated with one of these types (or `Optional` ones)
+# are converted to it before the lookup
+NORMALIZED_TYPES = (int, float, str, Path)
+
+F = TypeVar("F", bound=Callable[..., List[Any]])
+
+
+class CacheStats(NamedTuple):
+    """
+    Counters describing the effectiveness of a `QueryCache`
+
+    Parameters:
+        hits: The number of searches answered by the cache
+        disk_hits: The number of hits answered by the on-disk store
+        misses: The number of searches that went to the database
+        evictions: The number of results dropped to make room for new ones
+        invalidations: The number of times the load generation changed
+        size: The number of results currently kept in memory
+    """
+
+    hits: int
+    disk_hits: int
+    misses: int
+    evictions: int
+    invalidations: int
+    size: int
+
+
+@lru_cache(maxsize=None)
+def record_type(fields: Tuple[str, ...]) -> Any:
+    """
+    The `NamedTuple` type used for records restored from the on-disk store
+
+    Parameters:
+        fields: The names of the fields of the record
+
+    Returns:
+        The record type
+    """
+    return namedtuple("Record", fields, rename=True)
+
+
+def normalize(value: Any, annotation: Any) -> Any:
+    """
+    Convert an argument of a search to its annotated type, if it is one of
+    `NORMALIZED_TYPES`, so that equivalent searches share a cache key
+
+    Parameters:
+        value: The argument
+        annotation: The annotated type of the parameter
+
+    Returns:
+        The converted argument, or the argument itself if it cannot be converted
+    """
+    if value is None:
+        return None
+
+    if getattr(annotation, "__origin__", None) is Union:
+        types = [t for t in annotation.__args__ if t is not type(None)]
+        if len(types) == 1:
+            annotation = types[0]
+
+    if annotation not in NORMALIZED_TYPES or isinstance(value, annotation):
+        return value
+
+    try:
+        return annotation(value)
+    except (TypeError, ValueError):
+        return value
+
+
+class QueryCache:
+    """
+    A thread-safe LRU cache of search results, invalidated whenever the
+    load generation of the database changes.
+
+    Parameters:
+        generation: A function returning the current load generation
+        namespace: A function identifying the database currently searched
+        size: The maximum number of results kept in memory
+        path: The path to the shared on-disk store, if any
+        disk_size: The maximum number of results kept in the on-disk store
+        check_interval: The number of seconds between two generation checks
+    """
+
+    def __init__(
+        self,
+        generation: Callable[[], int],
+        namespace: Callable[[], Hashable] = lambda: None,
+        size: int = GUTENSEARCH_CACHE_SIZE,
+        path: Optional[str] = GUTENSEARCH_CACHE_PATH,
+        disk_size: int = GUTENSEARCH_CACHE_DISK_SIZE,
+        check_interval: float = GUTENSEARCH_CACHE_CHECK_INTERVAL,
+    ):
+        self.generation = generation
+        self.namespace = namespace
+        self.size = size
+        self.path = path
+        self.disk_size = disk_size
+        self.check_interval = check_interval
+
+        self.entries: "OrderedDict[Hashable, List[Any]]" = OrderedDict()
+        self.lock = threading.RLock()
+        self.current: Optional[int] = None
+        self.current_namespace: Hashable = None
+        self.checked = 0.0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        self._disk: Optional[sqlite3.Connection] = None
+        self._pid = os.getpid()
+
+    @property
+    def disk(self) -> Optional[sqlite3.Connection]:
+        """
+        The connection to the on-disk store, opened on first use
+        """
+        if self.path is None:
+            return None
+
+        if self._disk is None or self._pid != os.getpid():
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            con = sqlite3.connect(
+                self.path, timeout=10, isolation_level=None, check_same_thread=False
+            )
+            con.execute("PRAGMA journal_mode = WAL")
+            con.execute(DISK_SCHEMA)
+            self._disk, self._pid = con, os.getpid()
+
+        return self._disk
+
+    def check_generation(self) -> int:
+        """
+        Look up the load generation (at most once per `check_interval`)
+        and discard every cached result if it has changed
+
+        Returns:
+            The current load generation
+        """
+        now = time.monotonic()
+        namespace = self.namespace()
+        with self.lock:
+            # the entries of another database are keyed apart, but its
+            # generation must be looked up before any of them are used
+            if namespace != self.current_namespace:
+                self.current, self.current_namespace = None, namespace
+            if self.current is not None and now - self.checked < self.check_interval:
+                return self.current
+
+            generation = self.generation()
+            if self.current is not None and generation != self.current:
+                self.invalidations += 1
+                self.entries.clear()
+                if self.disk is not None:
+                    self.disk.execute(
+                        "DELETE FROM cache WHERE generation != ?", (generation,)
+                    )
+
+            self.current, self.checked = generation, now
+            return generation
+
+    def get(self, key: Hashable, compute: Callable[[], List[Any]]) -> List[Any]:
+        """
+        Look up the results for the given key, or compute (and cache) them
+
+        Parameters:
+            key: The normalized search and its arguments
+            compute: The function performing the search on a miss
+
+        Returns:
+            The results of the search
+        """
+        if self.size <= 0:
+            return compute()
+
+        generation = self.check_generation()
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return list(self.entries[key])
+
+        results = self._load(key, generation)
+        if results is not None:
+            with self.lock:
+                self.hits += 1
+                self.disk_hits += 1
+            self._put(key, results)
+            return list(results)
+
+        results = compute()
+        with self.lock:
+            self.misses += 1
+        self._put(key, results)
+        self._store(key, generation, results)
+
+        return list(results)
+
+    def _put(self, key: Hashable, results: List[Any]) -> None:
+        with self.lock:
+            self.entries[key] = results
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def _load(self, key: Hashable, generation: int) -> Optional[List[Any]]:
+        if self.disk is None:
+            return None
+
+        with self.lock:
+            row = self.disk.execute(
+                "SELECT value FROM cache WHERE key = ? AND generation = ?",
+                (pickle.dumps(key, PICKLE_PROTOCOL), generation),
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        value: Tuple[Optional[Tuple[str, ...]], List[Any]] = pickle.loads(row[0])
+        fields, rows = value
+        if fields is None:
+            return rows
+        return [record_type(fields)(*r) for r in rows]
+
+    def _store(self, key: Hashable, generation: int, results: List[Any]) -> None:
+        if self.disk is None:
+            return
+
+        # the records are stored as plain tuples, since the record
+        # types created by the database driver cannot be pickled
+        fields = tuple(results[0]._fields) if len(results) > 0 else None
+        value = pickle.dumps((fields, [tuple(r) for r in results]), PICKLE_PROTOCOL)
+        with self.lock:
+            self.disk.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?)",
+                (pickle.dumps(key, PICKLE_PROTOCOL), generation, value),
+            )
+            # every write is given the next rowid, so the oldest entries go first
+            self.disk.execute(
+                "DELETE FROM cache WHERE rowid <= (SELECT MAX(rowid) FROM cache) - ?",
+                (self.disk_size,),
+            )
+
+    def cached(self, func: F) -> F:
+        """
+        Decorate a search function so its results are cached, keyed on the
+        namespace of the database, the name of the function and every
+        argument (including defaults), normalized to its annotated type
+
+        Parameters:
+            func: The search function
+
+        Returns:
+            The decorated function
+        """
+        sig = signature(func)
+        hints = get_type_hints(func)
+
+        @wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> List[Any]:
+            bound = sig.bind(*args, **kwargs)
+            bound.apply_defaults()
+            for name, value in bound.arguments.items():
+                bound.arguments[name] = normalize(value, hints.get(name))
+
+            key = (self.namespace(), func.__name__, *bound.arguments.values())
+            return self.get(key, lambda: func(*bound.args, **bound.kwargs))
+
+        return wrapper  # type: ignore
+
+    def stats(self) -> CacheStats:
+        """
+        The hit, miss and eviction counters of the cache
+
+        Returns:
+            The counters
+        """
+        with self.lock:
+            return CacheStats(
+                self.hits,
+                self.disk_hits,
+                self.misses,
+                self.evictions,
+                self.invalidations,
+                len(self.entries),
+            )
+
+    def clear(self) -> None:
+        """
+        Discard every cached result, in memory and on disk
+        """
+        with self.lock:
+            self.entries.clear()
+            if self.disk is not None:
+                self.disk.execute("DELETE FROM cache")
@@ -1,20 +1,54 @@
 import sys
-import os
 import json
 import logging
+import sqlite3
 from pathlib import Path
 from argparse import ArgumentParser, Namespace
 from multiprocessing import cpu_count, Pool
-from itertools import chain
-from io import StringIO
+from functools import partial
+from contextlib import nullcontext
 from pprint import pprint
-from typing import List, Union
+from itertools import groupby, islice
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence
 
 import psycopg2  # type: ignore
 
-from .download import download_gutenberg_documents
-from .parse import parse_gutenberg_index, parse_document
-from .database import dbconfig, search_word, search_document
+from .backend import BACKENDS, GUTENSEARCH_BACKEND, Backend, get_backend
+from .boolean import is_boolean_query
+from .download import (
+    CONCURRENCY,
+    GUTENSEARCH_MIRROR,
+    RATE,
+    RETRIES,
+    Downloader,
+    download_gutenberg_documents,
+)
+from .ingest import COMMIT_SIZE, ingest
+from .parse import parse_gutenberg_index, parse_document_counts, document_id, TOKENIZERS
+from .shard import SHARD_SIZE, load_shards, parse_to_shards
+from .pgcopy import COPY_FORMATS
+from .positions import is_positional_query
+from .rank import RANKINGS
+from .database import (
+    CACHE,
+    GUTENSEARCH_SCHEMA,
+    SCHEMAS,
+    STATS,
+)
+from .metrics import METRICS, TimedParse, profiled, write_prometheus
+from .index import INDEX_PATH, InvertedIndex
+from .load import (
+    BATCH_SIZE,
+    PARTITION_KEYS,
+    QUEUE_SIZE,
+    REBUILD_RATIO,
+    ScannedParse,
+    find_documents,
+    parse_documents,
+    plan_incremental,
+    record_scanned,
+    scan_documents,
+)
 
 logging.basicConfig(
     format="%(asctime)s [%(levelname)s] %(name)s - %(message)s",
@@ -38,6 +72,14 @@ OUTPUT_CHOICES = {
     "json",
 }
 
+QUERY_STATS_FORMATS = {
+    "json",
+    "prometheus",
+}
+
+# default number of words searched for at a time with `word --from-file`
+WORDS_BATCH_SIZE = 1000
+
 
 def make_parser() -> ArgumentParser:
     """
@@ -65,11 +107,34 @@ def make_parser() -> ArgumentParser:
         type=int,
         default=None,
     )
+    parser_download.add_argument(
+        "--concurrency",
+        help="The number of documents fetched concurrently",
+        type=int,
+        default=CONCURRENCY,
+    )
+    parser_download.add_argument(
+        "--rate",
+        help="The maximum number of requests per second sent to the mirror",
+        type=float,
+        default=RATE,
+    )
     parser_download.add_argument(
         "--delay",
-        help="Number of seconds to delay between requests",
+        help="Number of seconds to delay between requests (overrides --rate)",
+        type=float,
+        default=None,
+    )
+    parser_download.add_argument(
+        "--retries",
+        help="The number of times a failed request is retried",
         type=int,
-        default=2,
+        default=RETRIES,
+    )
+    parser_download.add_argument(
+        "--mirror",
+        help="The base URL of the Project Gutenberg mirror to download from",
+        default=GUTENSEARCH_MIRROR,
     )
     parser_download.add_argument(
         "--log-level",
@@ -96,6 +161,55 @@ def make_parser() -> ArgumentParser:
         default=False,
     )
 
+    # subparser for parsing documents into shards
+    parser_parse = subparser.add_parser(
+        "parse",
+        help="Parse the word counts from documents into shards, to be loaded later",
+    )
+    parser_parse.add_argument(
+        "--path",
+        help="The path to the directory containing the documents",
+        default=Path("data"),
+        type=Path,
+    )
+    parser_parse.add_argument(
+        "--shards",
+        help="The path to the directory to write the shards to",
+        default=Path("shards"),
+        type=Path,
+    )
+    parser_parse.add_argument(
+        "--limit",
+        help="Only parse a limited number of documents",
+        type=int,
+        default=None,
+    )
+    parser_parse.add_argument(
+        "--multiprocessing",
+        help="Parse in parallel using multiple cores, each writing its own shards",
+        action="store_true",
+        default=False,
+    )
+    parser_parse.add_argument(
+        "--tokenizer",
+        help="The tokenizer engine used to parse each document",
+        choices=TOKENIZERS,
+        default="chunked",
+    )
+    parser_parse.add_argument(
+        "--shard-size",
+        help="The number of documents written to a single shard",
+        type=int,
+        default=SHARD_SIZE,
+    )
+    parser_parse.add_argument(
+        "--log-level",
+        help="Set the level for the logger",
+        choices=LOG_LEVEL_CHOICES.keys(),
+        default="info",
+    )
+    parser_parse.set_defaults(__parse=True)
+
     # subparser for parsing/loading data into the db
     parser_load = subparser.add_parser(
         "load",
@@ -107,6 +221,13 @@ def make_parser() -> ArgumentParser:
         default=Path("data"),
         type=Path,
     )
+    parser_load.add_argument(
+        "--shards",
+        help="Load the shards written by gutensearch parse to this directory, "
+        "instead of parsing the documents",
+        default=None,
+        type=Path,
+    )
     parser_load.add_argument(
         "--limit",
         help="Only parse and load a limited number of documents",
@@ -119,6 +240,125 @@ def make_parser() -> ArgumentParser:
         action="store_true",
         default=False,
     )
+    parser_load.add_argument(
+        "--tokenizer",
+        help="The tokenizer engine used to parse each document",
+        choices=TOKENIZERS,
+        default="chunked",
+    )
+    parser_load.add_argument(
+        "--backend",
+        help="The storage backend to load the documents into",
+        choices=BACKENDS,
+        default=GUTENSEARCH_BACKEND,
+    )
+    parser_load.add_argument(
+        "--schema",
+        help="The layout of the database tables to load the documents into",
+        choices=SCHEMAS,
+        default=GUTENSEARCH_SCHEMA,
+    )
+    parser_load.add_argument(
+        "--stream",
+        help="Write to the database in fixed-size batches while documents are parsed",
+        action="store_true",
+        default=False,
+    )
+    parser_load.add_argument(
+        "--batch-size",
+        help="The number of rows written to the database at a time with --stream",
+        type=int,
+        default=BATCH_SIZE,
+    )
+    parser_load.add_argument(
+        "--queue-size",
+        help="The maximum number of batches waiting to be written with --stream",
+        type=int,
+        default=QUEUE_SIZE,
+    )
+    parser_load.add_argument(
+        "--writers",
+        help="The number of connections copying rows to postgres at once "
+        "(defaults to one per partition)",
+        type=int,
+        default=None,
+    )
+    parser_load.add_argument(
+        "--partitions",
+        help="Partition the (empty) words table into this many partitions before loading",
+        type=int,
+        default=0,
+    )
+    parser_load.add_argument(
+        "--partition-by",
+        help="The partition key of the words table with --partitions",
+        choices=PARTITION_KEYS,
+        default="word",
+    )
+    parser_load.add_argument(
+        "--copy-format",
+        help="The format rows are written to postgres in with COPY",
+        choices=COPY_FORMATS,
+        default="text",
+    )
+    parser_load.add_argument(
+        "--rank",
+        help="Build the statistics used by gutensearch word --rank "
+        "(once built, every load keeps them up to date)",
+        action="store_true",
+        default=False,
+    )
+    parser_load.add_argument(
+        "--positions",
+        help="Build the positional index used by phrase and NEAR queries "
+        "(once built, every load keeps it up to date)",
+        action="store_true",
+        default=False,
+    )
+    parser_load.add_argument(
+        "--incremental",
+        help="Only load the documents that are new or have changed since they were loaded",
+        action="store_true",
+        default=False,
+    )
+    parser_load.add_argument(
+        "--rebuild-ratio",
+        help="With --incremental, only rebuild the indexes when the new documents are "
+        "at least this large relative to those already loaded",
+        type=float,
+        default=REBUILD_RATIO,
+    )
+    parser_load.add_argument(
+        "--fuzzy-index",
+        help="The path to save the fuzzy word matching index to "
+        "(defaults to a separate file for each backend)",
+        default=None,
+        type=Path,
+    )
+    parser_load.add_argument(
+        "--no-fuzzy-index",
+        help="Skip building the fuzzy word matching index after loading",
+        action="store_true",
+        default=False,
+    )
+    parser_load.add_argument(
+        "--metrics",
+        help="Write the time spent in each phase of the load, its throughput "
+        "and memory usage as JSON to this file (use - for stdout)",
+        default=None,
+    )
+    parser_load.add_argument(
+        "--prometheus",
+        help="Write the metrics of the load to this Prometheus textfile",
+        default=None,
+        type=Path,
+    )
+    parser_load.add_argument(
+        "--profile",
+        help="Save a cProfile profile of the load and of each worker to this directory",
+        default=None,
+        type=Path,
+    )
     parser_load.add_argument(
         "--log-level",
         help="Set the level for the logger",
@@ -127,13 +367,157 @@ def make_parser() -> ArgumentParser:
     )
     parser_load.set_defaults(__load=True)
 
+    # subparser for downloading documents straight into the db
+    parser_ingest = subparser.add_parser(
+        "ingest",
+        help="Download documents and load their word counts into the gutensearch "
+        "database, without saving them to disk",
+    )
+    parser_ingest.add_argument(
+        "--limit",
+        help="Stop after a certain number of documents have been loaded",
+        type=int,
+        default=None,
+    )
+    parser_ingest.add_argument(
+        "--only",
+        help="Ingest only the document ids listed in the given file",
+    )
+    parser_ingest.add_argument(
+        "--archive",
+        help="Also save the text of each document to the given directory",
+        default=None,
+        type=Path,
+    )
+    parser_ingest.add_argument(
+        "--concurrency",
+        help="The number of documents fetched concurrently",
+        type=int,
+        default=CONCURRENCY,
+    )
+    parser_ingest.add_argument(
+        "--rate",
+        help="The maximum number of requests per second sent to the mirror",
+        type=float,
+        default=RATE,
+    )
+    parser_ingest.add_argument(
+        "--retries",
+        help="The number of times a failed request is retried",
+        type=int,
+        default=RETRIES,
+    )
+    parser_ingest.add_argument(
+        "--mirror",
+        help="The base URL of the Project Gutenberg mirror to download from",
+        default=GUTENSEARCH_MIRROR,
+    )
+    parser_ingest.add_argument(
+        "--multiprocessing",
+        help="Parse the documents in parallel using multiple cores",
+        action="store_true",
+        default=False,
+    )
+    parser_ingest.add_argument(
+        "--tokenizer",
+        help="The tokenizer engine used to parse each document",
+        choices=TOKENIZERS,
+        default="chunked",
+    )
+    parser_ingest.add_argument(
+        "--backend",
+        help="The storage backend to load the documents into",
+        choices=BACKENDS,
+        default=GUTENSEARCH_BACKEND,
+    )
+    parser_ingest.add_argument(
+        "--schema",
+        help="The layout of the database tables to load the documents into",
+        choices=SCHEMAS,
+        default=GUTENSEARCH_SCHEMA,
+    )
+    parser_ingest.add_argument(
+        "--commit-size",
+        help="The number of documents loaded in a single transaction",
+        type=int,
+        default=COMMIT_SIZE,
+    )
+    parser_ingest.add_argument(
+        "--batch-size",
+        help="The number of rows written to the database at a time",
+        type=int,
+        default=BATCH_SIZE,
+    )
+    parser_ingest.add_argument(
+        "--fuzzy-index",
+        help="The path to save the fuzzy word matching index to "
+        "(defaults to a separate file for each backend)",
+        default=None,
+        type=Path,
+    )
+    parser_ingest.add_argument(
+        "--no-fuzzy-index",
+        help="Skip building the fuzzy word matching index after loading",
+        action="store_true",
+        default=False,
+    )
+    parser_ingest.add_argument(
+        "--log-level",
+        help="Set the level for the logger",
+        choices=LOG_LEVEL_CHOICES.keys(),
+        default="info",
+    )
+    parser_ingest.set_defaults(__ingest=True)
+
+    # subparser for building the embedded inverted index
+    parser_build_index = subparser.add_parser(
+        "build-index",
+        help="Build a read-only inverted index file that can be searched without the database",
+    )
+    parser_build_index.add_argument(
+        "--path",
+        help="The path to the directory to save the index to",
+        default=INDEX_PATH,
+        type=Path,
+    )
+    parser_build_index.add_argument(
+        "--backend",
+        help="The storage backend to read the word counts from",
+        choices=BACKENDS,
+        default=GUTENSEARCH_BACKEND,
+    )
+    parser_build_index.add_argument(
+        "--log-level",
+        help="Set the level for the logger",
+        choices=LOG_LEVEL_CHOICES.keys(),
+        default="info",
+    )
+    parser_build_index.set_defaults(__build_index=True)
+
     # subparser for searching for a word
     parser_word = subparser.add_parser(
         "word", help="Find the documents where the given word occurs most frequently"
     )
     parser_word.add_argument(
         "word",
-        help="The word to search for in the database",
+        help="The word to search for in the database, a boolean query "
+        'over several words such as "river AND fish NOT whale", or a phrase '
+        "query such as '\"white whale\"' or 'white NEAR/3 whale' "
+        "(needs gutensearch load --positions)",
+        nargs="?",
+        default=None,
+    )
+    parser_word.add_argument(
+        "--from-file",
+        help="Search for every word (one per line) in the given file instead, "
+        "or - to read the words from stdin",
+        default=None,
+    )
+    parser_word.add_argument(
+        "--batch-size",
+        help="The number of words searched for in a single query with --from-file",
+        type=int,
+        default=WORDS_BATCH_SIZE,
     )
     parser_word.add_argument(
         "-l",
@@ -148,6 +532,40 @@ def make_parser() -> ArgumentParser:
         action="store_true",
         default=False,
     )
+    parser_word.add_argument(
+        "--rank",
+        help="Order the documents by the BM25 or TF-IDF score of the word "
+        "instead of its count (needs gutensearch load --rank)",
+        choices=RANKINGS,
+        default=None,
+    )
+    parser_word.add_argument(
+        "--candidates",
+        help="List the n closest matching words and their scores instead",
+        type=int,
+        default=None,
+    )
+    parser_word.add_argument(
+        "--backend",
+        help="The storage backend to search",
+        choices=BACKENDS,
+        default=GUTENSEARCH_BACKEND,
+    )
+    parser_word.add_argument(
+        "--index",
+        help="Search the inverted index (see build-index) instead of the database",
+        nargs="?",
+        const=INDEX_PATH,
+        default=None,
+        type=Path,
+    )
+    parser_word.add_argument(
+        "--fuzzy-index",
+        help="The path to the fuzzy word matching index used by --fuzzy "
+        "(defaults to a separate file for each backend)",
+        default=None,
+        type=Path,
+    )
     parser_word.add_argument(
         "-o",
         "--output",
@@ -155,6 +573,25 @@ def make_parser() -> ArgumentParser:
         choices=OUTPUT_CHOICES,
         default="tsv",
     )
+    parser_word.add_argument(
+        "--slow-query-ms",
+        help="Log every database query slower than this many milliseconds, "
+        "along with its EXPLAIN (ANALYZE, BUFFERS) output",
+        type=float,
+        default=None,
+    )
+    parser_word.add_argument(
+        "--query-stats",
+        help="Write the latency histograms of the database queries to this file "
+        "(use - for stdout)",
+        default=None,
+    )
+    parser_word.add_argument(
+        "--query-stats-format",
+        help="The format of the file written with --query-stats",
+        choices=QUERY_STATS_FORMATS,
+        default="json",
+    )
     parser_word.set_defaults(__word=True)
 
     # subparser for searching for a document by id
@@ -179,6 +616,20 @@ def make_parser() -> ArgumentParser:
         type=int,
         default=4,
     )
+    parser_doc.add_argument(
+        "--backend",
+        help="The storage backend to search",
+        choices=BACKENDS,
+        default=GUTENSEARCH_BACKEND,
+    )
+    parser_doc.add_argument(
+        "--index",
+        help="Search the inverted index (see build-index) instead of the database",
+        nargs="?",
+        const=INDEX_PATH,
+        default=None,
+        type=Path,
+    )
     parser_doc.add_argument(
         "-o",
         "--output",
@@ -186,8 +637,59 @@ def make_parser() -> ArgumentParser:
         choices=OUTPUT_CHOICES,
         default="tsv",
     )
+    parser_doc.add_argument(
+        "--slow-query-ms",
+        help="Log every database query slower than this many milliseconds, "
+        "along with its EXPLAIN (ANALYZE, BUFFERS) output",
+        type=float,
+        default=None,
+    )
+    parser_doc.add_argument(
+        "--query-stats",
+        help="Write the latency histograms of the database queries to this file "
+        "(use - for stdout)",
+        default=None,
+    )
+    parser_doc.add_argument(
+        "--query-stats-format",
+        help="The format of the file written with --query-stats",
+        choices=QUERY_STATS_FORMATS,
+        default="json",
+    )
     parser_doc.set_defaults(__doc=True)
 
+    # subparser for searching for the documents similar to a document
+    parser_similar = subparser.add_parser(
+        "similar",
+        help="Find the documents most similar to the given document id "
+        "(needs build-index)",
+    )
+    parser_similar.add_argument(
+        "id",
+        help="The document id to search for",
+    )
+    parser_similar.add_argument(
+        "-l",
+        "--limit",
+        help="Limit the total number of results returned",
+        type=int,
+        default=10,
+    )
+    parser_similar.add_argument(
+        "--index",
+        help="The path to the inverted index (see build-index) to search",
+        default=INDEX_PATH,
+        type=Path,
+    )
+    parser_similar.add_argument(
+        "-o",
+        "--output",
+        help="The output format when printing to stdout",
+        choices=OUTPUT_CHOICES,
+        default="tsv",
+    )
+    parser_similar.set_defaults(__similar=True)
+
     return parser
 
 
@@ -218,169 +720,495 @@ def download_main(args: Namespace):
 
     try:
         download_gutenberg_documents(
-            path=args.path, limit=args.limit, delay=args.delay, only=ids
+            path=args.path,
+            limit=args.limit,
+            delay=args.delay,
+            only=ids,
+            concurrency=args.concurrency,
+            rate=args.rate,
+            retries=args.retries,
+            mirror=args.mirror,
         )
     except KeyboardInterrupt:
         return
 
 
+def parse_main(args: Namespace) -> None:
+    """
+    Entrypoint for the `gutensearch parse` command
+    """
+    log = logging.getLogger("gutensearch.shard")
+    log.setLevel(LOG_LEVEL_CHOICES[args.log_level])
+
+    files = sorted(find_documents(args.path), key=document_id)
+    if args.limit is not None:
+        files = files[: args.limit]
+
+    # only use multiple cpu's if requested
+    processes = cpu_count() if args.multiprocessing else 1
+
+    parse_to_shards(files, args.shards, processes, args.tokenizer, args.shard_size)
+
+
 def load_main(args: Namespace):
     """
     Entrypoint for the `gutensearch load` command
     """
     log = logging.getLogger("gutensearch.load")
     log.setLevel(LOG_LEVEL_CHOICES[args.log_level])
+    logging.getLogger("gutensearch.shard").setLevel(LOG_LEVEL_CHOICES[args.log_level])
 
-    files = [args.path / f for f in os.listdir(args.path) if f.endswith(".txt")]
+    # plain text and compressed documents, see `gutensearch.parse.DOCUMENT_SUFFIXES`,
+    # unless the documents were already parsed into shards
+    files = find_documents(args.path) if args.shards is None else []
 
     # parse/load only the first `n` files if --limit
     if args.limit is not None:
         files = files[: args.limit]
 
+    # one writer per partition, unless told otherwise
+    writers = args.writers or max(args.partitions, 1)
+
+    try:
+        backend = get_backend(
+            args.backend,
+            args.schema,
+            writers,
+            args.partitions,
+            args.partition_by,
+            args.copy_format,
+            args.rank,
+            args.positions,
+            fuzzy_index=args.fuzzy_index,
+        )
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+    # measure every phase of the load, see `gutensearch.metrics`
+    METRICS.reset()
+
+    # save the results using the storage backend
+    try:
+        with profiled(args.profile):
+            load_documents(args, backend, files)
+    except ValueError as e:
+        # e.g. partitioning a words table that already holds rows
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    finally:
+        backend.close()
+
+    report_metrics(args, METRICS.summary())
+
+
+def load_documents(args: Namespace, backend: Backend, files: List[Path]) -> None:
+    """
+    Parse and load the documents (or shards) of the `gutensearch load` command
+    """
+    log = logging.getLogger("gutensearch.load")
+
+    # once built, the positional index is kept up to date by every load
+    positions = args.positions or backend.has_positions()
+    if positions and args.shards is not None:
+        raise ValueError(
+            "Shards do not hold the positions of the words, "
+            "load the documents themselves to keep the positional index up to date"
+        )
+
+    # measure each document in the process that parses it
+    parse = TimedParse(
+        partial(parse_document_counts, tokenizer=args.tokenizer, positions=positions),
+        args.profile,
+    )
+
     # only use multiple cpu's if requested
-    if args.multiprocessing:
-        cpus = cpu_count()
-        log.info(f"Parsing {len(files)} documents using {cpus} cores")
+    processes = cpu_count() if args.multiprocessing else 1
 
-        with Pool(cpus) as p:
-            records = chain(*p.map(parse_document, files))
+    if args.shards is not None:
+        loaded = load_shards(
+            backend,
+            args.shards,
+            args.rebuild_ratio,
+            args.batch_size,
+            args.queue_size,
+        )
+        if loaded > 0 and not args.no_fuzzy_index:
+            backend.write_fuzzy_index(backend.fuzzy_index)
+        return
+
+    if args.incremental:
+        # record the size and hash of each document to compare with the manifest
+        entries = scan_documents(files)
+        plan = plan_incremental(backend.manifest(), entries, args.rebuild_ratio)
+        log.info(
+            f"Found {len(plan.files)} new or changed documents "
+            f"({len(plan.replaced)} changed), "
+            f"skipping {len(entries) - len(plan.files)} unchanged documents"
+        )
+        # an empty load still builds the ranking statistics, if asked to
+        if len(plan.files) == 0 and not args.rank:
+            return
+
+        log.info(
+            f"Parsing {len(plan.files)} documents using {processes} "
+            + ("cores" if processes > 1 else "core")
+        )
+        parsed = parse_documents([f.path for f in plan.files], parse, processes)
+        documents = METRICS.parsed(parsed)
+        backend.load_incremental(documents, plan, args.batch_size, args.queue_size)
+
+        if not args.no_fuzzy_index:
+            backend.write_fuzzy_index(backend.fuzzy_index)
+        return
+
+    log.info(
+        f"Parsing {len(files)} documents using {processes} "
+        + ("cores" if processes > 1 else "core")
+    )
+    # the size and hash of each document are recorded for the manifest by
+    # the worker that parses it, see `ScannedParse`
+    entries = []
+    scanned = ScannedParse(parse)
+    if args.stream:
+        documents = METRICS.parsed(
+            record_scanned(parse_documents(files, scanned, processes), entries)
+        )
     else:
-        log.info(f"Parsing {len(files)} documents using 1 core")
-        records = chain(*[parse_document(f) for f in files])
-
-    # connect to the db and save the results
-    with psycopg2.connect(**dbconfig()) as con:
-        cur = con.cursor()
-
-        log.info("Temporarily dropping indexes on table: words")
-        sql = """
-        DROP INDEX IF EXISTS idx_words_word;
-        DROP INDEX IF EXISTS idx_words_id;
-        """.strip()
-        cur.execute(sql)
-
-        log.info("Writing results to database")
-        # create an in-memory file-stream to copy the data
-        # using Postgres' high performance `COPY` command
-        words: List[Union[str, int]] = []  # used later for distinct_words
-        with StringIO() as fio:
-            for d in records:
-                words.append(d["word"])
-
-                text = "\t".join(str(v) for v in d.values())
-                fio.write(text + "\n")
-
-            fio.seek(0)
-            cur.copy_from(fio, "words")
-            log.info("Finished writing data to database")
-
-        # save distinct words for quicker access
-        # when perforing fuzzy word matching algorithm
-        log.info("Truncating table: distinct_words")
-        cur.execute("TRUNCATE TABLE distinct_words")
-
-        log.info("Writing new distinct words to database")
-        with StringIO() as fio:
-            for w in set(words):
-                fio.write(f"{w}\n")
-            fio.seek(0)
-            cur.copy_from(fio, "distinct_words")
-            log.info("Finished writing distinct words to database")
-
-        log.info("Recreating indexes on table: words")
-        sql = """
-        CREATE INDEX idx_words_word ON words (word);
-        CREATE INDEX idx_words_id ON words(document_id);
-        """.strip()
-        cur.execute(sql)
-
-        log.info("Committing changes to database")
-        con.commit()
-        cur.close()
-
-        log.info("Running vacuum analyze on table: words")
-        cur = con.cursor()
-        iso_level = con.isolation_level
-        con.set_isolation_level(0)
-        cur.execute("VACUUM ANALYZE words")
-
-        log.info("Committing changes to database")
-        con.commit()
-        con.set_isolation_level(iso_level)
-        cur.close()
+        with METRICS.phase("parse"):
+            if processes > 1:
+                with Pool(processes) as p:
+                    results = p.map(scanned, files)
+                    # let the workers exit on their own, see `parse_documents`
+                    p.close()
+                    p.join()
+            else:
+                results = [scanned(f) for f in files]
+        documents = METRICS.parsed(record_scanned(results, entries))
 
+    # the manifest entries are only complete once every document is parsed
+    ids = [document_id(f) for f in files]
+    backend.load(documents, args.stream, args.batch_size, args.queue_size, entries, ids)
 
-def word_main(args: Namespace):
+    if not args.no_fuzzy_index:
+        backend.write_fuzzy_index(backend.fuzzy_index)
+
+
+def report_metrics(args: Namespace, summary: Dict[str, Any]) -> None:
     """
-    Entrypoint for the `gutensearch word` command-line-interface
+    Log the metrics of a load, and write them to the files requested
+    by the `gutensearch load` command
     """
+    log = logging.getLogger("gutensearch.load")
+    log.info(
+        f"Loaded {summary['documents']} documents ({summary['rows']} rows) "
+        f"in {summary['seconds']:.2f}s: "
+        f"{summary['documents_per_s']:.1f} documents/s, "
+        f"{summary['rows_per_s']:.0f} rows/s, "
+        f"peak RSS {summary['peak_rss_bytes'] / 2**20:.0f} MiB"
+    )
+    for name, p in summary["phases"].items():
+        log.debug(
+            f"Phase {name}: {p['seconds']:.3f}s wall, {p['cpu_seconds']:.3f}s cpu, "
+            f"{p['calls']} calls"
+        )
+
+    if args.metrics == "-":
+        print(json.dumps(summary, indent=2))
+    elif args.metrics is not None:
+        Path(args.metrics).write_text(json.dumps(summary, indent=2) + "\n")
+
+    if args.prometheus is not None:
+        write_prometheus(summary, args.prometheus)
+
+
+def ingest_main(args: Namespace) -> None:
+    """
+    Entrypoint for the `gutensearch ingest` command
+    """
+    log = logging.getLogger("gutensearch")
+    log.setLevel(LOG_LEVEL_CHOICES[args.log_level])
+
+    if args.only is not None:
+        with open(args.only, "r") as f:
+            ids = [int(i.strip()) for i in f.readlines() if len(i.strip()) > 0]
+    else:
+        log.info("Downloading project gutenberg document index")
+        ids = parse_gutenberg_index()
+
     try:
-        results = search_word(args.word, args.fuzzy, args.limit)
-    except psycopg2.OperationalError as e:
+        backend = get_backend(args.backend, args.schema, fuzzy_index=args.fuzzy_index)
+    except ValueError as e:
         print(e, file=sys.stderr)
         sys.exit(1)
-    except ValueError as e:
+
+    processes = cpu_count() if args.multiprocessing else 1
+    downloader = Downloader(args.mirror, args.concurrency, args.rate, args.retries)
+    try:
+        loaded = ingest(
+            backend,
+            ids,
+            downloader,
+            concurrency=args.concurrency,
+            limit=args.limit,
+            processes=processes,
+            tokenizer=args.tokenizer,
+            positions=backend.has_positions(),
+            archive=args.archive,
+            commit_size=args.commit_size,
+            batch_size=args.batch_size,
+        )
+
+        if loaded > 0 and not args.no_fuzzy_index:
+            backend.write_fuzzy_index(backend.fuzzy_index)
+    except KeyboardInterrupt:
+        return
+    finally:
+        downloader.close()
+        backend.close()
+
+
+def build_index_main(args: Namespace) -> None:
+    """
+    Entrypoint for the `gutensearch build-index` command
+    """
+    log = logging.getLogger("gutensearch.index")
+    log.setLevel(LOG_LEVEL_CHOICES[args.log_level])
+
+    backend = get_backend(args.backend, read_only=True)
+    try:
+        backend.write_index(args.path)
+    except (psycopg2.OperationalError, sqlite3.OperationalError) as e:
         print(e, file=sys.stderr)
         sys.exit(1)
+    finally:
+        backend.close()
+
 
-    if len(results) == 0:
-        sys.exit(0)
+def print_records(
+    records: Sequence[NamedTuple], output: str, header: bool = True
+) -> None:
+    """
+    Print the results of a search to `stdout` in the given output format
+
+    Parameters:
+        records: The results of the search
+        output: One of the `OUTPUT_CHOICES`
+        header: Print the names of the fields before the `tsv` or `csv` records
+    """
+    if len(records) == 0:
+        return
 
-    if args.output == "json":
-        records = [dict(r._asdict()) for r in results]
-        pprint(records)
-        sys.exit(0)
+    if output == "json":
+        pprint([dict(r._asdict()) for r in records])
 
-    if args.output == "tsv":
-        fields = "\t".join(results[0]._fields)
-        print(fields)
-        for r in results:
+    if output == "tsv":
+        fields = "\t".join(records[0]._fields)
+        if header:
+            print(fields)
+        for r in records:
             values = "\t".join(str(x) for x in r._asdict().values())
             print(values)
-        sys.exit(0)
 
-    if args.output == "csv":
-        fields = ",".join(results[0]._fields)
-        print(fields)
-        for r in results:
+    if output == "csv":
+        fields = ",".join(records[0]._fields)
+        if header:
+            print(fields)
+        for r in records:
             values = ",".join(str(x) for x in r._asdict().values())
             print(values)
-        sys.exit(0)
+
+
+def read_words(path: str) -> Iterator[str]:
+    """
+    Lazily read the words to search for, one per line, skipping blank lines
+
+    Parameters:
+        path: The path to the file, or `-` to read from `stdin`
+
+    Returns:
+        A generator of words
+    """
+    # `stdin` is left open, every other file is closed once read
+    with nullcontext(sys.stdin) if path == "-" else open(path, "r") as f:
+        for line in f:
+            word = line.strip()
+            if word:
+                yield word
+
+
+def print_term_groups(records: Sequence[NamedTuple]) -> None:
+    """
+    Print the results of a search for many words to `stdout` as JSON lines,
+    with one line per term holding every record found for it
+
+    Parameters:
+        records: The results of the search, grouped by term
+    """
+    for term, group in groupby(records, key=lambda r: r.term):  # type: ignore
+        results = [{k: v for k, v in r._asdict().items() if k != "term"} for r in group]
+        print(json.dumps({"term": term, "results": results}))
+
+
+def disable_memory_cache() -> None:
+    """
+    Disable the search results cache, unless the results are shared with
+    other processes using the on-disk store. Every search command runs in
+    a new process, so a cache kept only in memory could never be hit, and
+    would only add a query to look up the load generation.
+    """
+    if CACHE.path is None:
+        CACHE.size = 0
+
+
+def report_query_stats(args: Namespace) -> None:
+    """
+    Write the statistics of the database queries sent by the `gutensearch word`
+    or `gutensearch doc` command, if requested (see `gutensearch.querystats`)
+    """
+    if args.query_stats is None:
+        return
+
+    if args.query_stats_format == "prometheus":
+        text = STATS.prometheus()
+    else:
+        text = json.dumps(STATS.summary(), indent=2) + "\n"
+
+    if args.query_stats == "-":
+        sys.stdout.write(text)
+    else:
+        Path(args.query_stats).write_text(text)
+
+
+def word_from_file_main(args: Namespace) -> None:
+    """
+    Entrypoint for `gutensearch word --from-file`, which searches for
+    the words in batches and prints the results of each batch as soon
+    as they are found
+    """
+    search: Callable[[Sequence[str], bool, Optional[int]], Sequence[NamedTuple]]
+    try:
+        backend = get_backend(
+            args.backend, read_only=True, fuzzy_index=args.fuzzy_index
+        )
+        if args.index is not None:
+            search = InvertedIndex(args.index, backend.fuzzy_index).search_words
+        else:
+            search = backend.search_words
+
+        header = True
+        words = read_words(args.from_file)
+        while True:
+            batch = list(islice(words, args.batch_size))
+            if len(batch) == 0:
+                break
+
+            results = search(batch, args.fuzzy, args.limit)
+            if args.output == "json":
+                print_term_groups(results)
+            else:
+                print_records(results, args.output, header)
+                header = header and len(results) == 0
+            sys.stdout.flush()
+    except (psycopg2.OperationalError, sqlite3.OperationalError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+    report_query_stats(args)
+    sys.exit(0)
+
+
+def word_main(args: Namespace):
+    """
+    Entrypoint for the `gutensearch word` command-line-interface
+    """
+    if args.slow_query_ms is not None:
+        STATS.slow_ms = args.slow_query_ms
+    disable_memory_cache()
+
+    if args.rank is not None and (args.from_file is not None or args.index is not None):
+        print("--rank cannot be used with --from-file or --index", file=sys.stderr)
+        sys.exit(1)
+
+    if args.from_file is not None:
+        word_from_file_main(args)
+
+    if args.word is None:
+        print("Either a word or --from-file is required", file=sys.stderr)
+        sys.exit(1)
+
+    results: Sequence[NamedTuple]
+    try:
+        backend = get_backend(
+            args.backend, read_only=True, fuzzy_index=args.fuzzy_index
+        )
+        if args.candidates is not None:
+            results = backend.fuzzy_candidates(args.word, args.candidates)
+        elif args.index is not None:
+            if is_boolean_query(args.word) or is_positional_query(args.word):
+                raise ValueError(
+                    "Boolean, phrase and NEAR queries cannot be used with --index"
+                )
+            index = InvertedIndex(args.index, backend.fuzzy_index)
+            results = index.search_word(args.word, args.fuzzy, args.limit)
+        else:
+            results = backend.search_word(args.word, args.fuzzy, args.limit, args.rank)
+    except (psycopg2.OperationalError, sqlite3.OperationalError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+    print_records(results, args.output)
+    report_query_stats(args)
+    sys.exit(0)
 
 
 def doc_main(args: Namespace):
     """
     Entrypoint for the `gutensearch doc` command-line-interface
     """
+    if args.slow_query_ms is not None:
+        STATS.slow_ms = args.slow_query_ms
+    disable_memory_cache()
+
+    results: Sequence[NamedTuple]
     try:
-        results = search_document(args.id, args.min_length, args.limit)
-    except psycopg2.OperationalError as e:
+        backend = get_backend(args.backend, read_only=True)
+        if args.index is not None:
+            index = InvertedIndex(args.index)
+            results = index.search_document(args.id, args.min_length, args.limit)
+        else:
+            results = backend.search_document(args.id, args.min_length, args.limit)
+    except (psycopg2.OperationalError, sqlite3.OperationalError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    except (OSError, ValueError) as e:
         print(e, file=sys.stderr)
         sys.exit(1)
 
-    if len(results) == 0:
-        sys.exit(0)
+    print_records(results, args.output)
+    report_query_stats(args)
+    sys.exit(0)
 
-    if args.output == "json":
-        records = [dict(r._asdict()) for r in results]
-        pprint(records)
-        sys.exit(0)
 
-    if args.output == "tsv":
-        fields = "\t".join(results[0]._fields)
-        print(fields)
-        for r in results:
-            values = "\t".join(str(x) for x in r._asdict().values())
-            print(values)
-        sys.exit(0)
+def similar_main(args: Namespace) -> None:
+    """
+    Entrypoint for the `gutensearch similar` command-line-interface
+    """
+    try:
+        index = InvertedIndex(args.index)
+        results = index.search_similar(args.id, args.limit)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
 
-    if args.output == "csv":
-        fields = ",".join(results[0]._fields)
-        print(fields)
-        for r in results:
-            values = ",".join(str(x) for x in r._asdict().values())
-            print(values)
-        sys.exit(0)
+    print_records(results, args.output)
+    sys.exit(0)
 
 
 def main():
@@ -393,11 +1221,23 @@ def main():
     if hasattr(args, "__download"):
         download_main(args)
 
+    if hasattr(args, "__parse"):
+        parse_main(args)
+
     if hasattr(args, "__load"):
         load_main(args)
 
+    if hasattr(args, "__ingest"):
+        ingest_main(args)
+
+    if hasattr(args, "__build_index"):
+        build_index_main(args)
+
     if hasattr(args, "__word"):
         word_main(args)
 
     if hasattr(args, "__doc"):
         doc_main(args)
+
+    if hasattr(args, "__similar"):
+        similar_main(args)
@@ -1,16 +1,46 @@
 """
 This module provides functions to interface with the project
 Postgres database, including inserting/loading data and
-executing a variety of queries/searches.
+executing a variety of queries/searches. Queries are executed
+using a process-wide pool of connections, see `connection`.
 """
 
 import os
-from typing import Dict, List, NamedTuple, Tuple, Any, Optional
+import time
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import (
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Sequence,
+    Set,
+    Tuple,
+    Any,
+    Optional,
+    Union,
+    cast,
+)
 
 import psycopg2  # type: ignore
+import psycopg2.errors  # type: ignore
+from psycopg2.extensions import connection as _connection  # type: ignore
 from psycopg2.extras import NamedTupleCursor  # type: ignore
 
-from .parse import closest_match
+from .boolean import boolean_sql, is_boolean_query
+from .cache import QueryCache
+from .fuzzy import FUZZY_INDEX_PATH, load_fuzzy_index
+from .parse import Candidate, closest_match, closest_matches
+from .positions import (
+    candidates_sql,
+    is_positional_query,
+    match_documents,
+    parse_positional_query,
+)
+from .querystats import QueryStats, SlowQuery
+from .rank import IDF, RANKINGS, WEIGHT_COLUMNS
 
 POSTGRES_HOST = os.getenv("POSTGRES_HOST", "localhost")
 POSTGRES_DB = os.getenv("POSTGRES_DB", "postgres")
@@ -18,6 +48,41 @@ POSTGRES_USER = os.getenv("POSTGRES_USER", "postgres")
 POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD", "postgres")
 POSTGRES_PORT = os.getenv("POSTGRES_PORT", "5432")
 
+# the maximum number of open connections in the pool (0 disables pooling)
+POSTGRES_POOL_SIZE = int(os.getenv("POSTGRES_POOL_SIZE", "8"))
+
+# the number of seconds a pooled connection may sit idle before it is
+# checked to still be alive, the next time it is taken from the pool
+POSTGRES_POOL_CHECK_INTERVAL = float(os.getenv("POSTGRES_POOL_CHECK_INTERVAL", "30"))
+
+# the layout of the database tables, either `flat` (see `schema.sql`) where
+# every row of `words` holds the word itself, or `vocabulary` (see
+# `schema-vocabulary.sql`) where `words` refers to a `vocabulary` table
+GUTENSEARCH_SCHEMA = os.getenv("GUTENSEARCH_SCHEMA", "flat")
+
+SCHEMAS = {
+    "flat",
+    "vocabulary",
+}
+
+# the tables to select `word`, `document_id`, `count` from for each layout
+WORDS_TABLES = {
+    "flat": "words",
+    "vocabulary": "words JOIN vocabulary USING (word_id)",
+}
+
+# the tables to select every distinct `word` from for each layout
+DISTINCT_WORDS_TABLES = {
+    "flat": "distinct_words",
+    "vocabulary": "vocabulary",
+}
+
+# the column of `words` that identifies a word for each layout
+WORD_KEYS = {
+    "flat": "word",
+    "vocabulary": "word_id",
+}
+
 
 def dbconfig() -> Dict[str, str]:
     """
@@ -41,8 +106,196 @@ def dbconfig() -> Dict[str, str]:
     }
 
 
+class Connection(_connection):  # type: ignore
+    """
+    A psycopg2 connection that keeps track of the server-side prepared
+    statements created on it, and the last time it was used
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.prepared: Set[str] = set()
+        self.last_used = time.monotonic()
+
+
+class ConnectionPool:
+    """
+    A thread-safe pool of database connections. Connections are only
+    opened when they are needed, and are kept open once they are returned
+    to the pool. When every connection is in use, taking a connection
+    blocks until one is returned (rather than raising an error like
+    psycopg2's own pools), and a connection that has been idle for a
+    while is checked to still be alive before it is handed out again.
+
+    Parameters:
+        size: The maximum number of open connections
+        check_interval: The number of idle seconds after which a connection is checked
+    """
+
+    def __init__(
+        self,
+        size: int = POSTGRES_POOL_SIZE,
+        check_interval: float = POSTGRES_POOL_CHECK_INTERVAL,
+    ):
+        self.idle: List[Connection] = []
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(size)
+        self.check_interval = check_interval
+        self.pid = os.getpid()
+
+    def healthy(self, con: Connection) -> bool:
+        """
+        Check whether a connection can still be used
+
+        Parameters:
+            con: The connection to check
+
+        Returns:
+            `False` if the connection is closed or does not respond
+        """
+        if con.closed:
+            return False
+
+        if time.monotonic() - con.last_used < self.check_interval:
+            return True
+
+        try:
+            with con.cursor() as cur:
+                cur.execute("SELECT 1")
+            con.rollback()
+        except psycopg2.Error:
+            return False
+
+        return True
+
+    def getconn(self) -> Connection:
+        """
+        Take a connection from the pool, waiting for one to become
+        available if every connection is in use
+
+        Returns:
+            The connection, which must be returned using `putconn`
+        """
+        self.slots.acquire()
+        try:
+            while True:
+                with self.lock:
+                    con = self.idle.pop() if len(self.idle) > 0 else None
+
+                if con is None:
+                    return cast(
+                        Connection,
+                        psycopg2.connect(connection_factory=Connection, **dbconfig()),
+                    )
+                if self.healthy(con):
+                    return con
+                con.close()
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def putconn(self, con: Connection, close: bool = False) -> None:
+        """
+        Return a connection to the pool, rolling back any open transaction
+
+        Parameters:
+            con: The connection
+            close: Close the connection instead of keeping it open
+        """
+        try:
+            if close or con.closed:
+                con.close()
+                return
+
+            con.rollback()
+            con.last_used = time.monotonic()
+            with self.lock:
+                self.idle.append(con)
+        except psycopg2.Error:
+            con.close()
+        finally:
+            self.slots.release()
+
+    def closeall(self) -> None:
+        """
+        Close every idle connection in the pool
+        """
+        with self.lock:
+            for con in self.idle:
+                con.close()
+            self.idle.clear()
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """
+    Lazily create (and cache) the process-wide connection pool. A new pool
+    is created in a forked child process, since connections cannot be
+    shared with the parent process.
+
+    Returns:
+        The connection pool
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = ConnectionPool(POSTGRES_POOL_SIZE, POSTGRES_POOL_CHECK_INTERVAL)
+
+        return _pool
+
+
+def close_pool() -> None:
+    """
+    Close every connection in the process-wide connection pool
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool.pid == os.getpid():
+            _pool.closeall()
+        _pool = None
+
+
+@contextmanager
+def connection() -> Iterator[Connection]:
+    """
+    Borrow a connection from the process-wide connection pool for
+    the duration of the `with` block. Any open transaction is rolled
+    back once the connection is returned, and a connection that failed
+    is closed instead of being returned to the pool. If pooling is
+    disabled (`POSTGRES_POOL_SIZE=0`) a new connection is opened instead,
+    and closed afterwards.
+
+    Returns:
+        A context manager yielding the connection
+    """
+    if POSTGRES_POOL_SIZE <= 0:
+        con = psycopg2.connect(connection_factory=Connection, **dbconfig())
+        try:
+            yield con
+        finally:
+            con.close()
+        return
+
+    pool = get_pool()
+    con = pool.getconn()
+    broken = False
+    try:
+        yield con
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        pool.putconn(con, close=broken)
+
+
 def query(
-    sql: str, params: Optional[Tuple[Any, ...]] = None, limit: Optional[int] = None
+    sql: str,
+    params: Optional[Union[Tuple[Any, ...], Dict[str, Any]]] = None,
+    limit: Optional[int] = None,
+    kind: str = "query",
 ) -> List[NamedTuple]:
     """
     Convenience function to easily execute a read-only query
@@ -52,12 +305,16 @@ def query(
         sql: The SQL query to execute
         params: Data to bind to parameters in the query
         limit: Return only the first `n` records from the result
+        kind: The kind of query the statistics of the query are recorded
+            under (see `STATS`)
 
     Returns:
         A list of records where each record is an instance of a `NamedTuple`
 
     """
-    with psycopg2.connect(**dbconfig()) as con:
+    start = time.perf_counter()
+    with connection() as con:
+        connected = time.perf_counter()
         cur = con.cursor(cursor_factory=NamedTupleCursor)
 
         # auto-cleanup if there is an error
@@ -65,6 +322,8 @@ def query(
             cur.execute(sql, params)
         except Exception as e:
             cur.close()
+            elapsed = time.perf_counter() - connected
+            STATS.record(kind, elapsed, connected - start, 0, error=True)
             raise (e)
 
         if limit is not None:
@@ -72,17 +331,174 @@ def query(
         else:
             results = cur.fetchall()
 
+        elapsed = time.perf_counter() - connected
+        if STATS.is_slow(elapsed):
+            capture_slow_query(cur, kind, sql, params, elapsed, len(results))
+
         cur.close()
 
+    STATS.record(kind, elapsed, connected - start, len(results))
     return results
 
 
+def query_prepared(
+    name: str,
+    sql: str,
+    params: Tuple[Any, ...],
+    limit: Optional[int] = None,
+    kind: Optional[str] = None,
+) -> List[NamedTuple]:
+    """
+    Execute a read-only query as a server-side prepared statement, so
+    the query is only parsed and planned once per connection. The
+    statement is prepared the first time it is used on a connection
+    and then only executed, with the given parameters.
+
+    Parameters:
+        name: The name of the prepared statement, unique to this query
+        sql: The SQL query, using positional `$1`, `$2`, ... parameters
+        params: Data to bind to the parameters of the query
+        limit: Return only the first `n` records from the result
+        kind: The kind of query the statistics of the query are recorded
+            under (see `STATS`), which defaults to the name of the statement
+
+    Returns:
+        A list of records where each record is an instance of a `NamedTuple`
+    """
+    kind = kind or name
+    start = time.perf_counter()
+    with connection() as con:
+        connected = time.perf_counter()
+        cur = con.cursor(cursor_factory=NamedTupleCursor)
+        try:
+            if name not in con.prepared:
+                cur.execute(f"PREPARE {name} AS {sql}")
+                con.prepared.add(name)
+
+            placeholders = ", ".join(["%s"] * len(params))
+            execute = f"EXECUTE {name} ({placeholders})"
+            cur.execute(execute, params)
+
+            results: List[NamedTuple]
+            if limit is not None:
+                results = cast(List[NamedTuple], cur.fetchmany(limit))
+            else:
+                results = cast(List[NamedTuple], cur.fetchall())
+
+            elapsed = time.perf_counter() - connected
+            if STATS.is_slow(elapsed):
+                capture_slow_query(
+                    cur, kind, sql, params, elapsed, len(results), (execute, params)
+                )
+        except Exception:
+            elapsed = time.perf_counter() - connected
+            STATS.record(kind, elapsed, connected - start, 0, error=True)
+            raise
+        finally:
+            cur.close()
+
+    STATS.record(kind, elapsed, connected - start, len(results))
+    return results
+
+
+def capture_slow_query(
+    cur: Any,
+    kind: str,
+    sql: str,
+    params: Any,
+    seconds: float,
+    rows: int,
+    explain: Optional[Tuple[str, Any]] = None,
+) -> None:
+    """
+    Capture a query in the slow query log (see `STATS`), along with the
+    output of `EXPLAIN (ANALYZE, BUFFERS)`, which runs the query again
+
+    Parameters:
+        cur: The cursor the query was executed with
+        kind: The kind of query
+        sql: The SQL of the query
+        params: The parameters bound to the query
+        seconds: The time taken to execute the query and fetch its results
+        rows: The number of rows returned
+        explain: The SQL and parameters to explain instead of the query,
+            e.g. to execute a prepared statement
+    """
+    plan = None
+    if STATS.explain:
+        explain_sql, explain_params = explain or (sql, params)
+        try:
+            cur.execute(f"EXPLAIN (ANALYZE, BUFFERS) {explain_sql}", explain_params)
+            plan = "\n".join(r[0] for r in cur.fetchall())
+        except psycopg2.Error as e:
+            # the results were already fetched, so only the plan is lost
+            cur.connection.rollback()
+            plan = f"EXPLAIN failed: {e}".strip()
+
+    STATS.record_slow(SlowQuery(kind, sql, params, seconds, rows, plan, time.time()))
+
+
+def load_generation() -> int:
+    """
+    The load generation of the database, which is incremented every
+    time `gutensearch load` commits new documents (see `gutensearch.cache`)
+
+    Returns:
+        The load generation, or 0 if nothing has been loaded yet
+    """
+    try:
+        records = query(
+            "SELECT generation FROM load_generation", kind="load_generation"
+        )
+    except psycopg2.errors.UndefinedTable:
+        return 0
+
+    if len(records) == 0:
+        return 0
+
+    return records[0].generation  # type: ignore
+
+
+def cache_namespace() -> Tuple[str, ...]:
+    """
+    Identifies the database searched by this module, so that cached results
+    are never shared between databases or layouts (see `gutensearch.cache`)
+
+    Returns:
+        The backend, host, port, database name and layout of the database
+    """
+    config = dbconfig()
+    return (
+        "postgres",
+        config["host"],
+        config["port"],
+        config["dbname"],
+        GUTENSEARCH_SCHEMA,
+    )
+
+
+# the results of `search_word`, `search_document` and `fuzzy_candidates`
+# are cached, see `gutensearch.cache` (use `CACHE.stats()` to size it)
+CACHE = QueryCache(load_generation, cache_namespace)
+
+# the latency of every query sent to the database, by kind, and the slow
+# query log, see `gutensearch.querystats` (use `STATS.summary()` to export them)
+STATS = QueryStats()
+
+
+@CACHE.cached
 def search_word(
-    word: str, fuzzy: bool = False, limit: Optional[int] = None
+    word: str,
+    fuzzy: bool = False,
+    limit: Optional[int] = None,
+    rank: Optional[str] = None,
+    fuzzy_index: Path = FUZZY_INDEX_PATH,
 ) -> List[NamedTuple]:
     """
     Searches the `gutensearch` database for every document with the given word
     and returns the results, ordered by the highest `count` for each document id.
+    With the `vocabulary` layout, words are transparently resolved through
+    the `vocabulary` table.
 
     Parameters:
         word: The word to search for
@@ -90,49 +506,450 @@ def search_word(
             If `True` allow search to use fuzzy word matching.
             If `False`, only return results for exact matches.
         limit: Return only the records with the top `n` most frequent words
+        rank: Order the documents by their relevance instead, either `bm25`
+            or `tfidf` (see `search_word_ranked`)
+        fuzzy_index: The path to the fuzzy word matching index, if any
 
     Returns:
         A list of records where each record is an instance of a `NamedTuple`
 
     """
+    # a phrase or two words near each other, see `search_positions`
+    if is_positional_query(word):
+        if fuzzy or rank is not None:
+            raise ValueError(
+                "Cannot search a phrase or NEAR query using fuzzy word matching "
+                "or ranking"
+            )
+        return search_positions(word, limit)
+
+    # several words combined with AND, OR and NOT, see `search_boolean`
+    if is_boolean_query(word):
+        if fuzzy or rank is not None:
+            raise ValueError(
+                "Cannot search a boolean query using fuzzy word matching or ranking"
+            )
+        return search_boolean(word, limit)
+
     # check if the word supplied is actually a word pattern such
     # as fish% or thing_
-    has_pattern = False
-    if ("%" in word) or ("_" in word):
-        has_pattern = True
+    has_pattern = is_pattern(word)
 
     if has_pattern and fuzzy:
         raise ValueError("Cannot search using both a pattern and fuzzy word matching")
 
+    if rank is not None and rank not in RANKINGS:
+        raise ValueError(f"Unknown ranking: {rank}")
+
+    if has_pattern and rank is not None:
+        return search_word_ranked(word, rank, limit)
+
     if has_pattern:
-        sql = """
+        # resolve the pattern against the (much smaller) table of distinct
+        # words first, and then look up the matches using the index
+        key = WORD_KEYS[GUTENSEARCH_SCHEMA]
+        sql = f"""
         SELECT word,
                document_id,
                count
-          FROM words
-         WHERE word LIKE %s
+          FROM {WORDS_TABLES[GUTENSEARCH_SCHEMA]}
+         WHERE {key} = ANY(ARRAY({pattern_sql(word, key)}))
          ORDER BY 3 DESC
         """.strip()
-        return query(sql, params=(word,), limit=limit)
+
+        # push the limit into the database instead of fetching every match
+        if limit is not None:
+            sql = f"{sql}\n LIMIT %(limit)s"
+        params = {"pattern": word, "limit": limit}
+        return query(sql, params, limit, kind="search_word_pattern")
 
     if fuzzy:
-        # we need to get the "corpus" of text available first
-        corpus = query_distinct_words()
-        match = closest_match(word, corpus)
+        # prefer the fuzzy word matching index built by `gutensearch load`
+        index = load_fuzzy_index(fuzzy_index)
+        candidates = [] if index is None else index.lookup(word, limit=1)
+        if len(candidates) > 0:
+            match = candidates[0].word
+        else:
+            # there is no index, or no word within its maximum edit distance,
+            # so we need to get the "corpus" of text available first
+            corpus = query_distinct_words()
+            match = closest_match(word, corpus)
+
+        return search_word(match, fuzzy=False, limit=limit, rank=rank)
 
-        return search_word(match, fuzzy=False, limit=limit)
+    if rank is not None:
+        return search_word_ranked(word, rank, limit)
 
-    sql = """
+    # a `NULL` limit returns every record
+    sql = f"""
     SELECT word,
-            document_id,
-            count
-        FROM words
-        WHERE word = %s
-        ORDER BY 3 DESC
+           document_id,
+           count
+      FROM {WORDS_TABLES[GUTENSEARCH_SCHEMA]}
+     WHERE word = $1
+     ORDER BY 3 DESC
+     LIMIT $2
     """.strip()
-    return query(sql, params=(word,), limit=limit)
+    name = f"search_word_{GUTENSEARCH_SCHEMA}"
+    return query_prepared(name, sql, (word, limit), kind="search_word")
+
 
+@CACHE.cached
+def search_boolean(query_: str, limit: Optional[int] = None) -> List[NamedTuple]:
+    """
+    Searches the `gutensearch` database for every document matching a boolean
+    query over several words (or word patterns), such as `river AND fish NOT
+    whale`, using a single query (see `gutensearch.boolean`). The posting list
+    of each word is read using the index on `words`, and the posting lists are
+    intersected (`AND`), excluded (`NOT`) and merged (`OR`) by the database,
+    which also applies the limit.
 
+    Parameters:
+        query_: The boolean query
+        limit: Return only the records of the top `n` documents
+
+    Returns:
+        A list of records where each record is an instance of a `NamedTuple`
+        with the query as the `word`, and the `document_id` and combined
+        `count` (of every word not under `NOT`) of each matching document,
+        ordered by the highest `count`
+
+    Raises:
+        ValueError: If the query is not well formed
+    """
+    table = WORDS_TABLES[GUTENSEARCH_SCHEMA]
+    key = WORD_KEYS[GUTENSEARCH_SCHEMA]
+
+    def term_sql(word: str, param: str) -> str:
+        if is_pattern(word):
+            return f"""
+            SELECT document_id,
+                   SUM(count) AS count
+              FROM {table}
+             WHERE {key} = ANY(ARRAY({pattern_sql(word, key, param)}))
+             GROUP BY document_id
+            """.strip()
+
+        return f"SELECT document_id, count FROM {table} WHERE word = %({param})s"
+
+    sql, params = boolean_sql(query_, term_sql, lambda name: f"%({name})s")
+    params["limit"] = limit
+    return query(sql, params, limit, kind="search_boolean")
+
+
+@CACHE.cached
+def search_positions(query_: str, limit: Optional[int] = None) -> List[NamedTuple]:
+    """
+    Searches the `gutensearch` database for every document holding a phrase,
+    such as `"white whale"`, or two words within a distance of each other,
+    such as `white NEAR/3 whale`, using the positional index built by
+    `gutensearch load --positions` (see `gutensearch.positions`). A single
+    query reads the positions of every word, only for the documents holding
+    all of them, and the matches in each document are then counted.
+
+    Parameters:
+        query_: The phrase (in double quotes) or `NEAR` query
+        limit: Return only the records of the top `n` documents
+
+    Returns:
+        A list of records where each record is an instance of a `NamedTuple`
+        with the query as the `word`, and the `document_id` and number of
+        matches (`count`) of each matching document, ordered by the highest
+        `count`
+
+    Raises:
+        ValueError: If the query is not well formed, or the positional index
+            has not been built
+    """
+    parsed = parse_positional_query(query_)
+    sql, params = candidates_sql(parsed)
+
+    try:
+        candidates = query(sql, params, kind="search_positions")
+    except psycopg2.errors.UndefinedTable:
+        raise ValueError(
+            "Phrase and NEAR queries need the positional index "
+            "built by `gutensearch load --positions`"
+        )
+
+    return match_documents(query_, parsed, candidates, limit)  # type: ignore
+
+
+def search_word_ranked(
+    word: str, rank: str = "bm25", limit: Optional[int] = None
+) -> List[NamedTuple]:
+    """
+    Searches the `gutensearch` database for every document with the given word
+    (or SQL string pattern), ordered by the BM25 or TF-IDF score of the word
+    in each document, using the statistics built by `gutensearch load --rank`
+    (see `gutensearch.rank`). The documents of a word are read from the index
+    on its weights in score order, so only the top `n` documents are ever
+    read, however common the word. With a pattern, the top `n` documents of
+    each matching word are read this way, and then merged by score.
+
+    Parameters:
+        word: The word (or SQL string pattern) to search for
+        rank: The ranking, either `bm25` or `tfidf` (see `gutensearch.rank.RANKINGS`)
+        limit: Return only the records with the top `n` scores
+
+    Returns:
+        A list of records where each record is an instance of a `NamedTuple`
+        with the `word`, `document_id`, `count` and `score` of each document,
+        highest score first
+
+    Raises:
+        ValueError: If the ranking statistics have not been built
+    """
+    column = WEIGHT_COLUMNS[rank]
+
+    try:
+        if is_pattern(word):
+            sql = f"""
+            SELECT w.word,
+                   w.document_id,
+                   w.count,
+                   (w.{column} * p.idf)::REAL AS score
+              FROM (SELECT f.word,
+                           {IDF[rank]} AS idf
+                      FROM document_frequencies AS f
+                     CROSS JOIN corpus_stats AS c
+                     WHERE f.word = ANY(ARRAY({pattern_sql(word)}))) AS p
+             CROSS JOIN LATERAL (
+                   SELECT word,
+                          document_id,
+                          count,
+                          {column}
+                     FROM word_weights
+                    WHERE word = p.word
+                    ORDER BY {column} DESC
+                    LIMIT %(limit)s
+                   ) AS w
+             ORDER BY 4 DESC
+             LIMIT %(limit)s
+            """.strip()
+            params = {"pattern": word, "limit": limit}
+            return query(sql, params, limit, kind=f"search_word_pattern_{rank}")
+
+        # the inverse document frequency is the same for every document,
+        # so it is computed once and the index already gives the order
+        sql = f"""
+        SELECT w.word,
+               w.document_id,
+               w.count,
+               (w.{column} * (
+                   SELECT {IDF[rank]}
+                     FROM document_frequencies AS f
+                    CROSS JOIN corpus_stats AS c
+                    WHERE f.word = $1
+               ))::REAL AS score
+          FROM word_weights AS w
+         WHERE w.word = $1
+         ORDER BY w.{column} DESC
+         LIMIT $2
+        """.strip()
+        name = f"search_word_{rank}"
+        return query_prepared(name, sql, (word, limit))
+    except psycopg2.errors.UndefinedTable:
+        raise ValueError(
+            "Ranked search needs the statistics built by `gutensearch load --rank`"
+        )
+
+
+def search_words(
+    words: Sequence[str],
+    fuzzy: bool = False,
+    limit: Optional[int] = None,
+    fuzzy_index: Path = FUZZY_INDEX_PATH,
+) -> List[NamedTuple]:
+    """
+    Searches the `gutensearch` database for the documents of many words
+    (or word patterns) at once, using a single query. The exact words are
+    looked up together using `unnest`, and a `LATERAL` subquery selects the
+    top `n` documents of each word using the index on `words`, while each
+    word pattern gets its own branch of the query (see `pattern_sql`), so
+    it can still be resolved using the indexes on the distinct words.
+
+    Parameters:
+        words: The words (or SQL string patterns) to search for
+        fuzzy:
+            If `True` search for the closest match of each word instead.
+            Word patterns are always searched as they are.
+        limit: Return only the records with the top `n` most frequent words for each term
+        fuzzy_index: The path to the fuzzy word matching index, if any
+
+    Returns:
+        A list of records where each record is an instance of a `NamedTuple`
+        with the `term` searched for and the `word`, `document_id`, `count`
+        found, grouped by term in the order they were given, and ordered by
+        the highest `count` within each term
+
+    """
+    table = WORDS_TABLES[GUTENSEARCH_SCHEMA]
+    key = WORD_KEYS[GUTENSEARCH_SCHEMA]
+
+    exact = [(i, w) for i, w in enumerate(words) if not is_pattern(w)]
+    patterns = [(i, w) for i, w in enumerate(words) if is_pattern(w)]
+
+    if fuzzy and len(exact) > 0:
+        matches = closest_matches_of([w for _, w in exact], fuzzy_index)
+        exact = [(i, w) for i, w in exact if w in matches]
+        matched = [matches[w] for _, w in exact]
+    else:
+        matched = [w for _, w in exact]
+
+    params: Dict[str, Any] = {"limit": limit}
+    branches = []
+    if len(exact) > 0:
+        params["positions"] = [i for i, _ in exact]
+        params["terms"] = [w for _, w in exact]
+        params["words"] = matched
+        branches.append(
+            f"""
+            SELECT t.position,
+                   t.term,
+                   w.word,
+                   w.document_id,
+                   w.count
+              FROM unnest(%(positions)s::INTEGER[], %(terms)s::TEXT[], %(words)s::TEXT[])
+                   AS t(position, term, word)
+             CROSS JOIN LATERAL (
+                   SELECT word,
+                          document_id,
+                          count
+                     FROM {table}
+                    WHERE word = t.word
+                    ORDER BY 3 DESC
+                    LIMIT %(limit)s
+                   ) AS w
+            """.strip()
+        )
+
+    for n, (i, pattern) in enumerate(patterns):
+        param = f"pattern_{n}"
+        params[param] = pattern
+        branches.append(
+            f"""
+            (SELECT {i} AS position,
+                    %({param})s AS term,
+                    word,
+                    document_id,
+                    count
+               FROM {table}
+              WHERE {key} = ANY(ARRAY({pattern_sql(pattern, key, param)}))
+              ORDER BY count DESC
+              LIMIT %(limit)s)
+            """.strip()
+        )
+
+    if len(branches) == 0:
+        return []
+
+    union = "\nUNION ALL\n".join(branches)
+    sql = f"""
+    SELECT term,
+           word,
+           document_id,
+           count
+      FROM ({union}) AS results
+     ORDER BY position, count DESC
+    """.strip()
+    return query(sql, params=params, kind="search_words")
+
+
+def is_pattern(word: str) -> bool:
+    """
+    Check whether a word is actually a word pattern, such as fish% or thing_
+
+    Parameters:
+        word: The word to check
+
+    Returns:
+        `True` if the word contains any SQL string pattern wildcards
+    """
+    return ("%" in word) or ("_" in word)
+
+
+def closest_matches_of(
+    words: Sequence[str], fuzzy_index: Path = FUZZY_INDEX_PATH
+) -> Dict[str, str]:
+    """
+    Find the closest matching word in the database for each of the
+    given words, using the fuzzy word matching index if it exists, or
+    comparing every distinct word in the database otherwise.
+
+    Parameters:
+        words: The words to perform a "fuzzy match" on
+        fuzzy_index: The path to the fuzzy word matching index, if any
+
+    Returns:
+        The closest match of each word, omitting any word without a match
+    """
+    index = load_fuzzy_index(fuzzy_index)
+    matches = {}
+    missing = set(words)
+    if index is not None:
+        for w in set(words):
+            candidates = index.lookup(w, limit=1)
+            if len(candidates) > 0:
+                matches[w] = candidates[0].word
+                missing.discard(w)
+
+    # compare every distinct word for those without a match in the index
+    if len(missing) > 0:
+        corpus = query_distinct_words()
+        matches.update({w: closest_match(w, corpus) for w in missing})
+
+    return matches
+
+
+def pattern_sql(pattern: str, column: str = "word", param: str = "pattern") -> str:
+    """
+    Build the SQL to find every distinct word matching the given SQL string
+    pattern. Besides the `LIKE` condition itself, the equivalent condition
+    on the reversed word is added for patterns that start with a wildcard
+    such as `%ing`, so the query planner can choose between the indexes on
+    the distinct words (see `schema.sql`): a prefix match on the word, a
+    prefix match on the reversed word, or a trigram index for any other
+    pattern.
+
+    Parameters:
+        pattern: The SQL string pattern, such as `fish%` or `doctor_`
+        column: The column to select, either `word` or `word_id`
+        param: The name of the parameter holding the pattern
+
+    Returns:
+        The SQL query, with a single `%(pattern)s` parameter (or the given name)
+    """
+    sql = f"""
+    SELECT {column}
+      FROM {DISTINCT_WORDS_TABLES[GUTENSEARCH_SCHEMA]}
+     WHERE word LIKE %({param})s
+    """.strip()
+
+    # reversing a pattern with escaped wildcards would change its meaning
+    if pattern[:1] in ("%", "_") and "\\" not in pattern:
+        sql = f"{sql}\n       AND reverse(word) LIKE reverse(%({param})s)"
+
+    return sql
+
+
+def expand_pattern(pattern: str) -> List[str]:
+    """
+    Find every distinct word in the database matching the given SQL
+    string pattern, such as `fish%` or `doctor_`
+
+    Parameters:
+        pattern: The SQL string pattern
+
+    Returns:
+        The matching words, sorted alphabetically
+    """
+    sql = f"{pattern_sql(pattern)}\n ORDER BY 1"
+    records = query(sql, params={"pattern": pattern}, kind="expand_pattern")
+    return [r.word for r in records]  # type: ignore
+
+
+@CACHE.cached
 def search_document(
     id_: int, min_length: Optional[int] = None, limit: Optional[int] = None
 ) -> List[NamedTuple]:
@@ -149,27 +966,21 @@ def search_document(
         A list of records where each record is an instance of a `NamedTuple`
 
     """
-    if min_length is not None:
-        sql = """
-        SELECT word,
-               document_id,
-               count
-          FROM words
-         WHERE document_id = %s
-           AND LENGTH(word) >= %s
-         ORDER BY 3 DESC
-        """.strip()
-        return query(sql, params=(id_, min_length), limit=limit)
-
-    sql = """
+    # a minimum length of 0 includes every word, and a `NULL` limit
+    # returns every record
+    sql = f"""
     SELECT word,
            document_id,
            count
-      FROM words
-     WHERE document_id = %s
+      FROM {WORDS_TABLES[GUTENSEARCH_SCHEMA]}
+     WHERE document_id = $1
+       AND LENGTH(word) >= $2
      ORDER BY 3 DESC
+     LIMIT $3
     """.strip()
-    return query(sql, params=(id_,), limit=limit)
+    name = f"search_document_{GUTENSEARCH_SCHEMA}"
+    params = (int(id_), min_length or 0, limit)
+    return query_prepared(name, sql, params, kind="search_document")
 
 
 def query_distinct_words(sort: bool = False) -> List[str]:
@@ -184,8 +995,37 @@ def query_distinct_words(sort: bool = False) -> List[str]:
         A list of every distinct word in the database
 
     """
-    records = query("SELECT word FROM distinct_words")
+    sql = f"SELECT word FROM {DISTINCT_WORDS_TABLES[GUTENSEARCH_SCHEMA]}"
+    records = query(sql, kind="distinct_words")
     if sort:
         return sorted([r.word for r in records])  # type: ignore
 
     return [r.word for r in records]  # type: ignore
+
+
+@CACHE.cached
+def fuzzy_candidates(
+    word: str, limit: int = 10, fuzzy_index: Path = FUZZY_INDEX_PATH
+) -> List[Candidate]:
+    """
+    Find the words in the database that most closely match the given word.
+    The fuzzy word matching index built by `gutensearch load` is used if it
+    exists, otherwise every distinct word in the database is compared.
+
+    Parameters:
+        word: The word to perform a "fuzzy match" on
+        limit: Return only the top `n` closest matches
+        fuzzy_index: The path to the fuzzy word matching index, if any
+
+    Returns:
+        The closest matching words and their scores, highest score first
+
+    """
+    index = load_fuzzy_index(fuzzy_index)
+    if index is not None:
+        candidates = index.lookup(word, limit)
+        if len(candidates) > 0:
+            return candidates
+
+    # no word is within the maximum edit distance, so compare every word
+    return closest_matches(word, query_distinct_words(), limit)
@@ -3,14 +3,33 @@ Downloads and saves a local copy of every English document
 (in the form of a .txt) from Project Gutenberg in a simple,
 and respectful way. Alternatively, the download can be
 parameterized to limit the total number of documents downloaded.
+
+Documents are fetched concurrently by an asyncio download engine,
+while a global token bucket limits the rate of requests sent to the
+mirror, no matter how many fetches are in flight. Failed requests
+(connection errors, timeouts, and `429`/`5xx` responses) are retried
+with an exponential backoff.
 """
 
 import os
 import time
 import json
+import random
+import asyncio
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+)
 from pathlib import Path
 
 import requests
@@ -20,8 +39,77 @@ from .parse import parse_gutenberg_index
 
 DATETIME_FMT = "%Y-%m-%d %H:%M:%S"
 
+# the Project Gutenberg mirror to download documents from
+GUTENSEARCH_MIRROR = os.getenv("GUTENSEARCH_MIRROR", "https://aleph.gutenberg.org")
+
+# the number of documents fetched concurrently
+CONCURRENCY = 4
+
+# the maximum number of requests per second sent to the mirror
+RATE = 1.0
+
+# the number of times a failed request is retried
+RETRIES = 3
+
+# the number of seconds to wait before the first retry (doubled for each retry)
+BACKOFF = 2.0
+
+# the number of seconds to wait for the mirror to respond
+TIMEOUT = 60.0
+
+# responses worth retrying, since the mirror may recover from them
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class FetchedDocument(NamedTuple):
+    """
+    A document downloaded from the mirror
 
-def save_metadata(meta: Dict[int, Dict[str, str]], path: Path) -> None:
+    Parameters:
+        document_id: The id of the document
+        url: The URL of the page of the document
+        content: The contents of the text file of the document, as served
+        encoding: The encoding used to decode the contents
+    """
+
+    document_id: int
+    url: str
+    content: bytes
+    encoding: str
+
+    @property
+    def text(self) -> str:
+        """
+        The contents of the document, decoded the same way as by `requests`
+        """
+        return str(self.content, self.encoding, errors="replace")
+
+
+class Response(NamedTuple):
+    """
+    The parts of an HTTP response used by the download engine
+
+    Parameters:
+        status: The HTTP status code
+        content: The body of the response
+        encoding: The encoding used to decode the body
+        retry_after: The number of seconds the server asked to wait, if any
+    """
+
+    status: int
+    content: bytes
+    encoding: str
+    retry_after: Optional[float]
+
+    @property
+    def text(self) -> str:
+        """
+        The body of the response, decoded the same way as by `requests`
+        """
+        return str(self.content, self.encoding, errors="replace")
+
+
+def save_metadata(meta: Dict[str, Dict[str, str]], path: Path) -> None:
     """
     Convenience function to save metadata to the given path
 
@@ -45,27 +133,70 @@ def save_document(doc: str, path: Path) -> None:
         f.write(doc)
 
 
-def document_url(id_: int) -> Optional[str]:
+def document_url(id_: int, mirror: str = GUTENSEARCH_MIRROR) -> Optional[str]:
     """
     Generate the URL for the given document id,
     if one can be correctly inferred.
 
+    The documents of single digit ids are kept in the `0/` directory of
+    the mirror, e.g. `0/7/`. Before this, no URL was inferred for them
+    (`None` was returned), so they were never downloaded.
+
     Parameters:
         id_:
             The document id assigned by Project Gutenberg.
             See the [Gutenberg Index](https://www.gutenberg.org/dirs/GUTINDEX.ALL)
             for more information
+        mirror:
+            The base URL of the Project Gutenberg mirror
 
     Returns:
         The URL string if it can be inferred, `None` otherwise
     """
-    BASE_URL = "https://aleph.gutenberg.org"
+    if id_ < 0:
+        return None
+
+    # single digit ids are kept in the `0/` directory
+    prefix = str(id_)[:-1] or "0"
+    return f"{mirror.rstrip('/')}/{'/'.join(prefix)}/{id_}/"
+
+
+def parse_links(html: str) -> List[str]:
+    """
+    Extract the target of every `<a>` tag from the given HTML
+
+    Parameters:
+        html: The HTML of the page
+
+    Returns:
+        Every link present from the page
+    """
+    soup = BeautifulSoup(html, features="html.parser")
+    links = [t.attrs.get("href") for t in soup.find_all("a")]
 
-    prefix = str(id_)[:-1]
-    if len(prefix) == 0:
-        # don't know where to find single id docs (yet)
+    return [link for link in links if link is not None]
+
+
+def choose_text_file(links: List[str]) -> Optional[str]:
+    """
+    Choose the text file to download from the links of a document
+    page, breaking ties in this order:
+
+    - {id}.txt
+    - {id}-0.txt
+    - {id}-8.txt
+
+    Parameters:
+        links: Every link present from the page
+
+    Returns:
+        The name of the text file, `None` if there are no text files
+    """
+    textfiles = sorted(os.path.splitext(f)[0] for f in links if f.endswith(".txt"))
+    if len(textfiles) == 0:
         return None
-    return f"{BASE_URL}/{'/'.join(prefix)}/{id_}/"
+
+    return f"{textfiles[0]}.txt"
 
 
 def get_site_urls(url: str) -> Optional[List[str]]:
@@ -85,62 +216,52 @@ def get_site_urls(url: str) -> Optional[List[str]]:
     """
     log = logging.getLogger("gutensearch.download.get_site_urls")
     try:
-        response = requests.get(url)
+        response = requests.get(url, timeout=TIMEOUT)
         response.raise_for_status()
     except Exception as e:
         log.exception(e)
         return None
 
-    soup = BeautifulSoup(response.text, features="html.parser")
-    links = [t.attrs.get("href") for t in soup.find_all("a")]
-
-    return [link for link in links if link is not None]
+    return parse_links(response.text)
 
 
-def download_document_text(id_: int) -> Optional[str]:
+def download_document_text(id_: int, mirror: str = GUTENSEARCH_MIRROR) -> Optional[str]:
     """
     Download the contents of the text file from the page
-    for the provided document id. If more than one text
-    files are found, the function will break ties in this order:
-
-    - {id}.txt
-    - {id}-0.txt
-    - {id}-8.txt
-
+    for the provided document id (see `choose_text_file`).
     If no text files are found in the page, then
     the function will return `None`
 
+    This function fetches a single document without any rate limiting,
+    use `download_gutenberg_documents` to download many documents.
+
     Parameters:
         id_:
             The document id assigned by Project Gutenberg.
             See the [Gutenberg Index](https://www.gutenberg.org/dirs/GUTINDEX.ALL)
             for more information
+        mirror:
+            The base URL of the Project Gutenberg mirror
 
     Returns:
         The text, decoded from the .txt file if one is found,
         `None` if no .txt files are found otherwise.
     """
     log = logging.getLogger("gutensearch.download.download_document_text")
-    url = document_url(id_)
+    url = document_url(id_, mirror)
     if url is None:
         return None
 
-    time.sleep(1)
     files = get_site_urls(url)
     if files is None:
         return None
 
-    textfiles = [os.path.splitext(f)[0] for f in files if f.endswith(".txt")]
-    textfiles = sorted(textfiles)
-
-    if len(textfiles) == 0:
+    textfile = choose_text_file(files)
+    if textfile is None:
         return None
 
-    # use the first item as the text to download
-    time.sleep(1)
-    url = f"{url}{textfiles[0]}.txt"
     try:
-        response = requests.get(url)
+        response = requests.get(f"{url}{textfile}", timeout=TIMEOUT)
         response.raise_for_status()
     except Exception as e:
         log.exception(e)
@@ -149,11 +270,288 @@ def download_document_text(id_: int) -> Optional[str]:
     return response.text
 
 
+class TokenBucket:
+    """
+    An asyncio token bucket limiting the rate of requests. Tokens are
+    added continuously at `rate` tokens per second, up to `capacity`
+    tokens, and every request takes one token (waiting for it if the
+    bucket is empty). Waiting requests are served in order.
+
+    Parameters:
+        rate: The number of tokens added per second (unlimited if not positive)
+        capacity: The maximum number of tokens, i.e. the size of a burst
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def acquire(self) -> None:
+        """
+        Take a token from the bucket, waiting until one is available
+        """
+        if self.rate <= 0:
+            return
+
+        # created lazily, so that it belongs to the running event loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Downloader:
+    """
+    Fetches pages from the mirror for the asyncio download engine.
+    Requests are sent with `requests` from a pool of threads (one
+    session per thread, to reuse connections), every request first
+    takes a token from the shared `TokenBucket`, and failed requests
+    are retried with an exponential backoff (with jitter), or after
+    the delay requested by the mirror with a `Retry-After` header.
+
+    Parameters:
+        mirror: The base URL of the Project Gutenberg mirror
+        concurrency: The number of requests that may be in flight at once
+        rate: The maximum number of requests per second
+        retries: The number of times a failed request is retried
+        backoff: The number of seconds to wait before the first retry
+        timeout: The number of seconds to wait for the mirror to respond
+    """
+
+    def __init__(
+        self,
+        mirror: str = GUTENSEARCH_MIRROR,
+        concurrency: int = CONCURRENCY,
+        rate: float = RATE,
+        retries: int = RETRIES,
+        backoff: float = BACKOFF,
+        timeout: float = TIMEOUT,
+    ):
+        self.mirror = mirror
+        self.bucket = TokenBucket(rate)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max(concurrency, 1))
+        self.local = threading.local()
+
+    def _get(self, url: str) -> Response:
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = self.local.session = requests.Session()
+
+        response = session.get(url, timeout=self.timeout)
+        retry_after = response.headers.get("Retry-After")
+        return Response(
+            response.status_code,
+            response.content if response.ok else b"",
+            # guessing the encoding is slow, so it is done by this thread
+            response.encoding or response.apparent_encoding or "utf-8",
+            float(retry_after) if retry_after and retry_after.isdigit() else None,
+        )
+
+    async def get(self, url: str) -> Optional[Response]:
+        """
+        Fetch the given URL, retrying it if it fails
+
+        Parameters:
+            url: The URL of the page
+
+        Returns:
+            The response, `None` if the page could not be fetched
+        """
+        log = logging.getLogger("gutensearch.download.Downloader")
+        loop = asyncio.get_running_loop()
+
+        for attempt in range(self.retries + 1):
+            await self.bucket.acquire()
+            wait = None
+            try:
+                response = await loop.run_in_executor(self.executor, self._get, url)
+            except requests.RequestException as e:
+                error = str(e)
+            else:
+                if 200 <= response.status < 300:
+                    return response
+
+                error = f"{response.status} Error for url: {url}"
+                if response.status not in RETRY_STATUSES:
+                    log.error(error)
+                    return None
+                wait = response.retry_after
+
+            if attempt == self.retries:
+                log.error(f"Giving up after {attempt + 1} attempts: {error}")
+                return None
+
+            if wait is None:
+                wait = self.backoff * 2**attempt * random.uniform(0.5, 1.5)
+            log.warning(f"Retrying in {wait:.1f}s: {error}")
+            await asyncio.sleep(wait)
+
+        return None
+
+    async def document(self, id_: int) -> Optional[FetchedDocument]:
+        """
+        Download the text file for the provided document id
+        (see `download_document_text`)
+
+        Parameters:
+            id_: The document id assigned by Project Gutenberg
+
+        Returns:
+            The document, `None` if it could not be downloaded
+        """
+        url = document_url(id_, self.mirror)
+        if url is None:
+            return None
+
+        page = await self.get(url)
+        if page is None:
+            return None
+
+        textfile = choose_text_file(parse_links(page.text))
+        if textfile is None:
+            return None
+
+        response = await self.get(f"{url}{textfile}")
+        if response is None:
+            return None
+
+        return FetchedDocument(id_, url, response.content, response.encoding)
+
+    def close(self) -> None:
+        """
+        Shut down the threads sending the requests
+        """
+        self.executor.shutdown(wait=False)
+
+
+async def fetch_documents(
+    ids: Iterable[int],
+    downloader: Downloader,
+    handle: Callable[[FetchedDocument], Awaitable[None]],
+    concurrency: int = CONCURRENCY,
+    limit: Optional[int] = None,
+) -> int:
+    """
+    Download the given documents concurrently, passing each document
+    to `handle` as soon as it has been downloaded. Documents that can
+    not be downloaded are skipped.
+
+    Parameters:
+        ids: The document id's to download, in order
+        downloader: The downloader fetching the pages from the mirror
+        handle: The coroutine function called with each downloaded document
+        concurrency: The number of documents fetched concurrently
+        limit: Stop after a given number of documents have been downloaded
+
+    Returns:
+        The number of documents downloaded
+    """
+    log = logging.getLogger("gutensearch.download.fetch_documents")
+
+    # the workers share one iterator, so each id is downloaded once
+    pending: Iterator[int] = iter(ids)
+    counter = 0
+
+    async def worker() -> None:
+        nonlocal counter
+        for i in pending:
+            if limit is not None and counter >= limit:
+                return
+
+            document = await downloader.document(i)
+            if document is None:
+                log.info(f"Skipping document id: {i}")
+                continue
+
+            # other documents may have been downloaded in the meantime
+            if limit is not None and counter >= limit:
+                return
+
+            counter += 1
+            await handle(document)
+
+    await asyncio.gather(*(worker() for _ in range(max(concurrency, 1))))
+    return counter
+
+
+async def download_documents(
+    path: Path,
+    ids: Iterable[int],
+    meta: Dict[str, Dict[str, str]],
+    downloader: Downloader,
+    concurrency: int = CONCURRENCY,
+    limit: Optional[int] = None,
+) -> int:
+    """
+    Download the given documents concurrently, saving each one as
+    `{id}.txt` in the given directory and recording its metadata
+
+    Parameters:
+        path: The directory to save the documents to
+        ids: The document id's to download, in order
+        meta: The metadata of the downloaded documents, updated in place
+        downloader: The downloader fetching the pages from the mirror
+        concurrency: The number of documents fetched concurrently
+        limit: Stop after a given number of documents have been saved
+
+    Returns:
+        The number of documents saved
+    """
+    log = logging.getLogger("gutensearch.download.download_gutenberg_documents")
+    meta_path = path / ".meta.json"
+    loop = asyncio.get_running_loop()
+    counter = 0
+
+    async def save(document: FetchedDocument) -> None:
+        nonlocal counter
+
+        # save the file contents
+        filepath = path / f"{document.document_id}.txt"
+        log.info(f"[{counter}/{limit}] Saving document to path: {filepath}")
+        await loop.run_in_executor(None, save_document, document.text, filepath)
+        counter += 1
+
+        # and record the metadata, indexing by document id
+        meta[str(document.document_id)] = {
+            "url": document.url,
+            "datetime": datetime.now().strftime(DATETIME_FMT),
+            "filepath": str(filepath.resolve()),
+        }
+
+        # save metadata every 10 downloaded documents
+        if counter % 10 == 0:
+            log.info("Saving metadata checkpoint")
+            save_metadata(meta, meta_path)
+
+    return await fetch_documents(ids, downloader, save, concurrency, limit)
+
+
 def download_gutenberg_documents(
     path: Path,
     limit: Optional[int] = None,
-    delay: int = 2,
+    delay: Optional[float] = None,
     only: Optional[List[int]] = None,
+    concurrency: int = CONCURRENCY,
+    rate: float = RATE,
+    retries: int = RETRIES,
+    mirror: str = GUTENSEARCH_MIRROR,
 ) -> None:
     """
     Utility function to download every .txt document from
@@ -171,16 +569,25 @@ def download_gutenberg_documents(
             if `None`, continue downloading until all documents
             have been saved locally.
         delay:
-            Delay execution of consecutive requests, in seconds
+            Delay execution of consecutive requests, in seconds.
+            If given, this overrides `rate` with `1 / delay`
         only:
             List of document id's to exclusively download
+        concurrency:
+            The number of documents fetched concurrently
+        rate:
+            The maximum number of requests per second sent to the mirror
+        retries:
+            The number of times a failed request is retried
+        mirror:
+            The base URL of the Project Gutenberg mirror
 
     """
     log = logging.getLogger("gutensearch.download.download_gutenberg_documents")
 
     # track download metadata such as url, datetime, path
     meta_path = path / ".meta.json"
-    meta: Dict[int, Dict[str, str]] = {}
+    meta: Dict[str, Dict[str, str]] = {}
 
     # if the destination directory doesn't exist, create it
     if os.path.exists(path):
@@ -197,43 +604,16 @@ def download_gutenberg_documents(
     else:
         # download the entire list first
         log.info("Downloading project gutenberg document index")
-        time.sleep(1)
         ids = parse_gutenberg_index()
 
-    # begin download each document
-    counter: int = 0
-    for i in ids:
-        if limit is not None:
-            if counter >= limit:
-                log.info("Saving metadata and exiting")
-                save_metadata(meta, meta_path)
-
-        url = document_url(i)
-        if url is None:
-            log.info(f"Skipping document id: {i}")
-            continue
-
-        # wait between consecutive requests
-        time.sleep(delay)
-        text = download_document_text(i)
-        if text is None:
-            log.info(f"Skipping document id: {i}")
-            continue
-
-        # save the file contents
-        filepath = path / f"{i}.txt"
-        log.info(f"[{counter}/{limit}] Saving document to path: {filepath}")
-        save_document(text, filepath)
-        counter += 1
-
-        # and record the metadata, indexing by document id
-        meta[i] = {
-            "url": url,
-            "datetime": datetime.now().strftime(DATETIME_FMT),
-            "filepath": str(filepath.resolve()),
-        }
+    if delay is not None and delay > 0:
+        rate = 1 / delay
 
-        # save metadata every 10 downloaded documents
-        if counter % 10 == 0:
-            log.info("Saving metadata checkpoint")
-            save_metadata(meta, meta_path)
+    downloader = Downloader(mirror, concurrency, rate, retries)
+    try:
+        asyncio.run(download_documents(path, ids, meta, downloader, concurrency, limit))
+    finally:
+        # also save the metadata of an interrupted download
+        log.info("Saving metadata and exiting")
+        save_metadata(meta, meta_path)
+        downloader.close()
@@ -0,0 +1,304 @@
+"""
+This module provides a persistent index for fast fuzzy word matching,
+based on the "symmetric delete" spelling correction algorithm (SymSpell).
+Every word in the vocabulary is indexed under each string that can be
+produced by deleting up to `max_distance` characters from its prefix.
+At query time, the same deletes are generated for the query word, and
+only the words sharing at least one delete are compared and scored,
+rather than every word in the vocabulary.
+
+The index is written to a single binary file made of flat arrays,
+which is memory-mapped when it is opened so that it can be queried
+with practically no start-up cost.
+"""
+
+import os
+import sys
+import mmap
+import struct
+import zlib
+from array import array
+from difflib import SequenceMatcher
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Iterable, List, Optional, Set, cast
+
+from .parse import Candidate
+
+# the default location of the fuzzy word matching index
+FUZZY_INDEX_PATH = Path(
+    os.getenv(
+        "GUTENSEARCH_FUZZY_INDEX", str(Path.home() / ".gutensearch" / "fuzzy.idx")
+    )
+)
+
+# the maximum edit distance between a word and any of its matches
+MAX_DISTANCE = 2
+
+# only the first `n` characters of each word are used to generate deletes
+PREFIX_LENGTH = 7
+
+MAGIC = b"GSFUZZY1"
+
+# magic, byte order, max distance, prefix length, buckets, words, postings, blob size
+HEADER = struct.Struct("<8s?IIQQQQ")
+
+
+def deletes(word: str, max_distance: int = MAX_DISTANCE) -> Set[str]:
+    """
+    Generate every string that can be produced by deleting
+    up to `max_distance` characters from the given word,
+    including the word itself.
+
+    Parameters:
+        word: The word to generate deletes for
+        max_distance: The maximum number of characters to delete
+
+    Returns:
+        The set of unique deletes
+    """
+    results = {word}
+    edges = {word}
+    for _ in range(max_distance):
+        edges = {w[:i] + w[i + 1 :] for w in edges for i in range(len(w))}
+        results.update(edges)
+
+    return results
+
+
+def edit_distance(a: str, b: str) -> int:
+    """
+    Compute the (optimal string alignment) Damerau-Levenshtein distance
+    between two words, where insertions, deletions, substitutions and
+    transpositions of adjacent characters each count as a single edit.
+
+    Parameters:
+        a: The first word
+        b: The second word
+
+    Returns:
+        The number of edits needed to turn one word into the other
+    """
+    previous: List[int] = []
+    current = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(
+                previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost
+            )
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+
+    return current[-1]
+
+
+def _bucket(delete: str) -> int:
+    return zlib.crc32(delete.encode("utf-8"))
+
+
+def _pad(n: int) -> bytes:
+    # pad each section of the file to a multiple of 8 bytes
+    return b"\0" * (-n % 8)
+
+
+def build_fuzzy_index(
+    words: Iterable[str],
+    path: Path = FUZZY_INDEX_PATH,
+    max_distance: int = MAX_DISTANCE,
+    prefix_length: int = PREFIX_LENGTH,
+) -> None:
+    """
+    Build the fuzzy word matching index for the given vocabulary
+    and save it to the given path, replacing any existing index.
+
+    Parameters:
+        words: Every distinct word in the vocabulary
+        path: The path of the index file to write
+        max_distance: The maximum edit distance between a word and its matches
+        prefix_length: Only the first `n` characters of each word generate deletes
+    """
+    vocabulary = sorted(set(words))
+
+    # hash every delete of every word, without ever sorting the (very large)
+    # list of deletes: a counting sort places each word id in its bucket
+    hashes = array("I")
+    sizes = array("I")
+    for w in vocabulary:
+        keys = {_bucket(d) for d in deletes(w[:prefix_length], max_distance)}
+        hashes.extend(keys)
+        sizes.append(len(keys))
+
+    # use (roughly) as many buckets as there are deletes
+    buckets = 1 << max(len(hashes) - 1, 1).bit_length()
+    mask = buckets - 1
+
+    offsets = array("I", bytes(4 * (buckets + 1)))
+    for h in hashes:
+        offsets[(h & mask) + 1] += 1
+    for b in range(buckets):
+        offsets[b + 1] += offsets[b]
+
+    postings = array("I", bytes(4 * len(hashes)))
+    cursor = offsets[:-1]
+    i = 0
+    for word_id, size in enumerate(sizes):
+        for h in hashes[i : i + size]:
+            b = h & mask
+            postings[cursor[b]] = word_id
+            cursor[b] += 1
+        i += size
+
+    # the words are stored as a single blob, along with their offsets
+    blob = b"".join(w.encode("utf-8") for w in vocabulary)
+    word_offsets = array("I", [0])
+    for w in vocabulary:
+        word_offsets.append(word_offsets[-1] + len(w.encode("utf-8")))
+
+    header = HEADER.pack(
+        MAGIC,
+        sys.byteorder == "little",
+        max_distance,
+        prefix_length,
+        buckets,
+        len(vocabulary),
+        len(postings),
+        len(blob),
+    )
+
+    # write to a temporary file first so readers never see a partial index
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        for section in (header, word_offsets.tobytes(), blob, offsets.tobytes()):
+            f.write(section)
+            f.write(_pad(len(section)))
+        f.write(postings.tobytes())
+
+    os.replace(tmp, path)
+
+
+class FuzzyIndex:
+    """
+    A read-only, memory-mapped fuzzy word matching index,
+    see `build_fuzzy_index`.
+
+    Parameters:
+        path: The path of the index file
+
+    Raises:
+        ValueError: If the file is not a valid fuzzy word matching index
+    """
+
+    def __init__(self, path: Path = FUZZY_INDEX_PATH):
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        view = memoryview(self.mmap)
+        (
+            magic,
+            little,
+            self.max_distance,
+            self.prefix_length,
+            self.buckets,
+            nwords,
+            npostings,
+            nblob,
+        ) = HEADER.unpack_from(view)
+
+        if magic != MAGIC:
+            raise ValueError(f"Not a fuzzy word matching index: {path}")
+        if little != (sys.byteorder == "little"):
+            raise ValueError(f"Fuzzy word matching index has wrong byte order: {path}")
+
+        position = 0
+
+        def section(size: int, typecode: str = "B") -> memoryview:
+            nonlocal position
+            start, position = position, position + size + (-size % 8)
+            return view[start : start + size].cast(cast(Any, typecode))
+
+        section(HEADER.size)
+        self.word_offsets = section(4 * (nwords + 1), "I")
+        self.blob = section(nblob)
+        self.offsets = section(4 * (self.buckets + 1), "I")
+        self.postings = section(4 * npostings, "I")
+        self.view = view
+
+    def __len__(self) -> int:
+        return len(self.word_offsets) - 1
+
+    def word(self, word_id: int) -> str:
+        """
+        Look up a word in the vocabulary by its id
+
+        Parameters:
+            word_id: The id (position) of the word in the sorted vocabulary
+
+        Returns:
+            The word
+        """
+        start, end = self.word_offsets[word_id], self.word_offsets[word_id + 1]
+        return bytes(self.blob[start:end]).decode("utf-8")
+
+    def lookup(self, word: str, limit: int = 10) -> List[Candidate]:
+        """
+        Find the words in the vocabulary within the maximum edit
+        distance of the given word, ordered by the highest comparison
+        "ratio" (the same scoring used by `gutensearch.parse.closest_match`).
+
+        Parameters:
+            word: The word to perform a "fuzzy match" on
+            limit: Return only the top `n` closest matches
+
+        Returns:
+            The closest matching words and their scores
+        """
+        mask = self.buckets - 1
+        ids: Set[int] = set()
+        for d in deletes(word[: self.prefix_length], self.max_distance):
+            b = _bucket(d) & mask
+            ids.update(self.postings[self.offsets[b] : self.offsets[b + 1]])
+
+        candidates = []
+        for word_id in ids:
+            w = self.word(word_id)
+            if abs(len(w) - len(word)) > self.max_distance:
+                continue
+            if edit_distance(word, w) > self.max_distance:
+                continue
+
+            score = SequenceMatcher(None, word, w).ratio()
+            candidates.append(Candidate(w, score))
+
+        candidates.sort(key=lambda c: (-c.score, c.word))
+        return candidates[:limit]
+
+    def close(self) -> None:
+        """
+        Release the memory-mapped file
+        """
+        self.word_offsets.release()
+        self.blob.release()
+        self.offsets.release()
+        self.postings.release()
+        self.view.release()
+        self.mmap.close()
+
+
+@lru_cache(maxsize=None)
+def load_fuzzy_index(path: Path = FUZZY_INDEX_PATH) -> Optional[FuzzyIndex]:
+    """
+    Lazily open (and cache) the fuzzy word matching index
+
+    Parameters:
+        path: The path of the index file
+
+    Returns:
+        The index, or `None` if the index file does not exist
+    """
+    if not os.path.exists(path):
+        return None
+
+    return FuzzyIndex(path)
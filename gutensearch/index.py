@@ -0,0 +1,604 @@
+"""
+This module provides a read-only, embedded inverted index that can be
+searched without a database server. Since the word counts are written
+once and never modified, they are stored as flat arrays in a directory
+of files which are memory-mapped when the index is opened:
+
+- `vocabulary.*`: every distinct word, sorted, so a word can be found
+  using a binary search
+- `postings.*`: for each word, the documents it occurs in and its count
+  in each document, sorted by the highest count first
+- `documents.*` and `terms.*`: for each document (in CSR layout), the
+  words it contains and their counts, sorted by the highest count first,
+  along with the TF-IDF vector of the document used to find similar
+  documents (see `gutensearch.similar`)
+
+The index is built from the database using `gutensearch build-index`.
+"""
+
+import os
+import re
+import sys
+import json
+import mmap
+import sqlite3
+import heapq
+import logging
+from array import array
+from bisect import bisect_left
+from contextlib import ExitStack
+from itertools import islice
+from pathlib import Path
+from typing import (
+    Any,
+    BinaryIO,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+    cast,
+)
+
+from .database import is_pattern
+from .fuzzy import FUZZY_INDEX_PATH, load_fuzzy_index
+from .parse import closest_match
+from .similar import (
+    SimilarRecord,
+    TermVectors,
+    inverse_document_frequency,
+    normalize,
+    similar_documents,
+    term_weight,
+)
+
+# the default location of the embedded inverted index
+INDEX_PATH = Path(
+    os.getenv("GUTENSEARCH_INDEX", str(Path.home() / ".gutensearch" / "index"))
+)
+
+VERSION = 2
+
+# the array type code of each file in the index
+FILES = {
+    "vocabulary.blob": "B",
+    "vocabulary.offsets": "Q",
+    "postings.offsets": "Q",
+    "postings.documents": "I",
+    "postings.counts": "I",
+    "documents.ids": "I",
+    "documents.offsets": "Q",
+    "documents.norms": "f",
+    "terms.words": "I",
+    "terms.counts": "I",
+    "terms.weights": "f",
+}
+
+
+class Record(NamedTuple):
+    """
+    A single search result, with the same fields as the
+    records returned by `gutensearch.database.search_word`
+    """
+
+    word: str
+    document_id: int
+    count: int  # type: ignore[assignment]
+
+
+class TermRecord(NamedTuple):
+    """
+    A single result of a search for many words at once, with the same
+    fields as the records returned by `gutensearch.database.search_words`
+    """
+
+    term: str
+    word: str
+    document_id: int
+    count: int  # type: ignore[assignment]
+
+
+class ArrayWriter:
+    """
+    Incrementally append values to an array-backed file, buffering
+    them in memory and flushing them to disk in large chunks
+
+    Parameters:
+        f: The binary file to write to
+        typecode: The `array` type code of the values
+        buffer_size: The number of values to buffer before flushing
+    """
+
+    def __init__(self, f: BinaryIO, typecode: str, buffer_size: int = 1 << 20):
+        self.f = f
+        self.typecode = typecode
+        self.buffer_size = buffer_size
+        self.buffer: "array[Any]" = array(typecode)
+        self.length = 0
+
+    def append(self, value: Union[int, float]) -> None:
+        self.buffer.append(value)
+        self.length += 1
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self) -> None:
+        self.buffer.tofile(self.f)
+        self.buffer = array(self.typecode)
+
+
+def like_to_regex(pattern: str) -> "re.Pattern[str]":
+    """
+    Convert a SQL string pattern such as `fish%` or `doctor_`
+    into the equivalent regular expression
+
+    Parameters:
+        pattern: The SQL string pattern
+
+    Returns:
+        The compiled regular expression
+    """
+    parts = []
+    for c in pattern:
+        if c == "%":
+            parts.append(".*")
+        elif c == "_":
+            parts.append(".")
+        else:
+            parts.append(re.escape(c))
+
+    return re.compile("".join(parts), re.DOTALL)
+
+
+def build_index(con: Any, path: Path = INDEX_PATH, table: str = "words") -> None:
+    """
+    Build the embedded inverted index from the word counts in the database,
+    and save it to the given directory, replacing any existing index.
+
+    Parameters:
+        con: The database connection, either to postgres or to sqlite
+        path: The directory to save the index to
+        table: The table (or join) to select `word`, `document_id`, `count` from
+    """
+    log = logging.getLogger("gutensearch.index")
+    path.mkdir(parents=True, exist_ok=True)
+
+    # the words must be sorted the same way Python compares strings, which is
+    # the default (binary) collation of sqlite, and the "C" collation of postgres
+    sqlite = isinstance(con, sqlite3.Connection)
+    collate = "" if sqlite else ' COLLATE "C"'
+
+    def select(name: str, sql: str) -> Any:
+        if sqlite:
+            return con.execute(sql)
+        # stream the rows using a server-side cursor
+        cur = con.cursor(name=name)
+        cur.itersize = 100_000
+        cur.execute(sql)
+        return cur
+
+    # every file is written next to the previous index first, and removed
+    # again if anything fails before the index is complete
+    tmp = [path / f"{name}.tmp" for name in FILES] + [path / "meta.json.tmp"]
+    try:
+        with ExitStack() as stack:
+            files = {
+                name: stack.enter_context(open(path / f"{name}.tmp", "wb"))
+                for name in FILES
+            }
+            writers = {
+                name: ArrayWriter(f, FILES[name])
+                for name, f in files.items()
+                if name != "vocabulary.blob"
+            }
+
+            log.info("Writing vocabulary and postings")
+            cur = select(
+                "index_postings",
+                f"""
+                SELECT word,
+                       document_id,
+                       count
+                  FROM {table}
+                 ORDER BY word{collate}, count DESC, document_id
+                """,
+            )
+
+            ids: Dict[str, int] = {}
+            frequencies = array("I")
+            documents: Set[int] = set()
+            blob = 0
+            writers["vocabulary.offsets"].append(0)
+            writers["postings.offsets"].append(0)
+            for word, document_id, count in cur:
+                if word not in ids:
+                    if len(ids) > 0:
+                        writers["postings.offsets"].append(
+                            writers["postings.counts"].length
+                        )
+                    ids[word] = len(ids)
+
+                    data = word.encode("utf-8")
+                    files["vocabulary.blob"].write(data)
+                    blob += len(data)
+                    writers["vocabulary.offsets"].append(blob)
+                    frequencies.append(0)
+
+                writers["postings.documents"].append(document_id)
+                writers["postings.counts"].append(count)
+                frequencies[-1] += 1
+                documents.add(document_id)
+
+            if len(ids) > 0:
+                writers["postings.offsets"].append(writers["postings.counts"].length)
+            cur.close()
+
+            # the TF-IDF vector of each document is written along with its terms
+            idf = array(
+                "d",
+                (inverse_document_frequency(len(documents), f) for f in frequencies),
+            )
+
+            def write_vector(weights: List[float]) -> None:
+                normalized, norm = normalize(weights)
+                writers["documents.norms"].append(norm)
+                for w in normalized:
+                    writers["terms.weights"].append(w)
+
+            log.info("Writing documents and terms")
+            cur = select(
+                "index_terms",
+                f"""
+                SELECT document_id,
+                       word,
+                       count
+                  FROM {table}
+                 ORDER BY document_id, count DESC, word{collate}
+                """,
+            )
+
+            previous: Optional[int] = None
+            weights: List[float] = []
+            writers["documents.offsets"].append(0)
+            for document_id, word, count in cur:
+                if document_id != previous:
+                    if previous is not None:
+                        writers["documents.offsets"].append(
+                            writers["terms.counts"].length
+                        )
+                        write_vector(weights)
+                    writers["documents.ids"].append(document_id)
+                    previous = document_id
+                    weights = []
+
+                word_id = ids[word]
+                writers["terms.words"].append(word_id)
+                writers["terms.counts"].append(count)
+                weights.append(term_weight(count) * idf[word_id])
+
+            if previous is not None:
+                writers["documents.offsets"].append(writers["terms.counts"].length)
+                write_vector(weights)
+            cur.close()
+            con.commit()
+
+            for writer in writers.values():
+                writer.flush()
+
+        meta = {
+            "version": VERSION,
+            "byteorder": sys.byteorder,
+            "words": len(ids),
+            "documents": writers["documents.ids"].length,
+            "postings": writers["postings.counts"].length,
+        }
+        with open(path / "meta.json.tmp", "w") as m:
+            json.dump(meta, m, indent=2)
+    except BaseException:
+        for t in tmp:
+            if t.exists():
+                t.unlink()
+        raise
+
+    # only replace the previous index once every file has been written,
+    # removing its metadata first so a partial swap is never opened
+    if (path / "meta.json").exists():
+        os.remove(path / "meta.json")
+    for name in FILES:
+        os.replace(path / f"{name}.tmp", path / name)
+    os.replace(path / "meta.json.tmp", path / "meta.json")
+
+    log.info(f"Finished writing index with {meta['postings']} postings: {path}")
+
+
+class Vocabulary:
+    """
+    A sorted, read-only sequence of every word in the index
+
+    Parameters:
+        blob: The concatenated (utf-8 encoded) words
+        offsets: The offset of each word in the blob
+    """
+
+    def __init__(self, blob: memoryview, offsets: memoryview):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return bytes(self.blob[self.offsets[i] : self.offsets[i + 1]]).decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        return (self[i] for i in range(len(self)))
+
+    def find(self, word: str) -> Optional[int]:
+        """
+        Find the id (position) of the given word
+
+        Parameters:
+            word: The word to find
+
+        Returns:
+            The id of the word, or `None` if it is not in the vocabulary
+        """
+        i = bisect_left(self, word)
+        if i < len(self) and self[i] == word:
+            return i
+
+        return None
+
+    def prefix_range(self, prefix: str) -> Tuple[int, int]:
+        """
+        Find the range of ids of every word starting with the given prefix
+
+        Parameters:
+            prefix: The prefix of the words
+
+        Returns:
+            The (start, end) range of word ids
+        """
+        if len(prefix) == 0:
+            return 0, len(self)
+
+        # every word starting with the prefix sorts before its "successor"
+        successor = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        start = bisect_left(self, prefix)
+        end = bisect_left(self, successor, lo=start)
+
+        return start, end
+
+
+class InvertedIndex:
+    """
+    A read-only, memory-mapped embedded inverted index (see `build_index`)
+    that provides the same searches as `gutensearch.database`, without
+    any database connection.
+
+    Parameters:
+        path: The directory containing the index
+        fuzzy_index: The path to the fuzzy word matching index used by
+            fuzzy searches
+
+    Raises:
+        ValueError: If the directory does not contain a compatible index
+    """
+
+    def __init__(self, path: Path = INDEX_PATH, fuzzy_index: Path = FUZZY_INDEX_PATH):
+        with open(path / "meta.json", "r") as f:
+            self.meta = json.load(f)
+        self.fuzzy_index = fuzzy_index
+
+        if self.meta["version"] != VERSION:
+            raise ValueError(
+                f"Unsupported index version: {self.meta['version']} "
+                "(rebuild it using gutensearch build-index)"
+            )
+        if self.meta["byteorder"] != sys.byteorder:
+            raise ValueError(f"Index has the wrong byte order: {path}")
+
+        self.mmaps: List[mmap.mmap] = []
+        self.arrays: Dict[str, memoryview] = {}
+        for name, typecode in FILES.items():
+            with open(path / name, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    self.arrays[name] = memoryview(array(typecode))
+                    continue
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+            self.mmaps.append(m)
+            # the type stubs only accept a literal type code
+            self.arrays[name] = memoryview(m).cast(cast(Any, typecode))
+
+        self.vocabulary = Vocabulary(
+            self.arrays["vocabulary.blob"], self.arrays["vocabulary.offsets"]
+        )
+
+    def postings(self, word_id: int) -> Iterator[Record]:
+        """
+        Every document containing the given word, highest count first
+
+        Parameters:
+            word_id: The id of the word
+
+        Returns:
+            A generator of records
+        """
+        word = self.vocabulary[word_id]
+        offsets = self.arrays["postings.offsets"]
+        documents = self.arrays["postings.documents"]
+        counts = self.arrays["postings.counts"]
+
+        for i in range(offsets[word_id], offsets[word_id + 1]):
+            yield Record(word, documents[i], counts[i])
+
+    def expand_pattern(self, pattern: str) -> List[int]:
+        """
+        Find the ids of every word matching the given SQL string pattern
+
+        Parameters:
+            pattern: The SQL string pattern, such as `fish%` or `doctor_`
+
+        Returns:
+            The matching word ids
+        """
+        regex = like_to_regex(pattern)
+
+        # only the words sharing the literal prefix of the pattern can match
+        prefix = re.split("[%_]", pattern, maxsplit=1)[0]
+        start, end = self.vocabulary.prefix_range(prefix)
+
+        return [i for i in range(start, end) if regex.fullmatch(self.vocabulary[i])]
+
+    def search_word(
+        self, word: str, fuzzy: bool = False, limit: Optional[int] = None
+    ) -> List[Record]:
+        """
+        Search for every document with the given word, ordered by the
+        highest `count` for each document id.
+        See `gutensearch.database.search_word`.
+
+        Parameters:
+            word: The word (or SQL string pattern) to search for
+            fuzzy:
+                If `True` allow search to use fuzzy word matching.
+                If `False`, only return results for exact matches.
+            limit: Return only the records with the top `n` most frequent words
+
+        Returns:
+            A list of records
+        """
+        has_pattern = is_pattern(word)
+        if has_pattern and fuzzy:
+            raise ValueError(
+                "Cannot search using both a pattern and fuzzy word matching"
+            )
+
+        if has_pattern:
+            # each posting list is already sorted, so merge them lazily
+            postings = [self.postings(i) for i in self.expand_pattern(word)]
+            merged = heapq.merge(*postings, key=lambda r: r.count, reverse=True)
+            return list(islice(merged, limit))
+
+        if fuzzy:
+            index = load_fuzzy_index(self.fuzzy_index)
+            candidates = [] if index is None else index.lookup(word, limit=1)
+            if len(candidates) > 0:
+                word = candidates[0].word
+            else:
+                word = closest_match(word, list(self.vocabulary))
+
+        word_id = self.vocabulary.find(word)
+        if word_id is None:
+            return []
+
+        return list(islice(self.postings(word_id), limit))
+
+    def search_words(
+        self, words: Sequence[str], fuzzy: bool = False, limit: Optional[int] = None
+    ) -> List[TermRecord]:
+        """
+        Search for the documents of many words (or word patterns) at once.
+        See `gutensearch.database.search_words`.
+
+        Parameters:
+            words: The words (or SQL string patterns) to search for
+            fuzzy: If `True` search for the closest match of each word instead
+            limit: Return only the records with the top `n` most frequent words for each term
+
+        Returns:
+            A list of records, grouped by term in the order they were given
+        """
+        return [
+            TermRecord(w, *r)
+            for w in words
+            for r in self.search_word(w, fuzzy and not is_pattern(w), limit)
+        ]
+
+    def search_document(
+        self, id_: int, min_length: Optional[int] = None, limit: Optional[int] = None
+    ) -> List[Record]:
+        """
+        Search for every word in the given document, ordered by the
+        highest `count` for each word.
+        See `gutensearch.database.search_document`.
+
+        Parameters:
+            id_: The document id to search for
+            min_length: Exclude any words in the search with less than a minimum character length
+            limit: Return only the records with the top `n` most frequent words
+
+        Returns:
+            A list of records
+        """
+        ids = self.arrays["documents.ids"]
+        i = bisect_left(ids, int(id_))
+        if i == len(ids) or ids[i] != int(id_):
+            return []
+
+        offsets = self.arrays["documents.offsets"]
+        words = self.arrays["terms.words"]
+        counts = self.arrays["terms.counts"]
+
+        records = (
+            Record(self.vocabulary[words[j]], ids[i], counts[j])
+            for j in range(offsets[i], offsets[i + 1])
+        )
+        if min_length is not None:
+            records = (r for r in records if len(r.word) >= min_length)
+
+        return list(islice(records, limit))
+
+    def search_similar(
+        self, id_: int, limit: Optional[int] = None
+    ) -> List[SimilarRecord]:
+        """
+        Search for the documents most similar to the given document, by the
+        cosine similarity of their TF-IDF vectors.
+        See `gutensearch.similar.similar_documents`.
+
+        Parameters:
+            id_: The document id to search for
+            limit: Return only the top `n` most similar documents
+
+        Returns:
+            A list of records, most similar document first
+        """
+        vectors = TermVectors(
+            self.arrays["documents.ids"],
+            self.arrays["documents.offsets"],
+            self.arrays["terms.words"],
+            self.arrays["terms.weights"],
+            self.arrays["documents.norms"],
+            self.arrays["postings.offsets"],
+            self.arrays["postings.documents"],
+            self.arrays["postings.counts"],
+        )
+        return similar_documents(vectors, int(id_), limit)
+
+    def query_distinct_words(self, sort: bool = False) -> List[str]:
+        """
+        Retrieve a list of every distinct word in the index, which
+        is always sorted
+
+        Parameters:
+            sort: Unused, the words are always sorted
+
+        Returns:
+            A list of every distinct word in the index
+        """
+        return list(self.vocabulary)
+
+    def close(self) -> None:
+        """
+        Release the memory-mapped files
+        """
+        for view in self.arrays.values():
+            view.release()
+        for m in self.mmaps:
+            m.close()
@@ -0,0 +1,299 @@
+"""
+This module contains the pipeline used by `gutensearch ingest` to
+download documents and load their word counts straight into the
+database, without saving the documents to disk and reading them back
+with `gutensearch load`. The downloads run in a background thread
+(see `gutensearch.download.fetch_documents`), the downloaded text is
+parsed by a pool of worker processes, and the word counts are written
+with the same batched `COPY` as an incremental load, committing every
+`commit_size` documents so that an interrupted ingest keeps (and later
+skips) everything committed so far. The raw text of each document can
+optionally be archived, in the same layout as `gutensearch download`.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from functools import partial
+from itertools import islice
+from pathlib import Path
+from queue import Full, Queue
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Union
+
+from .backend import Backend
+from .download import (
+    CONCURRENCY,
+    DATETIME_FMT,
+    Downloader,
+    FetchedDocument,
+    fetch_documents,
+    save_metadata,
+)
+from .load import (
+    BATCH_SIZE,
+    QUEUE_SIZE,
+    DocumentFile,
+    IncrementalPlan,
+    parse_documents,
+)
+from .parse import DocumentCounts, parse_content_counts
+
+# default number of documents loaded (and committed) in a single transaction
+COMMIT_SIZE = 100
+
+# default number of downloaded documents waiting to be parsed
+FETCH_QUEUE_SIZE = 16
+
+
+class IngestedDocument(NamedTuple):
+    """
+    A downloaded document, parsed and ready to be loaded
+
+    Parameters:
+        counts: The word counts of the document
+        file: The entry of the document in the manifest of loaded documents
+        url: The URL of the page of the document
+    """
+
+    counts: DocumentCounts
+    file: DocumentFile
+    url: str
+
+
+class FetchError(NamedTuple):
+    """
+    Wraps an error raised by the background download thread
+    """
+
+    error: BaseException
+
+
+def parse_fetched_document(
+    document: FetchedDocument,
+    tokenizer: str = "chunked",
+    archive: Optional[Path] = None,
+    positions: bool = False,
+) -> IngestedDocument:
+    """
+    Parse a downloaded document, and optionally archive its raw text
+    as `{id}.txt` in the given directory.
+
+    This function is suitable to be used with multiprocessing.
+
+    Parameters:
+        document: The downloaded document
+        tokenizer: The tokenizer engine to use, see `parse_word_count`
+        archive: The directory to save the raw text to, if any
+        positions: Also find the positions of each word (see `gutensearch.positions`)
+
+    Returns:
+        The parsed document
+    """
+    data = document.content
+    path = Path(f"{document.document_id}.txt")
+    if archive is not None:
+        path = archive / path
+        path.write_bytes(data)
+
+    # hashed the same way as `file_digest`, so that an incremental
+    # load of the archive finds the document unchanged
+    digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+    file = DocumentFile(document.document_id, path, len(data), digest)
+    counts = parse_content_counts(document.document_id, data, tokenizer, positions)
+
+    return IngestedDocument(counts, file, document.url)
+
+
+def fetch_in_background(
+    ids: Iterable[int],
+    downloader: Downloader,
+    concurrency: int = CONCURRENCY,
+    limit: Optional[int] = None,
+    queue_size: int = FETCH_QUEUE_SIZE,
+) -> Iterator[FetchedDocument]:
+    """
+    Download the given documents from a background thread running the
+    download engine, yielding each document as soon as it has been
+    downloaded. The downloads are paused whenever `queue_size` documents
+    are waiting to be consumed.
+
+    Parameters:
+        ids: The document id's to download, in order
+        downloader: The downloader fetching the pages from the mirror
+        concurrency: The number of documents fetched concurrently
+        limit: Stop after a given number of documents have been downloaded
+        queue_size: The maximum number of documents waiting to be consumed
+
+    Returns:
+        A generator of downloaded documents
+    """
+    log = logging.getLogger("gutensearch.ingest.fetch_in_background")
+    queue: "Queue[Union[FetchedDocument, FetchError, None]]" = Queue(queue_size)
+    stop = threading.Event()
+
+    def put(item: Union[FetchedDocument, FetchError, None]) -> bool:
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    async def handle(document: FetchedDocument) -> None:
+        loop = asyncio.get_running_loop()
+        if not await loop.run_in_executor(None, put, document):
+            # the consumer is gone, so stop downloading
+            raise RuntimeError("Stopped downloading documents")
+
+    def run() -> None:
+        try:
+            asyncio.run(fetch_documents(ids, downloader, handle, concurrency, limit))
+        except Exception as e:
+            # the consumer raises the error again (unless it has already
+            # stopped), so its traceback in this thread is only worth debugging
+            log.debug("Stopped downloading documents", exc_info=True)
+            put(FetchError(e))
+        else:
+            put(None)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = queue.get()
+            if item is None:
+                break
+            if isinstance(item, FetchError):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+
+
+def ingest_documents(
+    backend: Backend,
+    documents: Iterable[IngestedDocument],
+    commit_size: int = COMMIT_SIZE,
+    batch_size: int = BATCH_SIZE,
+    queue_size: int = QUEUE_SIZE,
+    archive: Optional[Path] = None,
+) -> int:
+    """
+    Load the parsed documents into the storage backend as they arrive,
+    committing every `commit_size` documents as an incremental load (see
+    `Backend.load_incremental`), so the indexes are updated in place.
+    The statistics of the tables are only updated after the last commit.
+
+    Parameters:
+        backend: The storage backend to load the documents into
+        documents: The parsed documents to load
+        commit_size: The number of documents loaded in a single transaction
+        batch_size: The number of rows written at a time
+        queue_size: The maximum number of batches waiting to be written
+        archive: The directory the raw text of the documents is archived to,
+            where the metadata of each document is recorded in `.meta.json`
+
+    Returns:
+        The number of documents loaded
+    """
+    log = logging.getLogger("gutensearch.ingest")
+
+    meta: Dict[str, Dict[str, str]] = {}
+    if archive is not None and os.path.exists(archive / ".meta.json"):
+        with open(archive / ".meta.json", "r") as f:
+            meta = json.load(f)
+
+    it = iter(documents)
+    chunk: List[IngestedDocument] = list(islice(it, commit_size))
+    loaded = 0
+    while len(chunk) > 0:
+        # look ahead, so the statistics are only updated after the last chunk
+        following = list(islice(it, commit_size))
+
+        plan = IncrementalPlan([d.file for d in chunk], replaced=[], rebuild=False)
+        counts = (d.counts for d in chunk)
+        backend.load_incremental(
+            counts, plan, batch_size, queue_size, analyze=len(following) == 0
+        )
+        loaded += len(chunk)
+        log.info(f"Committed {len(chunk)} documents, {loaded} documents total")
+
+        if archive is not None:
+            for d in chunk:
+                meta[str(d.file.document_id)] = {
+                    "url": d.url,
+                    "datetime": datetime.now().strftime(DATETIME_FMT),
+                    "filepath": str(d.file.path.resolve()),
+                }
+            save_metadata(meta, archive / ".meta.json")
+
+        chunk = following
+
+    return loaded
+
+
+def ingest(
+    backend: Backend,
+    ids: Iterable[int],
+    downloader: Downloader,
+    concurrency: int = CONCURRENCY,
+    limit: Optional[int] = None,
+    processes: int = 1,
+    tokenizer: str = "chunked",
+    positions: bool = False,
+    archive: Optional[Path] = None,
+    commit_size: int = COMMIT_SIZE,
+    batch_size: int = BATCH_SIZE,
+    queue_size: int = QUEUE_SIZE,
+) -> int:
+    """
+    Download, parse and load the given documents, skipping any
+    document that is already in the manifest of loaded documents
+
+    Parameters:
+        backend: The storage backend to load the documents into
+        ids: The document id's to download, in order
+        downloader: The downloader fetching the pages from the mirror
+        concurrency: The number of documents fetched concurrently
+        limit: Stop after a given number of documents have been loaded
+        processes: The number of worker processes to parse with
+        tokenizer: The tokenizer engine to use, see `parse_word_count`
+        positions: Also parse the positions of each word, which are needed once
+            the positional index has been built (see `gutensearch.positions`)
+        archive: The directory to save the raw text of the documents to, if any
+        commit_size: The number of documents loaded in a single transaction
+        batch_size: The number of rows written at a time
+        queue_size: The maximum number of batches waiting to be written
+
+    Returns:
+        The number of documents loaded
+    """
+    log = logging.getLogger("gutensearch.ingest")
+
+    loaded = backend.manifest()
+    pending = [i for i in dict.fromkeys(ids) if i not in loaded]
+    log.info(
+        f"Ingesting up to {len(pending)} documents, "
+        f"skipping {len(loaded)} documents already loaded"
+    )
+
+    if archive is not None:
+        archive.mkdir(parents=True, exist_ok=True)
+
+    parse = partial(
+        parse_fetched_document,
+        tokenizer=tokenizer,
+        archive=archive,
+        positions=positions,
+    )
+    fetched = fetch_in_background(pending, downloader, concurrency, limit)
+    documents = parse_documents(fetched, parse, processes)
+
+    return ingest_documents(
+        backend, documents, commit_size, batch_size, queue_size, archive
+    )
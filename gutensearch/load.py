@@ -0,0 +1,1518 @@
+"""
+This module contains the pipeline used by `gutensearch load` to
+parse documents and bulk load their word counts into the database,
+either by building the entire dataset in memory first, or by
+streaming fixed-size batches into the database while the
+documents are still being parsed. A manifest of the loaded
+documents allows later loads to only add the new (or changed)
+documents, see `plan_incremental`.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import threading
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from io import BytesIO, StringIO
+from itertools import count
+from multiprocessing import Pool
+from pathlib import Path
+from queue import Queue
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+from psycopg2.extras import execute_values  # type: ignore
+
+from .database import DISTINCT_WORDS_TABLES, WORDS_TABLES
+from .fuzzy import build_fuzzy_index
+from .metrics import METRICS, phase
+from .pgcopy import copy_binary, encode_distinct_words
+from .parse import DOCUMENT_SUFFIXES, DocumentCounts, document_id, is_document
+from .rank import add_rank, has_rank_tables, rebuild_rank, remove_rank
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# default number of rows written to the database by a single `COPY`
+BATCH_SIZE = 1_000_000
+
+# default number of batches waiting to be written to the database
+QUEUE_SIZE = 4
+
+
+# with an incremental load, the indexes are only dropped and re-created when
+# the new documents are at least this large relative to those already loaded
+REBUILD_RATIO = 0.2
+
+# the manifest of every document loaded into the database, used to find
+# the new or changed documents during an incremental load
+MANIFEST_TABLE = """
+CREATE TABLE IF NOT EXISTS documents (
+    document_id BIGINT PRIMARY KEY,
+    digest VARCHAR NOT NULL,
+    size BIGINT NOT NULL
+)
+""".strip()
+
+RECORD_DOCUMENTS = """
+INSERT INTO documents (document_id, digest, size)
+VALUES %s
+    ON CONFLICT (document_id)
+    DO UPDATE SET digest = EXCLUDED.digest,
+                  size = EXCLUDED.size
+""".strip()
+
+# with the `flat` layout, only the words of the new documents
+# that are not already distinct words are added
+INSERT_NEW_WORDS = """
+INSERT INTO distinct_words (word)
+SELECT DISTINCT w.word
+  FROM words AS w
+ WHERE w.document_id = ANY(%(ids)s)
+   AND NOT EXISTS (SELECT 1 FROM distinct_words AS d WHERE d.word = w.word)
+""".strip()
+
+# the load generation is incremented in the same transaction as every load,
+# which invalidates any cached search results (see `gutensearch.cache`)
+BUMP_LOAD_GENERATION = """
+CREATE TABLE IF NOT EXISTS load_generation (
+    generation BIGINT NOT NULL
+);
+
+INSERT INTO load_generation (generation)
+SELECT 0
+ WHERE NOT EXISTS (SELECT 1 FROM load_generation);
+
+UPDATE load_generation SET generation = generation + 1;
+""".strip()
+
+# the indexes on the `words` table for each database layout
+INDEXES = {
+    "flat": {
+        "idx_words_word": "words (word)",
+        "idx_words_id": "words (document_id)",
+    },
+    "vocabulary": {
+        "idx_words_word_id": "words (word_id)",
+        "idx_words_id": "words (document_id)",
+    },
+}
+
+# the ways the `words` table of the `flat` layout can be partitioned, by
+# partition key: hashing each word spreads the rows evenly and lets word
+# searches skip every other partition, while ranges of document ids
+# let document searches skip every other partition instead
+PARTITION_KEYS = {
+    "word": "HASH (word)",
+    "document_id": "RANGE (document_id)",
+}
+
+PARTITIONED_WORDS_TABLE = """
+CREATE TABLE words (
+    word VARCHAR NOT NULL,
+    document_id BIGINT NOT NULL,
+    count INT NOT NULL
+) PARTITION BY {key}
+""".strip()
+
+# the partition key of the `words` table, if it is partitioned
+PARTITION_KEY = """
+SELECT a.attname AS key
+  FROM pg_partitioned_table AS p
+  JOIN pg_attribute AS a
+    ON a.attrelid = p.partrelid
+   AND a.attnum = p.partattrs[0]
+ WHERE p.partrelid = 'words'::regclass
+""".strip()
+
+# every partition of the `words` table, and the bounds of its values
+PARTITIONS = """
+SELECT c.relname AS name,
+       pg_get_expr(c.relpartbound, c.oid) AS bound
+  FROM pg_inherits AS i
+  JOIN pg_class AS c ON c.oid = i.inhrelid
+ WHERE i.inhparent = 'words'::regclass
+""".strip()
+
+# with the `vocabulary` layout, each batch is first copied to a staging table
+# and any new words are assigned an id in bulk before resolving every word
+STAGING_TABLE = """
+CREATE TEMPORARY TABLE IF NOT EXISTS words_staging (
+    word VARCHAR NOT NULL,
+    document_id BIGINT NOT NULL,
+    count INTEGER NOT NULL
+)
+""".strip()
+
+RESOLVE_STAGING = """
+INSERT INTO vocabulary (word)
+SELECT DISTINCT s.word
+  FROM words_staging AS s
+ WHERE NOT EXISTS (SELECT 1 FROM vocabulary AS v WHERE v.word = s.word);
+
+INSERT INTO words (word_id, document_id, count)
+SELECT v.word_id,
+       s.document_id,
+       s.count
+  FROM words_staging AS s
+  JOIN vocabulary AS v ON v.word = s.word;
+
+TRUNCATE TABLE words_staging;
+""".strip()
+
+# the optional positional index, holding the packed positions of each word
+# in each document (see `gutensearch.positions`), keyed by the word itself
+# with every layout
+POSITIONS_TABLE = """
+CREATE TABLE IF NOT EXISTS word_positions (
+    word VARCHAR NOT NULL,
+    document_id BIGINT NOT NULL,
+    positions BYTEA NOT NULL
+)
+""".strip()
+
+# the indexes on `word_positions`, the first of which serves phrase searches
+POSITION_INDEXES = {
+    "idx_word_positions_word_id": "word_positions (word, document_id)",
+    "idx_word_positions_id": "word_positions (document_id)",
+}
+
+
+def drop_indexes(cur: Any, schema: str = "flat") -> None:
+    """
+    Drop the indexes on the `words` table prior to a bulk load
+
+    Parameters:
+        cur: The database cursor used to execute the statement
+        schema: The database layout, see `gutensearch.database.SCHEMAS`
+    """
+    with phase("index"):
+        for name in INDEXES[schema]:
+            cur.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+def create_indexes(cur: Any, schema: str = "flat") -> None:
+    """
+    (Re-)create the indexes on the `words` table after a bulk load
+
+    Parameters:
+        cur: The database cursor used to execute the statement
+        schema: The database layout, see `gutensearch.database.SCHEMAS`
+    """
+    with phase("index"):
+        for name, columns in INDEXES[schema].items():
+            cur.execute(f"CREATE INDEX {name} ON {columns}")
+
+
+def has_position_table(cur: Any) -> bool:
+    """
+    Check whether the positional index has been built
+
+    Parameters:
+        cur: The database cursor used to execute the statement
+
+    Returns:
+        `True` if the positional index exists, and must be kept up to date
+    """
+    cur.execute("SELECT to_regclass('word_positions') IS NOT NULL")
+    return cur.fetchone()[0]  # type: ignore
+
+
+def prepare_positions(cur: Any, positions: bool = False) -> bool:
+    """
+    Prepare the positional index for a load, creating the `word_positions`
+    table if it is requested for the first time
+
+    Parameters:
+        cur: The database cursor used to execute the statement
+        positions: Build the positional index, which is kept up to date by
+            every load once it exists
+
+    Returns:
+        Whether the positions of the documents must be written
+
+    Raises:
+        ValueError: If the positional index is requested for the first time,
+            but documents were already loaded without their positions
+    """
+    with phase("positions"):
+        if has_position_table(cur):
+            return True
+        if not positions:
+            return False
+
+        cur.execute("SELECT EXISTS (SELECT 1 FROM words)")
+        if cur.fetchone()[0]:
+            raise ValueError(
+                "The positional index can only be built along with every "
+                "document, load the documents into an empty database instead"
+            )
+        cur.execute(POSITIONS_TABLE)
+
+    return True
+
+
+def drop_position_indexes(cur: Any) -> None:
+    """
+    Drop the indexes on the `word_positions` table prior to a bulk load
+
+    Parameters:
+        cur: The database cursor used to execute the statement
+    """
+    with phase("positions"):
+        for name in POSITION_INDEXES:
+            cur.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+def create_position_indexes(cur: Any) -> None:
+    """
+    (Re-)create the indexes on the `word_positions` table after a bulk
+    load, and update its statistics
+
+    Parameters:
+        cur: The database cursor used to execute the statement
+    """
+    with phase("positions"):
+        for name, columns in POSITION_INDEXES.items():
+            cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {columns}")
+        cur.execute("ANALYZE word_positions")
+
+
+def copy_buffer(copy_format: str = "text") -> Union[StringIO, BytesIO]:
+    """
+    Create an empty in-memory buffer to hold rows in the given `COPY` format
+
+    Parameters:
+        copy_format: The `COPY` format, see `gutensearch.pgcopy.COPY_FORMATS`
+
+    Returns:
+        A text buffer for the `text` format, or a bytes buffer for `binary`
+    """
+    return BytesIO() if copy_format == "binary" else StringIO()
+
+
+def write_rows(
+    fio: Union[StringIO, BytesIO],
+    doc: DocumentCounts,
+    copy_format: str = "text",
+    positions: Optional[Union[StringIO, BytesIO]] = None,
+) -> None:
+    """
+    Write the rows of a parsed document to a buffer created by `copy_buffer`
+
+    Parameters:
+        fio: The buffer to write to
+        doc: The parsed document
+        copy_format: The `COPY` format, see `gutensearch.pgcopy.COPY_FORMATS`
+        positions: The buffer to write the `word_positions` rows of the
+            document to, if any
+
+    Raises:
+        ValueError: If the `word_positions` rows are written, but the document
+            was parsed without its positions
+    """
+    with phase("serialize"):
+        if copy_format == "binary":
+            fio.write(doc.copy_binary())  # type: ignore
+        else:
+            fio.write(doc.copy_text())  # type: ignore
+
+        if positions is not None:
+            if doc.positions is None:
+                raise ValueError(
+                    f"Document {doc.document_id} was parsed without the "
+                    "positions of its words, which the positional index needs"
+                )
+            if copy_format == "binary":
+                positions.write(doc.copy_positions_binary())  # type: ignore
+            else:
+                positions.write(doc.copy_positions_text())  # type: ignore
+
+    METRICS.count(doc)
+
+
+def copy_words(
+    cur: Any,
+    fio: Union[StringIO, BytesIO],
+    schema: str = "flat",
+    table: str = "words",
+    copy_format: str = "text",
+) -> None:
+    """
+    Write `word`, `document_id`, `count` rows to the `words` table using
+    `COPY`, either tab-separated or in the binary format. With the
+    `vocabulary` layout, the rows go through a staging table so each
+    word can be resolved to its id.
+
+    Parameters:
+        cur: The database cursor used to execute the statement
+        fio: The rows to write
+        schema: The database layout, see `gutensearch.database.SCHEMAS`
+        table: The table to write to with the `flat` layout, e.g. a
+            single partition of `words`
+        copy_format: The `COPY` format, see `gutensearch.pgcopy.COPY_FORMATS`
+    """
+    with phase("copy"):
+        if schema != "flat":
+            cur.execute(STAGING_TABLE)
+            table = "words_staging"
+
+        if copy_format == "binary":
+            copy_binary(cur, fio, table)  # type: ignore
+        else:
+            cur.copy_from(fio, table)
+
+        if schema != "flat":
+            cur.execute(RESOLVE_STAGING)
+
+
+def copy_positions(
+    cur: Any, fio: Union[StringIO, BytesIO], copy_format: str = "text"
+) -> None:
+    """
+    Write `word`, `document_id`, `positions` rows to the `word_positions`
+    table using `COPY`, see `copy_words`
+
+    Parameters:
+        cur: The database cursor used to execute the statement
+        fio: The rows to write
+        copy_format: The `COPY` format, see `gutensearch.pgcopy.COPY_FORMATS`
+    """
+    with phase("positions"):
+        if copy_format == "binary":
+            copy_binary(cur, fio, "word_positions")  # type: ignore
+        else:
+            cur.copy_from(fio, "word_positions")
+
+
+def vacuum_analyze(con: Any) -> None:
+    """
+    Run `VACUUM ANALYZE` on the `words` table. `VACUUM` cannot run
+    inside of a transaction, so the connection is temporarily
+    switched to autocommit mode.
+
+    Parameters:
+        con: The database connection
+    """
+    log = logging.getLogger("gutensearch.load")
+
+    cur = con.cursor()
+    iso_level = con.isolation_level
+    con.set_isolation_level(0)
+    with phase("vacuum"):
+        cur.execute("VACUUM ANALYZE words")
+
+    log.info("Committing changes to database")
+    con.commit()
+    con.set_isolation_level(iso_level)
+    cur.close()
+
+
+class DocumentFile(NamedTuple):
+    """
+    A document on disk, as recorded in the manifest of loaded documents
+
+    Parameters:
+        document_id: The id of the document
+        path: The path to the document
+        size: The size of the document in bytes
+        digest: The hash of the contents of the document
+    """
+
+    document_id: int
+    path: Path
+    size: int
+    digest: str
+
+
+class IncrementalPlan(NamedTuple):
+    """
+    The documents to parse and load during an incremental load
+
+    Parameters:
+        files: The new or changed documents to load
+        replaced: The ids of the changed documents, whose rows are replaced
+        rebuild: Whether to drop and re-create the indexes on `words`
+    """
+
+    files: List[DocumentFile]
+    replaced: List[int]
+    rebuild: bool
+
+
+def file_digest(path: Path, block_size: int = 1 << 20) -> str:
+    """
+    Hash the contents of a file, reading it in blocks
+
+    Parameters:
+        path: The path to the file
+        block_size: The number of bytes to read at a time
+
+    Returns:
+        The hexadecimal digest of the file
+    """
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+
+    return h.hexdigest()
+
+
+def scan_documents(files: Iterable[Path]) -> List[DocumentFile]:
+    """
+    Record the id, size and hash of each document, to be
+    compared with (and saved to) the manifest of loaded documents
+
+    Parameters:
+        files: The paths to the documents
+
+    Returns:
+        The documents
+    """
+    with phase("scan"):
+        return [scan_document(f) for f in files]
+
+
+def scan_document(path: Path) -> DocumentFile:
+    """
+    Record the id, size and hash of a single document, see `scan_documents`
+
+    Parameters:
+        path: The path to the document
+
+    Returns:
+        The document
+    """
+    return DocumentFile(document_id(path), path, path.stat().st_size, file_digest(path))
+
+
+class ScannedParse(Generic[R]):
+    """
+    A wrapper of the function used to parse a single document, which can be
+    sent to worker processes. Each document is also scanned (see
+    `scan_document`) by the process that parses it, rather than reading
+    every document up front in the loading process, and returned along
+    with the parsed document (see `record_scanned`).
+
+    Parameters:
+        parse: The function used to parse a single document
+    """
+
+    def __init__(self, parse: Callable[[Path], R]):
+        self.parse = parse
+
+    def __call__(self, path: Path) -> Tuple[R, DocumentFile]:
+        return self.parse(path), scan_document(path)
+
+
+def record_scanned(
+    results: Iterable[Tuple[R, DocumentFile]], files: List[DocumentFile]
+) -> Iterator[R]:
+    """
+    Unwrap the documents parsed using `ScannedParse`, adding each scanned
+    document to `files`, which is complete once every document is consumed
+
+    Parameters:
+        results: The parsed and scanned documents
+        files: The list to add the scanned documents to
+
+    Returns:
+        A generator of the parsed documents
+    """
+    for result, f in results:
+        files.append(f)
+        yield result
+
+
+def find_documents(path: Path) -> List[Path]:
+    """
+    Find every document in the given directory, either plain text or
+    compressed (see `gutensearch.parse.DOCUMENT_SUFFIXES`). When the
+    same document is stored more than once (e.g. both `123.txt` and
+    `123.txt.gz`), only the most preferred file is kept, so that the
+    document is never loaded twice.
+
+    Parameters:
+        path: The path to the directory containing the documents
+
+    Returns:
+        The paths to the documents, one per document id
+    """
+    log = logging.getLogger("gutensearch.load")
+
+    found: Dict[int, Path] = {}
+    for name in os.listdir(path):
+        if not is_document(name):
+            continue
+
+        try:
+            id_ = document_id(Path(name))
+        except ValueError:
+            log.warning(f"Skipping file without a document id: {name}")
+            continue
+
+        if id_ in found:
+            kept = min(found[id_], path / name, key=_preference)
+            log.warning(
+                f"Found more than one file for document id {id_}, using: {kept.name}"
+            )
+            found[id_] = kept
+        else:
+            found[id_] = path / name
+
+    return list(found.values())
+
+
+def _preference(path: Path) -> Tuple[int, str]:
+    name = path.name.lower()
+    rank = [i for i, s in enumerate(DOCUMENT_SUFFIXES) if name.endswith(s)]
+    return (rank[0] if len(rank) > 0 else len(DOCUMENT_SUFFIXES), name)
+
+
+def plan_incremental(
+    manifest: Dict[int, Tuple[str, int]],
+    files: Iterable[DocumentFile],
+    rebuild_ratio: float = REBUILD_RATIO,
+) -> IncrementalPlan:
+    """
+    Compare the documents with the manifest of loaded documents to find
+    the ones that are new, or that have changed since they were loaded.
+    The indexes are only rebuilt when the total size of the documents to
+    load is at least `rebuild_ratio` times the size of those already loaded,
+    otherwise updating the indexes in place is cheaper.
+
+    Parameters:
+        manifest: The `digest` and `size` of each loaded document, by id
+        files: The documents to load
+        rebuild_ratio: The relative size above which the indexes are rebuilt
+
+    Returns:
+        The documents to load
+    """
+    load = []
+    replaced = []
+    for f in files:
+        if f.document_id not in manifest:
+            load.append(f)
+        elif manifest[f.document_id] != (f.digest, f.size):
+            load.append(f)
+            replaced.append(f.document_id)
+
+    loaded = sum(size for _, size in manifest.values())
+    size = sum(f.size for f in load)
+    rebuild = size > 0 and size >= rebuild_ratio * loaded
+
+    return IncrementalPlan(load, replaced, rebuild)
+
+
+def read_manifest(cur: Any) -> Dict[int, Tuple[str, int]]:
+    """
+    Read the manifest of loaded documents, creating it if needed
+
+    Parameters:
+        cur: The database cursor used to execute the statement
+
+    Returns:
+        The `digest` and `size` of each loaded document, by id
+    """
+    cur.execute(MANIFEST_TABLE)
+    cur.execute("SELECT document_id, digest, size FROM documents")
+    return {r[0]: (r[1], r[2]) for r in cur.fetchall()}
+
+
+def record_documents(cur: Any, files: Sequence[DocumentFile]) -> None:
+    """
+    Add (or update) the given documents in the manifest of loaded documents
+
+    Parameters:
+        cur: The database cursor used to execute the statement
+        files: The loaded documents
+    """
+    with phase("manifest"):
+        cur.execute(MANIFEST_TABLE)
+        rows = [(f.document_id, f.digest, f.size) for f in files]
+        execute_values(cur, RECORD_DOCUMENTS, rows, page_size=10_000)
+
+
+def parse_documents(
+    files: Iterable[T],
+    parse: Callable[[T], R],
+    processes: int = 1,
+    window: Optional[int] = None,
+) -> Iterator[R]:
+    """
+    Lazily parse each document, optionally in parallel using a pool of
+    worker processes. Results are returned in the order the workers
+    complete them, and no more than `window` documents are ever parsed
+    (or waiting to be consumed) ahead of the caller, so memory usage
+    stays bounded regardless of the number of documents.
+
+    Parameters:
+        files: The paths to the documents
+        parse: The function used to parse a single document
+        processes: The number of worker processes to parse with
+        window: The maximum number of documents in flight at once,
+            which defaults to four times the number of processes
+
+    Returns:
+        A generator of parsed documents
+    """
+    if processes <= 1:
+        for f in files:
+            yield parse(f)
+        return
+
+    if window is None:
+        window = 4 * processes
+
+    slots = threading.Semaphore(window)
+    stop = threading.Event()
+
+    def throttle() -> Iterator[T]:
+        # consumed by the pool's task handler thread, which blocks here
+        # until the caller has taken a finished document off our hands
+        for f in files:
+            slots.acquire()
+            if stop.is_set():
+                return
+            yield f
+
+    with Pool(processes) as p:
+        try:
+            for result in p.imap_unordered(parse, throttle()):
+                slots.release()
+                yield result
+
+            # let the workers exit on their own rather than being terminated,
+            # so they run their exit handlers (see `gutensearch.metrics`)
+            p.close()
+            p.join()
+        finally:
+            # unblock the task handler so the pool can shut down
+            stop.set()
+            for _ in range(window):
+                slots.release()
+
+
+class CopyWriter(threading.Thread):
+    """
+    A background thread that writes batches of rows to
+    the `words` table using `COPY`, so that the caller can keep
+    producing new batches while earlier ones are being written. The
+    number of batches waiting to be written is bounded, and `write`
+    blocks once the queue is full. The `word_positions` rows of each
+    batch, if any, are written along with it.
+
+    Parameters:
+        con: The database connection used exclusively by this writer
+        schema: The database layout, see `gutensearch.database.SCHEMAS`
+        queue_size: The maximum number of batches waiting to be written
+        table: The table to write to, e.g. a single partition of `words`
+        copy_format: The `COPY` format, see `gutensearch.pgcopy.COPY_FORMATS`
+    """
+
+    def __init__(
+        self,
+        con: Any,
+        schema: str = "flat",
+        queue_size: int = QUEUE_SIZE,
+        table: str = "words",
+        copy_format: str = "text",
+    ):
+        super().__init__(daemon=True)
+        self.con = con
+        self.schema = schema
+        self.table = table
+        self.copy_format = copy_format
+        self.queue: "Queue[Optional[Tuple[Any, Any]]]" = Queue(maxsize=queue_size)
+        self.error: Optional[BaseException] = None
+        self.rows = 0
+
+    def run(self) -> None:
+        log = logging.getLogger("gutensearch.load.CopyWriter")
+        cur = self.con.cursor()
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                break
+
+            # keep draining the queue after an error so `write` never blocks
+            if self.error is not None:
+                continue
+
+            fio, positions = batch
+            try:
+                copy_words(cur, fio, self.schema, self.table, self.copy_format)
+                if positions is not None:
+                    copy_positions(cur, positions, self.copy_format)
+            except Exception as e:
+                # raised again by the next `write` or `close`
+                log.error(f"Failed to copy rows to table: {self.table}", exc_info=True)
+                self.error = e
+
+        cur.close()
+
+    def write(
+        self,
+        fio: Union[StringIO, BytesIO],
+        rows: int,
+        positions: Optional[Union[StringIO, BytesIO]] = None,
+    ) -> None:
+        """
+        Queue a batch of rows to be written to the table
+
+        Parameters:
+            fio: The rows to write, created by `copy_buffer`
+            rows: The number of rows in the batch
+            positions: The `word_positions` rows of the batch, if any
+        """
+        if self.error is not None:
+            raise self.error
+
+        fio.seek(0)
+        if positions is not None:
+            positions.seek(0)
+        self.queue.put((fio, positions))
+        self.rows += rows
+
+    def close(self) -> None:
+        """
+        Wait for every queued batch to be written to the table
+
+        Raises:
+            Exception: Any error raised while writing a batch
+        """
+        self.queue.put(None)
+        self.join()
+
+        if self.error is not None:
+            raise self.error
+
+
+def load_records(
+    con: Any,
+    documents: Iterable[DocumentCounts],
+    schema: str = "flat",
+    files: Sequence[DocumentFile] = (),
+    copy_format: str = "text",
+    rank: bool = False,
+    positions: bool = False,
+) -> None:
+    """
+    Build the entire dataset in memory and write it to the `words`
+    and `distinct_words` tables, each with a single `COPY`. With the
+    `vocabulary` layout, new words are added to the `vocabulary` table
+    instead of `distinct_words`.
+
+    Parameters:
+        con: The database connection
+        documents: The parsed documents to load
+        schema: The database layout, see `gutensearch.database.SCHEMAS`
+        files: The documents to add to the manifest of loaded documents
+        copy_format: The `COPY` format, see `gutensearch.pgcopy.COPY_FORMATS`
+        rank: Build the ranking statistics (see `gutensearch.rank`), which
+            are rebuilt by every load once they exist
+        positions: Write the positional index (see `gutensearch.positions`),
+            which is kept up to date by every load once it exists, so the
+            documents must then be parsed with their positions
+    """
+    log = logging.getLogger("gutensearch.load")
+    cur = con.cursor()
+
+    positions = prepare_positions(cur, positions)
+
+    log.info("Temporarily dropping indexes on table: words")
+    drop_indexes(cur, schema)
+    if positions:
+        drop_position_indexes(cur)
+
+    log.info("Writing results to database")
+    # create an in-memory file-stream to copy the data
+    # using Postgres' high performance `COPY` command
+    words: Set[str] = set()  # used later for distinct_words
+    pfio = copy_buffer(copy_format) if positions else None
+    with copy_buffer(copy_format) as fio:
+        for doc in documents:
+            if schema == "flat":
+                words.update(doc.words)
+            write_rows(fio, doc, copy_format, pfio)
+
+        fio.seek(0)
+        copy_words(cur, fio, schema, copy_format=copy_format)
+        if pfio is not None:
+            pfio.seek(0)
+            copy_positions(cur, pfio, copy_format)
+        log.info("Finished writing data to database")
+
+    # save distinct words for quicker access
+    # when perforing fuzzy word matching algorithm
+    if schema == "flat":
+        log.info("Truncating table: distinct_words")
+        with phase("distinct_words"):
+            cur.execute("TRUNCATE TABLE distinct_words")
+
+            log.info("Writing new distinct words to database")
+            if copy_format == "binary":
+                data = BytesIO(encode_distinct_words(words))
+                copy_binary(cur, data, "distinct_words")
+            else:
+                with StringIO() as fio:
+                    for w in words:
+                        fio.write(f"{w}\n")
+                    fio.seek(0)
+                    cur.copy_from(fio, "distinct_words")
+        log.info("Finished writing distinct words to database")
+
+    log.info("Recreating indexes on table: words")
+    create_indexes(cur, schema)
+    if positions:
+        create_position_indexes(cur)
+
+    if rank or has_rank_tables(cur):
+        rebuild_rank(cur, WORDS_TABLES[schema])
+
+    log.info("Updating manifest of loaded documents")
+    record_documents(cur, files)
+    cur.execute(BUMP_LOAD_GENERATION)
+
+    log.info("Committing changes to database")
+    con.commit()
+    cur.close()
+
+    log.info("Running vacuum analyze on table: words")
+    vacuum_analyze(con)
+
+
+def write_batches(
+    con: Any,
+    documents: Iterable[DocumentCounts],
+    batch_size: int = BATCH_SIZE,
+    queue_size: int = QUEUE_SIZE,
+    schema: str = "flat",
+    copy_format: str = "text",
+    positions: bool = False,
+) -> int:
+    """
+    Write the parsed documents to the `words` table in fixed-size batches
+    using a `CopyWriter`, while they are still being parsed. The changes
+    are not committed.
+
+    Parameters:
+        con: The database connection
+        documents: The parsed documents to write
+        batch_size: The number of rows written by a single `COPY`
+        queue_size: The maximum number of batches waiting to be written
+        schema: The database layout, see `gutensearch.database.SCHEMAS`
+        copy_format: The `COPY` format, see `gutensearch.pgcopy.COPY_FORMATS`
+        positions: Also write the `word_positions` rows of the documents
+
+    Returns:
+        The number of rows written
+    """
+    log = logging.getLogger("gutensearch.load")
+    log.info(f"Streaming results to database in batches of {batch_size} rows")
+    writer = CopyWriter(con, schema, queue_size, copy_format=copy_format)
+    writer.start()
+
+    def buffers() -> Tuple[Any, Any]:
+        return copy_buffer(copy_format), copy_buffer(copy_format) if positions else None
+
+    rows = 0
+    fio, pfio = buffers()
+    try:
+        for doc in documents:
+            write_rows(fio, doc, copy_format, pfio)
+            rows += len(doc.words)
+
+            if rows >= batch_size:
+                writer.write(fio, rows, pfio)
+                log.debug(f"Queued batch, {writer.rows} rows total")
+                (fio, pfio), rows = buffers(), 0
+
+        if rows > 0:
+            writer.write(fio, rows, pfio)
+    finally:
+        writer.close()
+
+    return writer.rows
+
+
+def stream_records(
+    con: Any,
+    documents: Iterable[DocumentCounts],
+    batch_size: int = BATCH_SIZE,
+    queue_size: int = QUEUE_SIZE,
+    schema: str = "flat",
+    files: Sequence[DocumentFile] = (),
+    copy_format: str = "text",
+    rank: bool = False,
+    positions: bool = False,
+) -> None:
+    """
+    Write the parsed documents to the `words` table in fixed-size
+    batches (a document is never split between two batches) while
+    they are still being parsed. At most `queue_size` batches are
+    held in memory at once, so memory usage stays flat no matter how
+    many documents are loaded. The `distinct_words` table is rebuilt
+    from the `words` table by the database itself once every batch
+    has been written. With the `vocabulary` layout, new words are
+    added to the `vocabulary` table as each batch is written instead.
+
+    Parameters:
+        con: The database connection
+        documents: The parsed documents to load
+        batch_size: The number of rows written by a single `COPY`
+        queue_size: The maximum number of batches waiting to be written
+        schema: The database layout, see `gutensearch.database.SCHEMAS`
+        files: The documents to add to the manifest of loaded documents
+        copy_format: The `COPY` format, see `gutensearch.pgcopy.COPY_FORMATS`
+        rank: Build the ranking statistics (see `gutensearch.rank`), which
+            are rebuilt by every load once they exist
+        positions: Write the positional index (see `gutensearch.positions`),
+            which is kept up to date by every load once it exists, so the
+            documents must then be parsed with their positions
+    """
+    log = logging.getLogger("gutensearch.load")
+    cur = con.cursor()
+
+    positions = prepare_positions(cur, positions)
+
+    log.info("Temporarily dropping indexes on table: words")
+    drop_indexes(cur, schema)
+    if positions:
+        drop_position_indexes(cur)
+
+    rows = write_batches(
+        con, documents, batch_size, queue_size, schema, copy_format, positions
+    )
+    log.info(f"Finished writing {rows} rows to database")
+
+    if schema == "flat":
+        log.info("Truncating table: distinct_words")
+        with phase("distinct_words"):
+            cur.execute("TRUNCATE TABLE distinct_words")
+
+            log.info("Writing new distinct words to database")
+            cur.execute("INSERT INTO distinct_words SELECT DISTINCT word FROM words")
+
+    log.info("Recreating indexes on table: words")
+    create_indexes(cur, schema)
+    if positions:
+        create_position_indexes(cur)
+
+    if rank or has_rank_tables(cur):
+        rebuild_rank(cur, WORDS_TABLES[schema])
+
+    log.info("Updating manifest of loaded documents")
+    record_documents(cur, files)
+    cur.execute(BUMP_LOAD_GENERATION)
+
+    log.info("Committing changes to database")
+    con.commit()
+    cur.close()
+
+    log.info("Running vacuum analyze on table: words")
+    vacuum_analyze(con)
+
+
+def incremental_records(
+    con: Any,
+    documents: Iterable[DocumentCounts],
+    plan: IncrementalPlan,
+    batch_size: int = BATCH_SIZE,
+    queue_size: int = QUEUE_SIZE,
+    schema: str = "flat",
+    vacuum: bool = True,
+    copy_format: str = "text",
+    rank: bool = False,
+    positions: bool = False,
+) -> None:
+    """
+    Load only the new or changed documents (see `plan_incremental`) in a
+    single transaction. The existing rows of each changed document are
+    deleted first, so they are replaced rather than duplicated, and only
+    the words that have never been seen before are added to the
+    `distinct_words` (or `vocabulary`) table. The indexes on `words` are
+    left in place, unless the plan calls for them to be rebuilt.
+
+    Parameters:
+        con: The database connection
+        documents: The parsed new or changed documents
+        plan: The documents to load, see `plan_incremental`
+        batch_size: The number of rows written by a single `COPY`
+        queue_size: The maximum number of batches waiting to be written
+        schema: The database layout, see `gutensearch.database.SCHEMAS`
+        vacuum: Run `VACUUM ANALYZE` on `words` once the changes are committed
+        copy_format: The `COPY` format, see `gutensearch.pgcopy.COPY_FORMATS`
+        rank: Build the ranking statistics (see `gutensearch.rank`), which
+            are updated by every load once they exist
+        positions: Write the positional index (see `gutensearch.positions`),
+            which is kept up to date by every load once it exists, so the
+            documents must then be parsed with their positions
+
+    Raises:
+        ValueError: If the positional index cannot be built, see `prepare_positions`
+    """
+    log = logging.getLogger("gutensearch.load")
+    cur = con.cursor()
+    table = WORDS_TABLES[schema]
+    ranked = has_rank_tables(cur)
+
+    positions = prepare_positions(cur, positions)
+
+    if len(plan.replaced) > 0:
+        # the words of the changed documents are still needed to update the
+        # ranking statistics, so they are removed first
+        if ranked:
+            remove_rank(cur, plan.replaced, table)
+
+        log.info(f"Deleting rows of {len(plan.replaced)} changed documents")
+        with phase("delete"):
+            cur.execute(
+                "DELETE FROM words WHERE document_id = ANY(%(ids)s)",
+                {"ids": plan.replaced},
+            )
+            if positions:
+                cur.execute(
+                    "DELETE FROM word_positions WHERE document_id = ANY(%(ids)s)",
+                    {"ids": plan.replaced},
+                )
+
+    if plan.rebuild:
+        log.info("Temporarily dropping indexes on table: words")
+        drop_indexes(cur, schema)
+        if positions:
+            drop_position_indexes(cur)
+
+    rows = write_batches(
+        con, documents, batch_size, queue_size, schema, copy_format, positions
+    )
+    log.info(f"Finished writing {rows} rows to database")
+
+    if schema == "flat":
+        log.info("Writing new distinct words to database")
+        ids = [f.document_id for f in plan.files]
+        with phase("distinct_words"):
+            cur.execute(INSERT_NEW_WORDS, {"ids": ids})
+
+    if plan.rebuild:
+        log.info("Recreating indexes on table: words")
+        create_indexes(cur, schema)
+
+    if positions:
+        create_position_indexes(cur)
+
+    if ranked:
+        log.info("Adding new documents to the ranking statistics")
+        add_rank(cur, [f.document_id for f in plan.files], table)
+    elif rank:
+        rebuild_rank(cur, table)
+
+    log.info("Updating manifest of loaded documents")
+    record_documents(cur, plan.files)
+    cur.execute(BUMP_LOAD_GENERATION)
+
+    log.info("Committing changes to database")
+    con.commit()
+    cur.close()
+
+    if vacuum:
+        log.info("Running vacuum analyze on table: words")
+        vacuum_analyze(con)
+
+
+class Partition(NamedTuple):
+    """
+    A partition of the `words` table
+
+    Parameters:
+        name: The name of the partition
+        lower: The smallest document id in a range partition (inclusive)
+        upper: The largest document id in a range partition (exclusive)
+    """
+
+    name: str
+    lower: Optional[int] = None
+    upper: Optional[int] = None
+
+
+def range_bounds(ids: Iterable[int], partitions: int) -> List[int]:
+    """
+    Split the given document ids into ranges holding (roughly) the same
+    number of documents each
+
+    Parameters:
+        ids: The ids of the documents to load
+        partitions: The number of ranges
+
+    Returns:
+        The smallest document id of every range but the first
+    """
+    ids = sorted(set(ids))
+    if len(ids) == 0:
+        return []
+
+    bounds = {ids[len(ids) * k // partitions] for k in range(1, partitions)}
+    return sorted(bounds - {ids[0]})
+
+
+def read_partitions(cur: Any) -> Tuple[Optional[str], List[Partition]]:
+    """
+    Read the partition key and partitions of the `words` table
+
+    Parameters:
+        cur: The database cursor used to execute the statement
+
+    Returns:
+        The partition key (`None` if `words` is not partitioned),
+        and every partition ordered by name (or by range)
+    """
+    cur.execute(PARTITION_KEY)
+    row = cur.fetchone()
+    if row is None:
+        return None, []
+
+    cur.execute(PARTITIONS)
+    partitions = []
+    for name, bound in cur.fetchall():
+        # e.g. FOR VALUES FROM (MINVALUE) TO ('120')
+        match = re.search(r"FROM \((.*?)\) TO \((.*?)\)", bound)
+        if match is None:
+            partitions.append(Partition(name))
+            continue
+
+        lower, upper = (v.strip("'") for v in match.groups())
+        partitions.append(
+            Partition(
+                name,
+                int(lower) if lower != "MINVALUE" else None,
+                int(upper) if upper != "MAXVALUE" else None,
+            )
+        )
+
+    # partitions are named `words_0`, `words_1`, ... in order
+    partitions.sort(key=lambda p: int(p.name.rsplit("_", 1)[-1]))
+    return row[0], partitions
+
+
+def partition_words(
+    cur: Any, partitions: int, by: str = "word", ids: Iterable[int] = ()
+) -> None:
+    """
+    Replace the (empty) `words` table with one partitioned into the given
+    number of partitions, either by hash of the word or by ranges of
+    document ids (see `PARTITION_KEYS`). The ranges are chosen so that
+    each partition holds the same number of the given documents.
+    Nothing is done if `words` is already partitioned by the same key.
+
+    Parameters:
+        cur: The database cursor used to execute the statement
+        partitions: The number of partitions
+        by: The partition key, one of `PARTITION_KEYS`
+        ids: The ids of the documents to load, used to choose the ranges
+
+    Raises:
+        ValueError: If the partition key is unknown, or if `words`
+            holds rows and is not partitioned by the same key already
+    """
+    log = logging.getLogger("gutensearch.load")
+    if by not in PARTITION_KEYS:
+        raise ValueError(f"Unknown partition key: {by}")
+
+    key, existing = read_partitions(cur)
+    if key == by:
+        log.info(f"Table words is already partitioned into {len(existing)} partitions")
+        return
+
+    cur.execute("SELECT EXISTS (SELECT 1 FROM words)")
+    if cur.fetchone()[0]:
+        raise ValueError("The words table must be empty to change its partitioning")
+
+    log.info(f"Partitioning table words into {partitions} partitions by {by}")
+    cur.execute("DROP TABLE words")
+    cur.execute(PARTITIONED_WORDS_TABLE.format(key=PARTITION_KEYS[by]))
+
+    if by == "word":
+        for i in range(partitions):
+            cur.execute(
+                f"CREATE TABLE words_{i} PARTITION OF words "
+                f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {i})"
+            )
+        return
+
+    bounds = ["MINVALUE", *(str(b) for b in range_bounds(ids, partitions)), "MAXVALUE"]
+    for i, (lower, upper) in enumerate(zip(bounds, bounds[1:])):
+        cur.execute(
+            f"CREATE TABLE words_{i} PARTITION OF words "
+            f"FOR VALUES FROM ({lower}) TO ({upper})"
+        )
+
+
+def create_indexes_parallel(
+    connect: Callable[[], Any],
+    partitions: Sequence[Partition],
+    workers: int,
+) -> None:
+    """
+    Create the indexes on the `words` table (of the `flat` layout) using
+    several connections at once. When `words` is partitioned, the index
+    of every partition is built on its own, and then attached to the
+    index of the whole table. Otherwise, each index is built at once.
+
+    Parameters:
+        connect: A function opening a new database connection
+        partitions: The partitions of the `words` table, if any
+        workers: The number of indexes built at once
+    """
+    jobs = []
+    attach = []
+    for name, columns in INDEXES["flat"].items():
+        if len(partitions) == 0:
+            jobs.append(f"CREATE INDEX {name} ON {columns}")
+            continue
+
+        column = columns[columns.index("(") :]
+        jobs.append(f"CREATE INDEX {name} ON ONLY words {column}")
+        for i, p in enumerate(partitions):
+            jobs.append(f"CREATE INDEX {name}_{i} ON {p.name} {column}")
+            attach.append(f"ALTER INDEX {name} ATTACH PARTITION {name}_{i}")
+
+    local = threading.local()
+    cons: List[Any] = []
+    lock = threading.Lock()
+
+    def execute(sql: str) -> None:
+        if not hasattr(local, "con"):
+            local.con = connect()
+            with lock:
+                cons.append(local.con)
+        with local.con.cursor() as cur:
+            cur.execute(sql)
+        local.con.commit()
+
+    try:
+        with phase("index"):
+            # the (empty) indexes on the partitioned table go first
+            for sql in [j for j in jobs if " ON ONLY " in j]:
+                execute(sql)
+
+            with ThreadPoolExecutor(max(workers, 1)) as executor:
+                builds = [j for j in jobs if " ON ONLY " not in j]
+                list(executor.map(execute, builds))
+
+            for sql in attach:
+                execute(sql)
+    finally:
+        for con in cons:
+            con.close()
+
+
+def parallel_records(
+    connect: Callable[[], Any],
+    documents: Iterable[DocumentCounts],
+    writers: int,
+    batch_size: int = BATCH_SIZE,
+    queue_size: int = QUEUE_SIZE,
+    files: Sequence[DocumentFile] = (),
+    partitions: int = 0,
+    partition_by: str = "word",
+    copy_format: str = "text",
+    rank: bool = False,
+    positions: bool = False,
+    document_ids: Optional[Sequence[int]] = None,
+) -> None:
+    """
+    Write the parsed documents to the `words` table (of the `flat` layout)
+    using several `COPY` connections at once, optionally partitioning the
+    table first (see `partition_words`). With partitions by range of
+    document ids, each document is routed to the writer of its partition,
+    which copies straight into that partition. Otherwise, documents are
+    dealt out to `writers` writers in turn. The indexes are then built
+    concurrently (see `create_indexes_parallel`).
+
+    Unlike `stream_records`, the load is not a single transaction: the
+    indexes are dropped, each writer commits once every writer has
+    finished, and the indexes are built before the manifest is updated.
+
+    Parameters:
+        connect: A function opening a new database connection
+        documents: The parsed documents to load
+        writers: The number of connections copying rows at once
+        batch_size: The number of rows written by a single `COPY`,
+            shared between the writers
+        queue_size: The maximum number of batches waiting for each writer
+        files: The documents to add to the manifest of loaded documents
+        partitions: The number of partitions to create, if any
+        partition_by: The partition key, one of `PARTITION_KEYS`
+        copy_format: The `COPY` format, see `gutensearch.pgcopy.COPY_FORMATS`
+        rank: Build the ranking statistics (see `gutensearch.rank`), which
+            are rebuilt by every load once they exist
+        positions: Write the positional index (see `gutensearch.positions`),
+            which is kept up to date by every load once it exists, so the
+            documents must then be parsed with their positions
+        document_ids: The ids of the documents to load, used to choose the
+            bounds of range partitions before any document is parsed, since
+            `files` may only be complete once every document is consumed
+            (defaults to the ids of `files`)
+    """
+    log = logging.getLogger("gutensearch.load")
+    con = connect()
+    cur = con.cursor()
+
+    if document_ids is None:
+        document_ids = [f.document_id for f in files]
+
+    if partitions > 1:
+        partition_words(cur, partitions, partition_by, document_ids)
+
+    key, parts = read_partitions(cur)
+
+    # the indexes are dropped for good before copying, since holding
+    # their locks would block every other connection
+    positions = prepare_positions(cur, positions)
+
+    log.info("Temporarily dropping indexes on table: words")
+    drop_indexes(cur)
+    if positions:
+        drop_position_indexes(cur)
+    con.commit()
+
+    if key == "document_id":
+        targets = [p.name for p in parts]
+        lowers = [p.lower for p in parts[1:]]
+
+        def route(doc: DocumentCounts) -> int:
+            return bisect_right(lowers, doc.document_id)  # type: ignore
+
+    else:
+        targets = ["words"] * max(writers, 1)
+        turn = count()
+
+        def route(doc: DocumentCounts) -> int:
+            return next(turn) % len(targets)
+
+    log.info(
+        f"Streaming results to database with {len(targets)} writers "
+        f"in batches of {batch_size // len(targets)} rows"
+    )
+    cons = [connect() for _ in targets]
+    sinks = [
+        CopyWriter(c, "flat", queue_size, t, copy_format) for c, t in zip(cons, targets)
+    ]
+    for w in sinks:
+        w.start()
+
+    try:
+
+        def buffer() -> Any:
+            return copy_buffer(copy_format) if positions else None
+
+        buffers = [copy_buffer(copy_format) for _ in sinks]
+        pbuffers = [buffer() for _ in sinks]
+        rows = [0 for _ in sinks]
+        # every writer is closed and waited for, even if another one fails
+        # (the errors of the others are chained to the one that is raised)
+        with ExitStack() as stack:
+            for w in sinks:
+                stack.callback(w.close)
+
+            for doc in documents:
+                k = route(doc)
+                write_rows(buffers[k], doc, copy_format, pbuffers[k])
+                rows[k] += len(doc.words)
+
+                if rows[k] >= batch_size // len(sinks):
+                    sinks[k].write(buffers[k], rows[k], pbuffers[k])
+                    buffers[k], rows[k] = copy_buffer(copy_format), 0
+                    pbuffers[k] = buffer()
+
+            for w, fio, pfio, n in zip(sinks, buffers, pbuffers, rows):
+                if n > 0:
+                    w.write(fio, n, pfio)
+
+        for c in cons:
+            c.commit()
+    except BaseException:
+        # every writer rolls back, so put back the indexes of the rows
+        # already in the table before giving up
+        log.error("Failed to write rows to database, recreating indexes")
+        # the writers hold locks on the table until they roll back
+        for c in cons:
+            c.rollback()
+        create_indexes_parallel(connect, parts, len(targets))
+        raise
+    finally:
+        for c in cons:
+            c.close()
+
+    log.info(f"Finished writing {sum(w.rows for w in sinks)} rows to database")
+
+    log.info("Truncating table: distinct_words")
+    with phase("distinct_words"):
+        cur.execute("TRUNCATE TABLE distinct_words")
+
+        log.info("Writing new distinct words to database")
+        cur.execute("INSERT INTO distinct_words SELECT DISTINCT word FROM words")
+        con.commit()
+
+    log.info(f"Recreating indexes on table: words, {len(targets)} at a time")
+    create_indexes_parallel(connect, parts, len(targets))
+    if positions:
+        create_position_indexes(cur)
+
+    if rank or has_rank_tables(cur):
+        rebuild_rank(cur)
+
+    log.info("Updating manifest of loaded documents")
+    record_documents(cur, files)
+    cur.execute(BUMP_LOAD_GENERATION)
+
+    log.info("Committing changes to database")
+    con.commit()
+    cur.close()
+
+    log.info("Running vacuum analyze on table: words")
+    vacuum_analyze(con)
+    con.close()
+
+
+def write_fuzzy_index(con: Any, path: Path, schema: str = "flat") -> None:
+    """
+    Build the fuzzy word matching index (see `gutensearch.fuzzy`)
+    from every distinct word in the database.
+
+    Parameters:
+        con: The database connection
+        path: The path of the index file to write
+        schema: The database layout, see `gutensearch.database.SCHEMAS`
+    """
+    log = logging.getLogger("gutensearch.load")
+    log.info(f"Building fuzzy word matching index: {path}")
+
+    # stream the words using a server-side cursor
+    with phase("fuzzy_index"):
+        cur = con.cursor(name="distinct_words")
+        cur.execute(f"SELECT word FROM {DISTINCT_WORDS_TABLES[schema]}")
+        build_fuzzy_index((r[0] for r in cur), path)
+        cur.close()
+        con.commit()
+
+    log.info("Finished building fuzzy word matching index")
@@ -0,0 +1,466 @@
+"""
+This module measures where the time of `gutensearch load` goes. Each
+phase of a load (parsing documents, serializing their rows, writing them
+with `COPY`, rebuilding the indexes, `VACUUM`, ...) is timed using
+`phase`, which adds the wall-clock and CPU time spent in it to the
+`METRICS` of the current load. Phases may run inside of each other (for
+example, documents are parsed while the SQLite backend inserts rows), in
+which case the time of the inner phase is only counted once, as part of
+the inner phase. Phases also run in several threads at once (one per
+`COPY` writer), so the time of a phase is summed over every thread and
+may exceed the duration of the load.
+
+Every document parsed by a worker process is measured in that process
+(see `TimedParse`), so the throughput and peak memory usage (RSS) of
+every worker are known, along with those of the loading process. Once
+loaded, the metrics can be summarized as JSON (see `LoadMetrics.summary`)
+or written as a Prometheus textfile (see `write_prometheus`), e.g. for
+the textfile collector of the node exporter. Optionally, each process
+can also be profiled with `cProfile` (see `profiled`).
+"""
+
+import os
+import sys
+import time
+import cProfile
+import logging
+import threading
+from contextlib import contextmanager
+from multiprocessing.util import Finalize
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    ContextManager,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+from .parse import DocumentCounts
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None  # type: ignore
+
+# the phases of a load, in the order they usually run
+PHASES = (
+    "scan",
+    "parse",
+    "serialize",
+    "delete",
+    "copy",
+    "distinct_words",
+    "index",
+    "rank",
+    "positions",
+    "manifest",
+    "vacuum",
+    "fuzzy_index",
+)
+
+# the profiler of a worker process, started by its first `TimedParse` call
+_profiler: Optional[cProfile.Profile] = None
+
+
+class PhaseStats(NamedTuple):
+    """
+    The time spent in a single phase of a load
+
+    Parameters:
+        name: The name of the phase, one of `PHASES`
+        calls: The number of times the phase ran
+        wall: The wall-clock time spent in the phase, summed over every thread
+        cpu: The CPU time spent in the phase, summed over every thread
+    """
+
+    name: str
+    calls: int
+    wall: float
+    cpu: float
+
+
+class ParseStats(NamedTuple):
+    """
+    The measurements of a single parsed document, taken by the process
+    that parsed it (see `TimedParse`)
+
+    Parameters:
+        pid: The id of the process that parsed the document
+        wall: The wall-clock time spent parsing the document
+        cpu: The CPU time spent parsing the document
+        bytes: The size of the document on disk
+        rows: The number of unique words found in the document
+        max_rss: The peak memory usage (RSS) of the process so far, in bytes
+    """
+
+    pid: int
+    wall: float
+    cpu: float
+    bytes: int
+    rows: int
+    max_rss: int
+
+
+class WorkerStats(NamedTuple):
+    """
+    The total measurements of every document parsed by a single process
+
+    Parameters:
+        pid: The id of the process
+        documents: The number of documents parsed
+        rows: The number of rows found in the documents
+        bytes: The size of the documents on disk
+        wall: The wall-clock time spent parsing
+        cpu: The CPU time spent parsing
+        max_rss: The peak memory usage (RSS) of the process, in bytes
+    """
+
+    pid: int
+    documents: int
+    rows: int
+    bytes: int
+    wall: float
+    cpu: float
+    max_rss: int
+
+
+def peak_rss() -> int:
+    """
+    The peak memory usage (resident set size) of the current process
+
+    Returns:
+        The peak memory usage in bytes, or 0 if it cannot be measured
+    """
+    if resource is None:
+        return 0
+
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, but bytes on macOS
+    return usage if sys.platform == "darwin" else 1024 * usage
+
+
+class LoadMetrics:
+    """
+    The metrics of a single load, recorded by any number of threads
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Discard every measurement and start measuring a new load
+        """
+        with self.lock:
+            self.started = time.perf_counter()
+            self.cpu_started = time.process_time()
+            self.phases: Dict[str, List[float]] = {}
+            self.workers: Dict[int, WorkerStats] = {}
+            self.documents = 0
+            self.rows = 0
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Add the time spent in the `with` block to the given phase, minus
+        the time spent in any phase nested inside of it
+
+        Parameters:
+            name: The name of the phase, one of `PHASES`
+        """
+        stack = self.local.__dict__.setdefault("stack", [])
+        # the time spent in nested phases, which is not counted twice
+        nested = [0.0, 0.0]
+        stack.append(nested)
+
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.thread_time() - cpu
+            stack.pop()
+            if len(stack) > 0:
+                stack[-1][0] += wall
+                stack[-1][1] += cpu
+
+            with self.lock:
+                stats = self.phases.setdefault(name, [0, 0.0, 0.0])
+                stats[0] += 1
+                stats[1] += wall - nested[0]
+                stats[2] += cpu - nested[1]
+
+    def count(self, doc: DocumentCounts) -> None:
+        """
+        Count a document (and its rows) written to the database
+        """
+        with self.lock:
+            self.documents += 1
+            self.rows += len(doc.words)
+
+    def parsed(
+        self, results: Iterable[Tuple[DocumentCounts, ParseStats]]
+    ) -> Iterator[DocumentCounts]:
+        """
+        Record the measurements of documents parsed using `TimedParse`.
+        Any time spent waiting for the next document is added to the
+        `parse` phase.
+
+        Parameters:
+            results: The documents and measurements returned by `TimedParse`
+
+        Returns:
+            A generator of the parsed documents
+        """
+        results = iter(results)
+        while True:
+            with self.phase("parse"):
+                result = next(results, None)
+            if result is None:
+                return
+
+            doc, stats = result
+            with self.lock:
+                w = self.workers.get(
+                    stats.pid, WorkerStats(stats.pid, 0, 0, 0, 0, 0, 0)
+                )
+                self.workers[stats.pid] = WorkerStats(
+                    stats.pid,
+                    w.documents + 1,
+                    w.rows + stats.rows,
+                    w.bytes + stats.bytes,
+                    w.wall + stats.wall,
+                    w.cpu + stats.cpu,
+                    max(w.max_rss, stats.max_rss),
+                )
+            yield doc
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Summarize the metrics of the load so far
+
+        Returns:
+            A JSON serializable dictionary, with the duration and CPU time of
+            the whole load, the number of documents and rows written and their
+            throughput, the bytes read, the peak memory usage of the loading
+            process and of the workers, and the time spent in each phase and
+            by each worker
+        """
+        with self.lock:
+            wall = time.perf_counter() - self.started
+            cpu = time.process_time() - self.cpu_started
+            phases = [
+                PhaseStats(k, int(v[0]), v[1], v[2]) for k, v in self.phases.items()
+            ]
+            workers = sorted(self.workers.values())
+            documents, rows = self.documents, self.rows
+
+        order = {name: i for i, name in enumerate(PHASES)}
+        phases.sort(key=lambda p: order.get(p.name, len(PHASES)))
+        read = sum(w.bytes for w in workers)
+
+        return {
+            "seconds": wall,
+            "cpu_seconds": cpu,
+            "documents": documents,
+            "rows": rows,
+            "bytes_read": read,
+            "documents_per_s": documents / wall if wall > 0 else 0.0,
+            "rows_per_s": rows / wall if wall > 0 else 0.0,
+            "bytes_read_per_s": read / wall if wall > 0 else 0.0,
+            "peak_rss_bytes": peak_rss(),
+            "workers_peak_rss_bytes": max((w.max_rss for w in workers), default=0),
+            "phases": {
+                p.name: {"calls": p.calls, "seconds": p.wall, "cpu_seconds": p.cpu}
+                for p in phases
+            },
+            "workers": [
+                {
+                    "pid": w.pid,
+                    "documents": w.documents,
+                    "rows": w.rows,
+                    "bytes_read": w.bytes,
+                    "seconds": w.wall,
+                    "cpu_seconds": w.cpu,
+                    "documents_per_s": w.documents / w.wall if w.wall > 0 else 0.0,
+                    "rows_per_s": w.rows / w.wall if w.wall > 0 else 0.0,
+                    "peak_rss_bytes": w.max_rss,
+                }
+                for w in workers
+            ],
+        }
+
+
+# the metrics of the current load
+METRICS = LoadMetrics()
+
+
+def phase(name: str) -> ContextManager[None]:
+    """
+    Add the time spent in the `with` block to a phase of the current load.
+    See `LoadMetrics.phase`.
+    """
+    return METRICS.phase(name)
+
+
+class TimedParse:
+    """
+    A wrapper of the function used to parse a single document, which can be
+    sent to worker processes. Each document is measured by the process that
+    parses it, and returned along with its measurements (see
+    `LoadMetrics.parsed`). Optionally, every worker process is profiled
+    while parsing, and saves its profile to `parse-{pid}.prof` when it exits.
+
+    Parameters:
+        parse: The function used to parse a single document
+        profile: The directory to save the profile of each worker to, if any
+    """
+
+    def __init__(
+        self,
+        parse: Callable[[Path], DocumentCounts],
+        profile: Optional[Path] = None,
+    ):
+        self.parse = parse
+        self.profile = profile
+        # the loading process is profiled as a whole, see `profiled`
+        self.pid = os.getpid()
+
+    def __call__(self, path: Path) -> Tuple[DocumentCounts, ParseStats]:
+        profiler = None
+        if self.profile is not None and os.getpid() != self.pid:
+            profiler = _worker_profiler(self.profile)
+
+        wall, cpu = time.perf_counter(), time.thread_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            doc = self.parse(path)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+        wall = time.perf_counter() - wall
+        cpu = time.thread_time() - cpu
+
+        stats = ParseStats(
+            os.getpid(), wall, cpu, path.stat().st_size, len(doc.words), peak_rss()
+        )
+        return doc, stats
+
+
+def _worker_profiler(directory: Path) -> cProfile.Profile:
+    global _profiler
+    if _profiler is None:
+        _profiler = cProfile.Profile()
+        path = directory / f"parse-{os.getpid()}.prof"
+        # run when the worker exits on its own, rather than being terminated
+        Finalize(None, _profiler.dump_stats, args=(str(path),), exitpriority=0)
+
+    return _profiler
+
+
+@contextmanager
+def profiled(directory: Optional[Path]) -> Iterator[None]:
+    """
+    Profile the current process using `cProfile` while in the `with` block,
+    and save the profile to `load-{pid}.prof` in the given directory (which
+    can be read using `pstats`, or tools such as `snakeviz`)
+
+    Parameters:
+        directory: The directory to save the profile to, or `None`
+            to skip profiling
+    """
+    if directory is None:
+        yield
+        return
+
+    log = logging.getLogger("gutensearch.load")
+    directory.mkdir(parents=True, exist_ok=True)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        path = directory / f"load-{os.getpid()}.prof"
+        profiler.dump_stats(str(path))
+        log.info(f"Saved profile: {path}")
+
+
+def prometheus_text(summary: Dict[str, Any], prefix: str = "gutensearch_load") -> str:
+    """
+    Format a summary of the metrics of a load (see `LoadMetrics.summary`)
+    in the Prometheus text exposition format
+
+    Parameters:
+        summary: The summary of the load
+        prefix: The prefix of the name of each metric
+
+    Returns:
+        Every metric, with its help and type
+    """
+    lines: List[str] = []
+
+    def gauge(name: str, help_: str, samples: Iterable[Tuple[str, float]]) -> None:
+        lines.append(f"# HELP {prefix}_{name} {help_}")
+        lines.append(f"# TYPE {prefix}_{name} gauge")
+        for labels, value in samples:
+            lines.append(f"{prefix}_{name}{labels} {value}")
+
+    phases = summary["phases"]
+    gauge("duration_seconds", "Duration of the load", [("", summary["seconds"])])
+    gauge(
+        "cpu_seconds",
+        "CPU time of the loading process",
+        [("", summary["cpu_seconds"])],
+    )
+    gauge("documents", "Documents written", [("", summary["documents"])])
+    gauge("rows", "Rows written", [("", summary["rows"])])
+    gauge("read_bytes", "Bytes of documents parsed", [("", summary["bytes_read"])])
+    gauge(
+        "phase_seconds",
+        "Wall-clock time of each phase, summed over every thread",
+        [(f'{{phase="{k}"}}', v["seconds"]) for k, v in phases.items()],
+    )
+    gauge(
+        "phase_cpu_seconds",
+        "CPU time of each phase, summed over every thread",
+        [(f'{{phase="{k}"}}', v["cpu_seconds"]) for k, v in phases.items()],
+    )
+    gauge(
+        "peak_rss_bytes",
+        "Peak memory usage (RSS) of the loading process and of any worker",
+        [
+            ('{process="load"}', summary["peak_rss_bytes"]),
+            ('{process="worker"}', summary["workers_peak_rss_bytes"]),
+        ],
+    )
+    gauge(
+        "last_success_timestamp_seconds",
+        "Time the last load finished",
+        [("", time.time())],
+    )
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(summary: Dict[str, Any], path: Path) -> None:
+    """
+    Write a summary of the metrics of a load (see `LoadMetrics.summary`) to
+    a Prometheus textfile. The file is first written to a temporary file,
+    so it is never read partially written.
+
+    Parameters:
+        summary: The summary of the load
+        path: The path to write the textfile to, e.g. `gutensearch.prom`
+    """
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(prometheus_text(summary))
+    os.replace(tmp, path)
@@ -6,13 +6,205 @@ of each word in the given document.
 """
 
 import os
-from typing import Sequence, List, IO, Generator, Dict, Union
-from collections import Counter
+import bz2
+import gzip
+import heapq
+import zipfile
+from array import array
+from contextlib import contextmanager
+from io import BytesIO, StringIO, TextIOWrapper
+from typing import (
+    Sequence,
+    Iterable,
+    Iterator,
+    List,
+    IO,
+    BinaryIO,
+    Generator,
+    Dict,
+    Optional,
+    Union,
+    NamedTuple,
+)
+from collections import Counter, defaultdict
 from difflib import SequenceMatcher
 from pathlib import Path
 
+from .pgcopy import encode_word_positions, encode_words
+from .positions import encode_positions
 
-def lazytokenize(io: IO) -> Generator[str, None, None]:
+# number of bytes read from a document at a time by `chunktokenize`
+BLOCK_SIZE = 1 << 20
+
+# the tokenizer engines available to `parse_word_count` and `parse_document`
+TOKENIZERS = {
+    "lazy",
+    "chunked",
+}
+
+# the file names of the documents that can be parsed, from the most
+# preferred to the least preferred when a document is stored more than once
+DOCUMENT_SUFFIXES = (".txt", ".txt.gz", ".txt.bz2", ".zip")
+
+# translation table used by `chunktokenize` that maps upper case letters
+# to lower case letters, and any other byte to an ASCII space
+_LETTERS = bytes(range(65, 91)) + bytes(range(97, 123))
+_TOKEN_TABLE = bytes((b | 0x20) if b in _LETTERS else 0x20 for b in range(256))
+
+
+class DocumentCounts(NamedTuple):
+    """
+    A compact representation of the word counts of a single document,
+    holding every unique word and its count in two parallel sequences
+    rather than as one dictionary per word. This is considerably cheaper
+    to send between processes, and to turn into rows for the database.
+
+    Attributes:
+        document_id: The id of the document
+        words: Every unique word found in the document
+        counts: The count of each word, in the same order as `words`
+        positions: The packed positions of each word, in the same order as
+            `words` (see `gutensearch.positions.encode_positions`), if the
+            document was parsed with its positions
+    """
+
+    document_id: int
+    words: List[str]
+    counts: "array[int]"
+    positions: Optional[List[bytes]] = None
+
+    def copy_text(self) -> str:
+        """
+        Format the word counts as tab-separated `word`, `document_id`,
+        `count` rows, as expected by the Postgres `COPY` command
+
+        Returns:
+            The rows, each terminated by a newline
+        """
+        suffix = f"\t{self.document_id}\t"
+        return "".join(f"{w}{suffix}{c}\n" for w, c in zip(self.words, self.counts))
+
+    def copy_binary(self) -> bytes:
+        """
+        Format the word counts as `word`, `document_id`, `count` rows in
+        the binary format of the Postgres `COPY` command (see `gutensearch.pgcopy`)
+
+        Returns:
+            The rows, without the header or trailer of the stream
+        """
+        return encode_words(self.document_id, self.words, self.counts)
+
+    def copy_positions_text(self) -> str:
+        """
+        Format the positions of the words as tab-separated `word`,
+        `document_id`, `positions` rows of the `word_positions` table,
+        as expected by the Postgres `COPY` command
+
+        Returns:
+            The rows, each terminated by a newline
+        """
+        suffix = f"\t{self.document_id}\t\\\\x"
+        return "".join(
+            f"{w}{suffix}{p.hex()}\n" for w, p in zip(self.words, self.positions or [])
+        )
+
+    def copy_positions_binary(self) -> bytes:
+        """
+        Format the positions of the words as `word`, `document_id`,
+        `positions` rows of the `word_positions` table in the binary
+        format of the Postgres `COPY` command
+
+        Returns:
+            The rows, without the header or trailer of the stream
+        """
+        return encode_word_positions(self.document_id, self.words, self.positions or [])
+
+
+class Candidate(NamedTuple):
+    """
+    A possible match for a word when performing fuzzy word matching
+
+    Attributes:
+        word: The word that was matched
+        score: The comparison "ratio" between 0 and 1, where 1 is an exact match
+    """
+
+    word: str
+    score: float
+
+
+def is_document(name: str) -> bool:
+    """
+    Check whether the given file name is a document that can be parsed,
+    either plain text or compressed (see `DOCUMENT_SUFFIXES`)
+
+    Parameters:
+        name: The name of the file
+
+    Returns:
+        `True` if the file is a document, `False` otherwise
+    """
+    return name.lower().endswith(DOCUMENT_SUFFIXES)
+
+
+def document_id(path: Path) -> int:
+    """
+    Extract the document id from the name of the given document,
+    ignoring every extension and any `-0` or `-8` suffix used by
+    Project Gutenberg. For example, `18546.txt`, `18546.txt.gz`
+    and `18546-0.zip` all represent the document with id `18546`.
+
+    Parameters:
+        path: The path to the document
+
+    Returns:
+        The document id
+
+    Raises:
+        ValueError: If the name of the document is not a document id
+    """
+    return int(path.name.split(".")[0].split("-")[0])
+
+
+@contextmanager
+def open_document(path: Path) -> Iterator[BinaryIO]:
+    """
+    Open the given document as a binary stream of its text, decompressing
+    `.gz` and `.bz2` files as they are read. For a Project Gutenberg `.zip`
+    file, the first text file in the archive is read (in the same order
+    of precedence as `gutensearch.download.choose_text_file`).
+
+    Parameters:
+        path: The path to the document
+
+    Returns:
+        The binary stream of the text of the document
+
+    Raises:
+        ValueError: If a `.zip` file does not contain any text file
+    """
+    name = path.name.lower()
+    if name.endswith(".gz"):
+        with gzip.open(path, "rb") as f:
+            yield f  # type: ignore
+    elif name.endswith(".bz2"):
+        with bz2.open(path, "rb") as f:
+            yield f  # type: ignore
+    elif name.endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            members = [m for m in archive.namelist() if m.lower().endswith(".txt")]
+            if len(members) == 0:
+                raise ValueError(f"No text file found in archive: {path}")
+
+            members.sort(key=lambda m: os.path.splitext(m)[0])
+            with archive.open(members[0]) as f:
+                yield f  # type: ignore
+    else:
+        with open(path, "rb") as f:
+            yield f
+
+
+def lazytokenize(io: "IO[str]") -> Generator[str, None, None]:
     """
     Apply a simple tokenization strategy to the stream
     of text provided by keeping any sequences of characters
@@ -48,40 +240,219 @@ def lazytokenize(io: IO) -> Generator[str, None, None]:
 
                 chars = []
 
+    # flush the last word if the stream does not end with a separator
+    if len(chars) > 0:
+        yield "".join(chars)
+
+
+def chunktokens(
+    io: BinaryIO, block_size: int = BLOCK_SIZE
+) -> Generator[List[bytes], None, None]:
+    """
+    Read the binary stream in large blocks and split each block into
+    lower case ASCII tokens using a single translation table pass,
+    rather than inspecting each character in Python. Any token that
+    runs up to the end of a block is held back and joined with the
+    start of the next block so words crossing a block boundary are
+    never split in two.
+
+    Parameters:
+        io: The binary stream of text to tokenize
+        block_size: The number of bytes to read from the stream at a time
 
-def parse_word_count(path: Path) -> Counter:
+    Returns:
+        A generator of lists, where each list holds the tokens (as bytes)
+        found in a single block
+    """
+    # holds a (possibly incomplete) word left over from the previous block
+    tail = b""
+
+    while True:
+        block = io.read(block_size)
+        if len(block) == 0:
+            break
+
+        data = (tail + block).translate(_TOKEN_TABLE)
+        tokens = data.split()
+
+        # the last word may continue in the next block
+        if len(tokens) > 0 and data[-1] != 0x20:
+            tail = tokens.pop()
+        else:
+            tail = b""
+
+        yield tokens
+
+    if len(tail) > 0:
+        yield [tail]
+
+
+def chunktokenize(
+    io: BinaryIO, block_size: int = BLOCK_SIZE
+) -> Generator[str, None, None]:
+    """
+    Apply the same tokenization strategy as `lazytokenize`, keeping
+    any sequences of upper/lower case (ASCII) letters, converted to
+    lower case. The stream is read in large binary blocks instead of
+    character by character, making this function significantly faster
+    while still producing identical tokens.
+
+    Parameters:
+        io: The binary stream of text to tokenize
+        block_size: The number of bytes to read from the stream at a time
+
+    Returns:
+        A generator of strings representing each "token"
+    """
+    for tokens in chunktokens(io, block_size):
+        for token in tokens:
+            yield token.decode("ascii")
+
+
+def parse_word_count(path: Path, tokenizer: str = "chunked") -> "Counter[str]":
     """
     Count the occurence of each unique (cleaned & tokenized)
-    word from the provided text document.
+    word from the provided text document, which may also be
+    compressed (see `open_document`).
     This function is suitable to be used with multiprocessing.
 
     Parameters:
         path: The path to the document
+        tokenizer:
+            The tokenizer engine to use, either `chunked` (default)
+            or `lazy`. Both produce identical results.
 
     Returns:
         A counter where each key is a unique instance of a
         word, and the value is the count of how frequently
         that word occured in the given document.
+
+    Raises:
+        ValueError: If the tokenizer is not one of `TOKENIZERS`
     """
-    with open(path, "r") as f:
-        count = Counter(lazytokenize(f))
+    if tokenizer not in TOKENIZERS:
+        raise ValueError(f"Unknown tokenizer: {tokenizer}")
+
+    # compressed documents are decompressed as they are read
+    if tokenizer == "lazy":
+        with open_document(path) as f:
+            return Counter(lazytokenize(TextIOWrapper(f)))
+
+    with open_document(path) as f:
+        return chunkcount(f)
+
 
-    return count
+def chunkcount(io: BinaryIO) -> "Counter[str]":
+    """
+    Count the occurence of each unique word from the binary stream,
+    using the same tokenization strategy as `chunktokenize`
 
+    Parameters:
+        io: The binary stream of text to count the words of
 
-def parse_document(path: Path) -> List[Dict[str, Union[str, int]]]:
+    Returns:
+        A counter of each unique word, see `parse_word_count`
+    """
+    # count the raw bytes first, and only decode each unique word once
+    counts: "Counter[bytes]" = Counter()
+    for tokens in chunktokens(io):
+        counts.update(tokens)
+
+    return Counter({w.decode("ascii"): c for w, c in counts.items()})
+
+
+def chunkpositions(io: BinaryIO) -> Dict[str, List[int]]:
+    """
+    Find the positions of each unique word in the binary stream, using the
+    same tokenization strategy as `chunktokenize`, where the position of a
+    word is its index in the sequence of every word in the stream
+
+    Parameters:
+        io: The binary stream of text to find the positions of the words in
+
+    Returns:
+        The positions of each unique word, in increasing order
+    """
+    positions: Dict[bytes, List[int]] = defaultdict(list)
+    offset = 0
+    for tokens in chunktokens(io):
+        for i, token in enumerate(tokens, offset):
+            positions[token].append(i)
+        offset += len(tokens)
+
+    return {w.decode("ascii"): p for w, p in positions.items()}
+
+
+def lazypositions(io: "IO[str]") -> Dict[str, List[int]]:
+    """
+    Find the positions of each unique word in the stream of text,
+    using `lazytokenize`, see `chunkpositions`
+    """
+    positions: Dict[str, List[int]] = defaultdict(list)
+    for i, token in enumerate(lazytokenize(io)):
+        positions[token].append(i)
+
+    return dict(positions)
+
+
+def parse_word_positions(
+    path: Path, tokenizer: str = "chunked"
+) -> Dict[str, List[int]]:
+    """
+    Find the positions of each unique (cleaned & tokenized) word from the
+    provided text document, which may also be compressed (see `open_document`)
+
+    Parameters:
+        path: The path to the document
+        tokenizer: The tokenizer engine to use, see `parse_word_count`
+
+    Returns:
+        The positions of each unique word in the document, in increasing
+        order, where the number of positions is the count of the word
+
+    Raises:
+        ValueError: If the tokenizer is not one of `TOKENIZERS`
+    """
+    if tokenizer not in TOKENIZERS:
+        raise ValueError(f"Unknown tokenizer: {tokenizer}")
+
+    with open_document(path) as f:
+        if tokenizer == "lazy":
+            return lazypositions(TextIOWrapper(f))
+        return chunkpositions(f)
+
+
+def positions_counts(
+    document_id: int, positions: Dict[str, List[int]]
+) -> DocumentCounts:
+    """
+    Build the word counts of a document, along with the packed positions
+    of each word, from the positions of each word
+    """
+    return DocumentCounts(
+        document_id,
+        list(positions.keys()),
+        array("I", (len(p) for p in positions.values())),
+        [encode_positions(p) for p in positions.values()],
+    )
+
+
+def parse_document(
+    path: Path, tokenizer: str = "chunked"
+) -> List[Dict[str, Union[str, int]]]:
     """
     Parse the contents of the document from the given path and
     return the results as a dictionary with the document id
     and a dictionary of the unique word instances and their count.
     The function assumes that the name of the file contains the
-    document id. For example, `18546.txt` would represent the
-    document with id `18546`.
+    document id (see `document_id`). For example, `18546.txt` (or
+    `18546.txt.gz`) would represent the document with id `18546`.
 
     This function is suitable to be used with multiprocessing.
 
     Parameters:
         path: The path to the document
+        tokenizer: The tokenizer engine to use, see `parse_word_count`
 
     Returns:
         A list of dictionaries, where each dictionary represents
@@ -89,12 +460,83 @@ def parse_document(path: Path) -> List[Dict[str, Union[str, int]]]:
         and `count`.
 
     """
-    id_ = path.name.split(".")[0]
-    count = dict(parse_word_count(path))
+    id_ = str(document_id(path))
+    count = dict(parse_word_count(path, tokenizer))
 
     return [{"word": w, "document_id": id_, "count": c} for w, c in count.items()]
 
 
+def parse_document_counts(
+    path: Path, tokenizer: str = "chunked", positions: bool = False
+) -> DocumentCounts:
+    """
+    Parse the contents of the document from the given path, in the same
+    way as `parse_document`, but return the results in the compact
+    `DocumentCounts` format.
+
+    This function is suitable to be used with multiprocessing.
+
+    Parameters:
+        path: The path to the document
+        tokenizer: The tokenizer engine to use, see `parse_word_count`
+        positions: Also find the positions of each word (see `gutensearch.positions`)
+
+    Returns:
+        The word counts of the document
+    """
+    id_ = document_id(path)
+    if positions:
+        return positions_counts(id_, parse_word_positions(path, tokenizer))
+
+    count = parse_word_count(path, tokenizer)
+
+    return DocumentCounts(id_, list(count.keys()), array("I", count.values()))
+
+
+def parse_content_counts(
+    document_id: int,
+    content: bytes,
+    tokenizer: str = "chunked",
+    positions: bool = False,
+) -> DocumentCounts:
+    """
+    Parse the contents of a document that has not been saved to disk,
+    in the same way as `parse_document_counts`
+
+    This function is suitable to be used with multiprocessing.
+
+    Parameters:
+        document_id: The id of the document
+        content: The contents of the document
+        tokenizer: The tokenizer engine to use, see `parse_word_count`
+        positions: Also find the positions of each word (see `gutensearch.positions`)
+
+    Returns:
+        The word counts of the document
+
+    Raises:
+        ValueError: If the tokenizer is not one of `TOKENIZERS`
+    """
+    if tokenizer not in TOKENIZERS:
+        raise ValueError(f"Unknown tokenizer: {tokenizer}")
+
+    if positions:
+        if tokenizer == "lazy":
+            text = content.decode("utf-8", errors="replace")
+            found = lazypositions(StringIO(text))
+        else:
+            found = chunkpositions(BytesIO(content))
+        return positions_counts(document_id, found)
+
+    if tokenizer == "lazy":
+        text = content.decode("utf-8", errors="replace")
+        count = Counter(lazytokenize(StringIO(text)))
+    else:
+        count = chunkcount(BytesIO(content))
+
+    return DocumentCounts(document_id, list(count.keys()), array("I", count.values()))
+
+
 def closest_match(word: str, corpus: Sequence[str]) -> str:
     """
     Returns the word in the corpus that is the closest match
@@ -114,6 +556,26 @@ def closest_match(word: str, corpus: Sequence[str]) -> str:
     return result[0]
 
 
+def closest_matches(
+    word: str, corpus: Iterable[str], limit: int = 10
+) -> List[Candidate]:
+    """
+    Returns the words in the corpus that are the closest match to
+    the word specified, ordered by the highest comparison "ratio".
+    This uses the same scoring as `closest_match`.
+
+    Parameters:
+        word: The word to perform a "fuzzy match" on
+        corpus: The corpus of words to try and match against
+        limit: Return only the top `n` closest matches
+
+    Returns:
+        The closest matching words and their scores
+    """
+    ratios = (Candidate(w, SequenceMatcher(None, word, w).ratio()) for w in corpus)
+    return heapq.nlargest(limit, ratios, key=lambda c: c.score)
+
+
 def parse_gutenberg_index() -> List[int]:
     """
     Makes the best attempt at extracting each document id
@@ -0,0 +1,236 @@
+"""
+This module encodes rows in the binary format of the Postgres `COPY`
+command, as an alternative to the tab-separated text format used by
+default. In the binary format, every value is sent with its length, and
+integers are sent as fixed-size big-endian values, so Postgres can store
+each row without parsing (and validating) any text. A stream starts with
+`BINARY_HEADER` and ends with `BINARY_TRAILER`, and every row starts with
+its number of columns.
+
+See https://www.postgresql.org/docs/current/sql-copy.html#id-1.9.3.55.9.4
+"""
+
+import struct
+from io import BytesIO
+from itertools import chain
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+# the formats that rows can be written to the database in with `COPY`
+COPY_FORMATS = (
+    "text",
+    "binary",
+)
+
+# signature, flags and length of the (empty) header extension
+BINARY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+
+# a row with -1 columns marks the end of the stream
+BINARY_TRAILER = struct.pack(">h", -1)
+
+_INT16 = struct.Struct(">h")
+_INT32 = struct.Struct(">i")
+_INT64 = struct.Struct(">q")
+_FIELD = struct.Struct(">hi")
+
+# the start of a `words` row holding a word of `n` bytes, i.e. the number of
+# columns and the length of the word, precomputed for the most common lengths
+_WORD_HEADERS = [_FIELD.pack(3, n) for n in range(256)]
+
+# the start of a `distinct_words` row holding a word of `n` bytes
+_DISTINCT_HEADERS = [_FIELD.pack(1, n) for n in range(256)]
+
+# a `count` field holding the value `n`, for the most common counts
+_COUNT_FIELDS = [_INT32.pack(4) + _INT32.pack(n) for n in range(4096)]
+
+
+def encode_words(
+    document_id: int, words: Sequence[str], counts: Sequence[int]
+) -> bytes:
+    """
+    Encode the word counts of a document as binary `word`, `document_id`,
+    `count` rows of the `words` table (`VARCHAR`, `BIGINT`, `INT`)
+
+    Parameters:
+        document_id: The id of the document
+        words: Every unique word found in the document
+        counts: The count of each word, in the same order as `words`
+
+    Returns:
+        The rows, without the header or trailer of the stream
+    """
+    # words cannot hold a null byte, so every word is encoded at once
+    encoded = "\0".join(words).encode("utf-8").split(b"\0") if words else []
+
+    # every row ends with the same id field, and most counts are small and
+    # repeated, so the end of each row is only built once per distinct count
+    middle = _INT32.pack(8) + _INT64.pack(document_id)
+    endings: Dict[int, bytes] = {}
+
+    def ending(count: int) -> bytes:
+        field = (
+            _COUNT_FIELDS[count]
+            if count < 4096
+            else _INT32.pack(4) + _INT32.pack(count)
+        )
+        endings[count] = middle + field
+        return endings[count]
+
+    # each row is made of three parts, interleaved with slice assignment
+    # rather than concatenated one row at a time, which is much faster
+    parts: List[bytes] = [b""] * (3 * len(encoded))
+    parts[0::3] = [
+        _WORD_HEADERS[len(w)] if len(w) < 256 else _FIELD.pack(3, len(w))
+        for w in encoded
+    ]
+    parts[1::3] = encoded
+    parts[2::3] = [endings.get(c) or ending(c) for c in counts]
+    return b"".join(parts)
+
+
+def encode_word_positions(
+    document_id: int, words: Sequence[str], positions: Sequence[bytes]
+) -> bytes:
+    """
+    Encode the packed positions of the words of a document (see
+    `gutensearch.positions`) as binary `word`, `document_id`, `positions`
+    rows of the `word_positions` table (`VARCHAR`, `BIGINT`, `BYTEA`)
+
+    Parameters:
+        document_id: The id of the document
+        words: Every unique word found in the document
+        positions: The packed positions of each word, in the same order as `words`
+
+    Returns:
+        The rows, without the header or trailer of the stream
+    """
+    encoded = "\0".join(words).encode("utf-8").split(b"\0") if words else []
+    middle = _INT32.pack(8) + _INT64.pack(document_id)
+
+    parts: List[bytes] = [b""] * (5 * len(encoded))
+    parts[0::5] = [
+        _WORD_HEADERS[len(w)] if len(w) < 256 else _FIELD.pack(3, len(w))
+        for w in encoded
+    ]
+    parts[1::5] = encoded
+    parts[2::5] = [middle] * len(encoded)
+    parts[3::5] = [_INT32.pack(len(p)) for p in positions]
+    parts[4::5] = positions
+    return b"".join(parts)
+
+
+def encode_distinct_words(words: Iterable[str]) -> bytes:
+    """
+    Encode words as binary rows of the `distinct_words` table (`VARCHAR`)
+
+    Parameters:
+        words: The words to encode
+
+    Returns:
+        The rows, without the header or trailer of the stream
+    """
+    encoded = [w.encode("utf-8") for w in words]
+    parts: List[bytes] = [b""] * (2 * len(encoded))
+    parts[0::2] = [
+        _DISTINCT_HEADERS[len(w)] if len(w) < 256 else _FIELD.pack(1, len(w))
+        for w in encoded
+    ]
+    parts[1::2] = encoded
+    return b"".join(parts)
+
+
+def decode_rows(data: bytes, types: Sequence[str]) -> List[Tuple[Any, ...]]:
+    """
+    Decode a binary `COPY` stream, e.g. to check the output of the
+    encoders. Only the types written by the encoders are supported.
+
+    Parameters:
+        data: The entire stream, including the header and trailer
+        types: The type of each column, either `text`, `bytea`, `int4` or `int8`
+
+    Returns:
+        Every row in the stream
+
+    Raises:
+        ValueError: If the stream is malformed or holds a `NULL` value
+    """
+    if not data.startswith(BINARY_HEADER):
+        raise ValueError("Missing binary COPY header")
+
+    rows = []
+    offset = len(BINARY_HEADER)
+    while True:
+        (columns,) = _INT16.unpack_from(data, offset)
+        offset += 2
+        if columns == -1:
+            break
+        if columns != len(types):
+            raise ValueError(f"Expected {len(types)} columns, found {columns}")
+
+        row: List[Any] = []
+        for t in types:
+            (size,) = _INT32.unpack_from(data, offset)
+            offset += 4
+            if size < 0:
+                raise ValueError("Unexpected NULL value")
+
+            value = data[offset : offset + size]
+            offset += size
+            if t == "text":
+                row.append(value.decode("utf-8"))
+            elif t == "bytea":
+                row.append(value)
+            else:
+                row.append(int.from_bytes(value, "big", signed=True))
+        rows.append(tuple(row))
+
+    if offset != len(data):
+        raise ValueError("Unexpected data after binary COPY trailer")
+
+    return rows
+
+
+class BinaryStream:
+    """
+    A file-like reader of a binary `COPY` stream, which reads the rows from
+    the buffer `size` bytes at a time, between the header and the trailer,
+    so the rows are never copied into a second buffer all at once
+
+    Parameters:
+        fio: The rows to read, without the header or trailer
+        size: The number of bytes read from the buffer at a time
+    """
+
+    def __init__(self, fio: BytesIO, size: int = 1 << 16):
+        fio.seek(0)
+        self.parts = chain(
+            (BINARY_HEADER,), iter(lambda: fio.read(size), b""), (BINARY_TRAILER,)
+        )
+        self.pending = b""
+
+    def read(self, n: int = -1) -> bytes:
+        while n < 0 or len(self.pending) < n:
+            part = next(self.parts, None)
+            if part is None:
+                break
+            self.pending += part
+
+        if n < 0:
+            data, self.pending = self.pending, b""
+        else:
+            data, self.pending = self.pending[:n], self.pending[n:]
+        return data
+
+
+def copy_binary(cur: Any, fio: BytesIO, table: str, size: int = 1 << 16) -> None:
+    """
+    Write binary rows to a table using `COPY`, adding the header
+    and trailer of the stream (see `BinaryStream`)
+
+    Parameters:
+        cur: The database cursor used to execute the statement
+        fio: The rows to write, without the header or trailer
+        table: The table to write to
+        size: The number of bytes sent to the database at a time
+    """
+    stream = BinaryStream(fio, size)
+    cur.copy_expert(f"COPY {table} FROM STDIN WITH (FORMAT binary)", stream, size)
@@ -0,0 +1,324 @@
+"""
+This module encodes and searches the optional positional index built by
+`gutensearch load --positions`, which records where each word occurs in
+each document, so that phrases (such as `"white whale"`) and words close
+to each other (such as `white NEAR/3 whale`) can be searched for. The
+`words` table only holds the number of times each word occurs, which
+cannot tell whether two words are ever next to each other.
+
+The positions of a word in a document (the index of each occurrence
+among every word of the document) are stored as a single `BYTEA` value
+of the `word_positions` table (see `gutensearch.load.POSITIONS_TABLE`).
+The positions are in increasing order, so each one is stored as the
+difference from the previous one (delta encoding), packed as a
+variable-length integer of 7 bits per byte, where the high bit is set on
+every byte but the last of each integer (varint encoding). The
+differences between the positions of a word are mostly small, so most
+positions take a single byte.
+
+Searching a phrase reads the positions of every word of the phrase, but
+only for the documents holding all of them (the posting lists are
+intersected by the database, starting from the rarest word), and the
+positions are then compared to count the matches in each document.
+"""
+
+import re
+from bisect import bisect_left, bisect_right
+from itertools import accumulate, chain
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+# e.g. white NEAR/3 whale
+NEAR_PATTERN = re.compile(r"^(\S+)\s+NEAR/(\d+)\s+(\S+)$")
+
+# the words of a query are tokenized in the same way as the documents
+# (see `gutensearch.parse.chunktokenize`)
+WORD_PATTERN = re.compile(r"[A-Za-z]+")
+
+
+class PositionalQuery(NamedTuple):
+    """
+    A phrase, or two words near each other
+
+    Parameters:
+        words: The words of the phrase in order, or the two words
+        distance: The largest number of positions between the two words,
+            or `None` for a phrase
+    """
+
+    words: Tuple[str, ...]
+    distance: Optional[int] = None
+
+
+class PositionalRecord(NamedTuple):
+    """
+    A document matching a phrase or `NEAR` query
+
+    Parameters:
+        word: The query
+        document_id: The id of the document
+        count: The number of times the phrase (or the two words within the
+            distance of each other) occurs in the document
+    """
+
+    word: str
+    document_id: int
+    count: int
+
+
+def encode_positions(positions: Sequence[int]) -> bytes:
+    """
+    Delta encode the positions of a word in a document, and pack each
+    difference as a variable-length integer
+
+    Parameters:
+        positions: The positions of the word, in increasing order
+
+    Returns:
+        The packed positions
+    """
+    deltas = [b - a for a, b in zip(chain((0,), positions), positions)]
+
+    # in most documents, every occurrence of a word is less than 128 words
+    # after the previous one, so each difference is already a single byte
+    if max(deltas, default=0) < 0x80:
+        return bytes(deltas)
+
+    packed = bytearray()
+    for d in deltas:
+        while d >= 0x80:
+            packed.append((d & 0x7F) | 0x80)
+            d >>= 7
+        packed.append(d)
+
+    return bytes(packed)
+
+
+def decode_positions(data: bytes) -> List[int]:
+    """
+    Unpack the positions of a word in a document, see `encode_positions`
+
+    Parameters:
+        data: The packed positions
+
+    Returns:
+        The positions of the word, in increasing order
+    """
+    if max(data, default=0) < 0x80:
+        return list(accumulate(data))
+
+    deltas = []
+    value = shift = 0
+    for b in data:
+        value |= (b & 0x7F) << shift
+        if b & 0x80:
+            shift += 7
+        else:
+            deltas.append(value)
+            value = shift = 0
+
+    return list(accumulate(deltas))
+
+
+def is_positional_query(text: str) -> bool:
+    """
+    Check whether a search is a phrase (in double quotes) or a `NEAR` query,
+    which must be parsed using `parse_positional_query`
+
+    Parameters:
+        text: The search
+
+    Returns:
+        `True` if the search needs the positional index
+    """
+    return '"' in text or re.search(r"\bNEAR/\d+\b", text) is not None
+
+
+def query_words(text: str) -> List[str]:
+    """
+    Split the text of a phrase (or one side of a `NEAR` query) into words
+
+    Raises:
+        ValueError: If the text holds a word pattern
+    """
+    if any(c in "%_" for c in text):
+        raise ValueError(
+            f"Cannot search a phrase or NEAR query using a pattern: {text}"
+        )
+
+    return [w.lower() for w in WORD_PATTERN.findall(text)]
+
+
+def parse_positional_query(text: str) -> PositionalQuery:
+    """
+    Parse a phrase in double quotes, such as `"white whale"`, or two words
+    within a distance of each other (in either order), such as
+    `white NEAR/3 whale`, where `NEAR/1` only matches words next to each other
+
+    Parameters:
+        text: The query
+
+    Returns:
+        The parsed query
+
+    Raises:
+        ValueError: If the query is not a single phrase or `NEAR` query
+    """
+    text = text.strip()
+    if len(text) >= 2 and text[0] == '"' and text[-1] == '"' and '"' not in text[1:-1]:
+        words = query_words(text[1:-1])
+        if len(words) == 0:
+            raise ValueError(f"Cannot search using an empty phrase: {text}")
+        return PositionalQuery(tuple(words))
+
+    match = NEAR_PATTERN.match(text)
+    if match is None or '"' in text:
+        raise ValueError(
+            'Expected a single phrase such as "white whale", '
+            f"or two words such as white NEAR/3 whale: {text}"
+        )
+
+    left, distance, right = match.groups()
+    words = query_words(left) + query_words(right)
+    if len(words) != 2:
+        raise ValueError(f"NEAR must be used between two words: {text}")
+    if int(distance) < 1:
+        raise ValueError(f"The distance of NEAR must be at least 1: {text}")
+
+    return PositionalQuery(tuple(words), int(distance))
+
+
+def count_phrase(positions: Sequence[Sequence[int]]) -> int:
+    """
+    Count the occurrences of a phrase in a document
+
+    Parameters:
+        positions: The positions of each word of the phrase, in order
+
+    Returns:
+        The number of positions the phrase starts at
+    """
+    # the phrase can only start where its rarest word allows it to
+    rarest, shortest = min(enumerate(positions), key=lambda p: len(p[1]))
+    starts = {p - rarest for p in shortest}
+
+    for offset, others in enumerate(positions):
+        if offset == rarest or len(starts) == 0:
+            continue
+        starts.intersection_update(p - offset for p in others)
+
+    return len(starts)
+
+
+def count_near(first: Sequence[int], second: Sequence[int], distance: int) -> int:
+    """
+    Count the pairs of occurrences of two words within a distance of each
+    other (in either order) in a document
+
+    Parameters:
+        first: The positions of the first word, in increasing order
+        second: The positions of the second word, in increasing order
+        distance: The largest number of positions between the two words
+
+    Returns:
+        The number of pairs of occurrences
+    """
+    same = first is second
+    if len(first) > len(second):
+        first, second = second, first
+
+    pairs = 0
+    for p in first:
+        pairs += bisect_right(second, p + distance) - bisect_left(second, p - distance)
+
+    # with the same word twice, each occurrence matched itself, and every
+    # pair of occurrences was counted from both of its ends
+    if same:
+        return (pairs - len(first)) // 2
+
+    return pairs
+
+
+def count_matches(query: PositionalQuery, packed: Dict[str, bytes]) -> int:
+    """
+    Count the matches of a query in a document
+
+    Parameters:
+        query: The parsed query
+        packed: The packed positions of each (distinct) word of the query
+            in the document
+
+    Returns:
+        The number of matches, see `count_phrase` and `count_near`
+    """
+    # `BYTEA` values are read from Postgres as a `memoryview`
+    positions = {w: decode_positions(bytes(p)) for w, p in packed.items()}
+    lists = [positions[w] for w in query.words]
+
+    if query.distance is None:
+        return count_phrase(lists)
+
+    return count_near(lists[0], lists[1], query.distance)
+
+
+def match_documents(
+    text: str,
+    query: PositionalQuery,
+    candidates: Sequence[Tuple[Any, ...]],
+    limit: Optional[int] = None,
+) -> List[PositionalRecord]:
+    """
+    Count the matches of a query in each candidate document, i.e. each
+    document holding every word of the query
+
+    Parameters:
+        text: The query as it was searched for
+        query: The parsed query
+        candidates: The `document_id` of each candidate document, followed by
+            the packed positions of each distinct word of the query (in the
+            order of `dict.fromkeys(query.words)`)
+        limit: Return only the top `n` documents
+
+    Returns:
+        The matching documents, ordered by the highest `count`
+    """
+    words = list(dict.fromkeys(query.words))
+    records = []
+    for id_, *packed in candidates:
+        count = count_matches(query, dict(zip(words, packed)))
+        if count > 0:
+            records.append(PositionalRecord(text, id_, count))
+
+    records.sort(key=lambda r: (-r.count, r.document_id))
+    return records[:limit] if limit is not None else records
+
+
+def candidates_sql(query: PositionalQuery) -> Tuple[str, Dict[str, str]]:
+    """
+    Build the SQL selecting the `document_id` of every document holding
+    each word of the query, and the packed positions of every (distinct)
+    word in it. The posting lists of the words are joined on `document_id`,
+    so the database can start from the rarest word.
+
+    Parameters:
+        query: The parsed query
+
+    Returns:
+        The SQL, and the parameters to bind to it
+    """
+    words = list(dict.fromkeys(query.words))
+    params = {f"word_{i}": w for i, w in enumerate(words)}
+
+    columns = ", ".join(f"p{i}.positions AS positions_{i}" for i in range(len(words)))
+    joins = ["word_positions AS p0"]
+    for i in range(1, len(words)):
+        joins.append(
+            f"JOIN word_positions AS p{i} ON p{i}.document_id = p0.document_id "
+            f"AND p{i}.word = %(word_{i})s"
+        )
+
+    sql = (
+        f"SELECT p0.document_id, {columns}\n  FROM "
+        + "\n  ".join(joins)
+        + "\n WHERE p0.word = %(word_0)s"
+    )
+    return sql, params
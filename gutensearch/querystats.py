@@ -0,0 +1,332 @@
+"""
+This module records statistics about the queries sent to the database by
+searches, to find out why some searches are slower than others. Every
+query is recorded under its __kind__ (e.g. `search_word` or
+`search_word_pattern`), with a histogram of its latency, a histogram of
+the time taken to get a connection from the pool, and the number of rows
+returned. The statistics can be exported as JSON (see
+`QueryStats.summary`) or in the Prometheus text format (see
+`QueryStats.prometheus`).
+
+Optionally, every query slower than a threshold (set
+`GUTENSEARCH_SLOW_QUERY_MS`) is captured in a slow query log, along with
+its SQL, parameters and the output of `EXPLAIN (ANALYZE, BUFFERS)`. Note
+that `EXPLAIN ANALYZE` runs the query a second time, so each slow query
+takes twice as long.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from bisect import bisect_left
+from collections import deque
+from typing import Any, Deque, Dict, List, NamedTuple, Optional, Sequence
+
+# the latency (in milliseconds) above which a query is captured in the
+# slow query log, which is disabled unless set
+GUTENSEARCH_SLOW_QUERY_MS = (
+    float(os.environ["GUTENSEARCH_SLOW_QUERY_MS"])
+    if os.getenv("GUTENSEARCH_SLOW_QUERY_MS")
+    else None
+)
+
+# the path to append each slow query to as a line of JSON (otherwise
+# slow queries are logged as warnings)
+GUTENSEARCH_SLOW_QUERY_LOG = os.getenv("GUTENSEARCH_SLOW_QUERY_LOG")
+
+# whether to capture the `EXPLAIN (ANALYZE, BUFFERS)` output of slow queries
+GUTENSEARCH_SLOW_QUERY_EXPLAIN = os.getenv("GUTENSEARCH_SLOW_QUERY_EXPLAIN", "1") == "1"
+
+# the number of slow queries kept in memory for `QueryStats.summary`
+SLOW_QUERIES_KEPT = 100
+
+# the upper bounds of the buckets of each histogram, in seconds
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+
+class SlowQuery(NamedTuple):
+    """
+    A query captured in the slow query log
+
+    Parameters:
+        kind: The kind of query
+        sql: The SQL of the query
+        params: The parameters bound to the query
+        seconds: The time taken to execute the query and fetch its results
+        rows: The number of rows returned
+        plan: The output of `EXPLAIN (ANALYZE, BUFFERS)`, if captured
+        timestamp: The (unix) time the query finished
+    """
+
+    kind: str
+    sql: str
+    params: Any
+    seconds: float
+    rows: int
+    plan: Optional[str]
+    timestamp: float
+
+
+class Histogram:
+    """
+    A histogram of durations, with fixed bucket boundaries
+
+    Parameters:
+        buckets: The upper bound of each bucket, in seconds, in increasing order
+    """
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # the last bucket holds every value above the largest bound
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        """
+        Add a single duration to the histogram
+        """
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate a quantile of the durations, by interpolating linearly
+        within the bucket holding it (as Prometheus' `histogram_quantile`)
+
+        Parameters:
+            q: The quantile, between 0 and 1
+
+        Returns:
+            The estimated duration, or 0 if the histogram is empty
+        """
+        if self.count == 0:
+            return 0.0
+
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n > 0:
+                if i == len(self.buckets):
+                    # above every bound, so the best estimate is the largest one
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / n
+            seen += n
+
+        return self.buckets[-1]
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Summarize the histogram
+
+        Returns:
+            The number and sum of the durations, the estimated median, 95th and
+            99th percentiles, and the cumulative count of each bucket
+        """
+        cumulative = 0
+        buckets = {}
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += n
+            buckets["+Inf" if bound == float("inf") else str(bound)] = cumulative
+
+        return {
+            "count": self.count,
+            "sum_seconds": self.sum,
+            "p50_seconds": self.quantile(0.5),
+            "p95_seconds": self.quantile(0.95),
+            "p99_seconds": self.quantile(0.99),
+            "buckets": buckets,
+        }
+
+
+class _KindStats:
+    def __init__(self) -> None:
+        self.latency = Histogram()
+        self.connect = Histogram()
+        self.rows = 0
+        self.errors = 0
+
+
+class QueryStats:
+    """
+    Thread-safe statistics of every query sent to the database, by kind,
+    and a log of the slowest queries
+
+    Parameters:
+        slow_ms: The latency (in milliseconds) above which a query is
+            captured in the slow query log, or `None` to disable it
+        explain: Capture the `EXPLAIN (ANALYZE, BUFFERS)` output of slow queries
+        path: The path to append each slow query to as a line of JSON,
+            or `None` to log each slow query as a warning instead
+        kept: The number of slow queries kept in memory
+    """
+
+    def __init__(
+        self,
+        slow_ms: Optional[float] = GUTENSEARCH_SLOW_QUERY_MS,
+        explain: bool = GUTENSEARCH_SLOW_QUERY_EXPLAIN,
+        path: Optional[str] = GUTENSEARCH_SLOW_QUERY_LOG,
+        kept: int = SLOW_QUERIES_KEPT,
+    ):
+        self.slow_ms = slow_ms
+        self.explain = explain
+        self.path = path
+        self.lock = threading.Lock()
+        self.kinds: Dict[str, _KindStats] = {}
+        self.slow: Deque[SlowQuery] = deque(maxlen=kept)
+
+    def reset(self) -> None:
+        """
+        Discard every recorded query
+        """
+        with self.lock:
+            self.kinds.clear()
+            self.slow.clear()
+
+    def record(
+        self,
+        kind: str,
+        seconds: float,
+        connect: float,
+        rows: int,
+        error: bool = False,
+    ) -> None:
+        """
+        Record a single query
+
+        Parameters:
+            kind: The kind of query, e.g. `search_word`
+            seconds: The time taken to execute the query and fetch its results
+            connect: The time taken to get a connection to run the query on
+            rows: The number of rows returned
+            error: Whether the query failed
+        """
+        with self.lock:
+            stats = self.kinds.get(kind)
+            if stats is None:
+                stats = self.kinds[kind] = _KindStats()
+
+            stats.latency.observe(seconds)
+            stats.connect.observe(connect)
+            stats.rows += rows
+            stats.errors += error
+
+    def is_slow(self, seconds: float) -> bool:
+        """
+        Check whether a query should be captured in the slow query log
+
+        Parameters:
+            seconds: The time taken by the query
+        """
+        return self.slow_ms is not None and 1000 * seconds >= self.slow_ms
+
+    def record_slow(self, query: SlowQuery) -> None:
+        """
+        Capture a query in the slow query log
+        """
+        with self.lock:
+            self.slow.append(query)
+
+        if self.path is not None:
+            line = json.dumps(query._asdict(), default=str)
+            with self.lock, open(self.path, "a") as f:
+                f.write(f"{line}\n")
+            return
+
+        log = logging.getLogger("gutensearch.database")
+        log.warning(
+            f"Slow {query.kind} query ({1000 * query.seconds:.1f} ms, "
+            f"{query.rows} rows): {query.sql} with {query.params!r}"
+            + (f"\n{query.plan}" if query.plan is not None else "")
+        )
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Summarize the recorded queries
+
+        Returns:
+            A JSON serializable dictionary holding, for each kind of query, the
+            number of queries, rows returned and errors, and the histograms of
+            their latency and of the time taken to get a connection, as well as
+            the slow queries kept in memory
+        """
+        with self.lock:
+            kinds = {
+                kind: {
+                    "queries": s.latency.count,
+                    "rows": s.rows,
+                    "errors": s.errors,
+                    "latency": s.latency.summary(),
+                    "connect": s.connect.summary(),
+                }
+                for kind, s in sorted(self.kinds.items())
+            }
+            slow = [q._asdict() for q in self.slow]
+
+        return {
+            "timestamp": time.time(),
+            "kinds": kinds,
+            "slow_queries": json.loads(json.dumps(slow, default=str)),
+        }
+
+    def prometheus(self, prefix: str = "gutensearch_query") -> str:
+        """
+        Format the statistics in the Prometheus text exposition format
+
+        Parameters:
+            prefix: The prefix of the name of each metric
+
+        Returns:
+            A histogram of the latency and connection time of each kind of
+            query, and counters of the rows returned and errors
+        """
+        lines: List[str] = []
+        summary = self.summary()["kinds"]
+
+        def histogram(name: str, help_: str, field: str) -> None:
+            lines.append(f"# HELP {prefix}_{name} {help_}")
+            lines.append(f"# TYPE {prefix}_{name} histogram")
+            for kind, s in summary.items():
+                h = s[field]
+                for bound, n in h["buckets"].items():
+                    lines.append(
+                        f'{prefix}_{name}_bucket{{kind="{kind}",le="{bound}"}} {n}'
+                    )
+                lines.append(f'{prefix}_{name}_sum{{kind="{kind}"}} {h["sum_seconds"]}')
+                lines.append(f'{prefix}_{name}_count{{kind="{kind}"}} {h["count"]}')
+
+        def counter(name: str, help_: str, field: str) -> None:
+            lines.append(f"# HELP {prefix}_{name} {help_}")
+            lines.append(f"# TYPE {prefix}_{name} counter")
+            for kind, s in summary.items():
+                lines.append(f'{prefix}_{name}{{kind="{kind}"}} {s[field]}')
+
+        histogram("duration_seconds", "Time taken to run each query", "latency")
+        histogram(
+            "connect_seconds",
+            "Time taken to get a connection for each query",
+            "connect",
+        )
+        counter("rows_total", "Rows returned by the queries", "rows")
+        counter("errors_total", "Queries that failed", "errors")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,303 @@
+"""
+This module maintains the statistics used to rank the results of a word
+search by relevance, rather than by the raw number of times the word
+occurs in each document (which always favours the longest books). The
+statistics are built by `gutensearch load --rank`, and kept up to date
+by every load after that:
+
+- `document_lengths`: the number of words in each document
+- `document_frequencies`: the number of documents each word occurs in
+- `corpus_stats`: the number of documents and their average length
+- `word_weights`: the length-normalized term frequency of each word in
+  each document, for both BM25 and TF-IDF
+
+Only the part of each score that depends on the document is stored in
+`word_weights`, while the inverse document frequency of the word is
+applied when searching. Since every document of a word shares the same
+inverse document frequency, the documents of a word are already in
+score order in the indexes on `word_weights`, so the top `n` documents
+of even the most common word are read straight off the index, without
+scoring and sorting every one of them (see `gutensearch.database.search_word`).
+
+The BM25 weights depend on the average document length at the time they
+were computed. New documents are weighted using that same average, so
+every weight stays comparable, and the weights are only recomputed once
+the average length has drifted by more than `WEIGHTS_DRIFT`.
+"""
+
+import logging
+from typing import Any, Optional, Sequence
+
+from .metrics import phase
+
+# the ways search results can be ranked
+RANKINGS = {
+    "bm25",
+    "tfidf",
+}
+
+# the BM25 term frequency saturation and document length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# the relative change in the average document length above which the
+# BM25 weights of every document are recomputed
+WEIGHTS_DRIFT = 0.05
+
+# the column of `word_weights` that documents are ranked by, for each ranking
+WEIGHT_COLUMNS = {
+    "bm25": "bm25",
+    "tfidf": "tf",
+}
+
+# the inverse document frequency of a word, given its `document_frequencies`
+# row `f` and the `corpus_stats` row `c`, for each ranking
+IDF = {
+    # the non-negative variant of the BM25 inverse document frequency
+    "bm25": "ln(1 + (c.documents - f.documents + 0.5) / (f.documents + 0.5))",
+    # the smoothed inverse document frequency, which is never zero
+    "tfidf": "ln((1 + c.documents)::DOUBLE PRECISION / (1 + f.documents)) + 1",
+}
+
+RANK_TABLES = """
+CREATE TABLE IF NOT EXISTS document_lengths (
+    document_id BIGINT PRIMARY KEY,
+    length BIGINT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS document_frequencies (
+    word VARCHAR PRIMARY KEY,
+    documents BIGINT NOT NULL
+);
+
+-- a single row, along with the average length the BM25 weights were computed with
+CREATE TABLE IF NOT EXISTS corpus_stats (
+    documents BIGINT NOT NULL,
+    average_length DOUBLE PRECISION NOT NULL,
+    weights_average_length DOUBLE PRECISION NOT NULL
+);
+
+INSERT INTO corpus_stats (documents, average_length, weights_average_length)
+SELECT 0, 0, 0
+ WHERE NOT EXISTS (SELECT 1 FROM corpus_stats);
+
+CREATE TABLE IF NOT EXISTS word_weights (
+    word VARCHAR NOT NULL,
+    document_id BIGINT NOT NULL,
+    count INT NOT NULL,
+    bm25 REAL NOT NULL,
+    tf REAL NOT NULL
+);
+""".strip()
+
+# the indexes on `word_weights`, the first two of which serve ranked searches
+WEIGHT_INDEXES = {
+    "idx_word_weights_bm25": "word_weights (word, bm25 DESC)",
+    "idx_word_weights_tf": "word_weights (word, tf DESC)",
+    "idx_word_weights_id": "word_weights (document_id)",
+}
+
+UPDATE_CORPUS_STATS = """
+UPDATE corpus_stats
+   SET documents = s.documents,
+       average_length = s.average_length
+  FROM (SELECT COUNT(*) AS documents,
+               COALESCE(AVG(length), 0) AS average_length
+          FROM document_lengths) AS s
+""".strip()
+
+# the weights of the rows of `words` selected by `{where}`, computed with
+# the average document length the existing weights were computed with
+INSERT_WEIGHTS = f"""
+INSERT INTO word_weights (word, document_id, count, bm25, tf)
+SELECT w.word,
+       w.document_id,
+       w.count,
+       w.count * {BM25_K1 + 1} / (
+           w.count + {BM25_K1} * (
+               1 - {BM25_B} + {BM25_B} * l.length / GREATEST(c.weights_average_length, 1)
+           )
+       ),
+       w.count::REAL / GREATEST(l.length, 1)
+  FROM (SELECT word, document_id, count FROM {{table}}) AS w
+  JOIN document_lengths AS l USING (document_id)
+ CROSS JOIN corpus_stats AS c
+ {{where}}
+""".strip()
+
+
+def has_rank_tables(cur: Any) -> bool:
+    """
+    Check whether the ranking statistics have been built
+
+    Parameters:
+        cur: The database cursor used to execute the statement
+
+    Returns:
+        `True` if the statistics exist, and must be kept up to date
+    """
+    cur.execute("SELECT to_regclass('word_weights') IS NOT NULL")
+    return cur.fetchone()[0]  # type: ignore
+
+
+def rebuild_rank(cur: Any, table: str = "words") -> None:
+    """
+    Rebuild every ranking statistic from the rows of the `words` table,
+    creating the tables first if needed
+
+    Parameters:
+        cur: The database cursor used to execute the statement
+        table: The table to select `word`, `document_id`, `count` from,
+            see `gutensearch.database.WORDS_TABLES`
+    """
+    log = logging.getLogger("gutensearch.load")
+    log.info("Rebuilding ranking statistics")
+
+    with phase("rank"):
+        cur.execute(RANK_TABLES)
+        cur.execute(
+            "TRUNCATE TABLE document_lengths, document_frequencies, word_weights"
+        )
+        cur.execute(
+            f"""
+            INSERT INTO document_lengths (document_id, length)
+            SELECT document_id, SUM(count)
+              FROM {table}
+             GROUP BY document_id
+            """
+        )
+        cur.execute(
+            f"""
+            INSERT INTO document_frequencies (word, documents)
+            SELECT word, COUNT(*)
+              FROM {table}
+             GROUP BY word
+            """
+        )
+        cur.execute(UPDATE_CORPUS_STATS)
+        write_weights(cur, table)
+        cur.execute("ANALYZE document_lengths, document_frequencies, word_weights")
+
+
+def write_weights(
+    cur: Any, table: str = "words", ids: Optional[Sequence[int]] = None
+) -> None:
+    """
+    Compute the weights of the given documents, or recompute the weights
+    of every document using the current average document length
+
+    Parameters:
+        cur: The database cursor used to execute the statement
+        table: The table to select `word`, `document_id`, `count` from
+        ids: The ids of the documents to add the weights of, or `None`
+            to replace every weight
+    """
+    if ids is not None:
+        where = "WHERE w.document_id = ANY(%(ids)s)"
+        cur.execute(INSERT_WEIGHTS.format(table=table, where=where), {"ids": list(ids)})
+        return
+
+    cur.execute("UPDATE corpus_stats SET weights_average_length = average_length")
+
+    # building the indexes once is much faster than updating them for every row
+    cur.execute("TRUNCATE TABLE word_weights")
+    for name in WEIGHT_INDEXES:
+        cur.execute(f"DROP INDEX IF EXISTS {name}")
+
+    cur.execute(INSERT_WEIGHTS.format(table=table, where=""))
+
+    for name, columns in WEIGHT_INDEXES.items():
+        cur.execute(f"CREATE INDEX {name} ON {columns}")
+
+
+def remove_rank(cur: Any, ids: Sequence[int], table: str = "words") -> None:
+    """
+    Remove the given documents from the ranking statistics. This must run
+    before their rows are deleted from the `words` table, since their
+    words are needed to update the document frequencies.
+
+    Parameters:
+        cur: The database cursor used to execute the statement
+        ids: The ids of the documents to remove
+        table: The table to select `word`, `document_id`, `count` from
+    """
+    with phase("rank"):
+        cur.execute(
+            f"""
+            UPDATE document_frequencies AS f
+               SET documents = f.documents - d.documents
+              FROM (SELECT word, COUNT(*) AS documents
+                      FROM {table}
+                     WHERE document_id = ANY(%(ids)s)
+                     GROUP BY word) AS d
+             WHERE f.word = d.word
+            """,
+            {"ids": list(ids)},
+        )
+        cur.execute(
+            "DELETE FROM document_lengths WHERE document_id = ANY(%(ids)s)",
+            {"ids": list(ids)},
+        )
+        cur.execute(
+            "DELETE FROM word_weights WHERE document_id = ANY(%(ids)s)",
+            {"ids": list(ids)},
+        )
+
+
+def add_rank(
+    cur: Any,
+    ids: Sequence[int],
+    table: str = "words",
+    drift: float = WEIGHTS_DRIFT,
+) -> None:
+    """
+    Add the given (newly loaded) documents to the ranking statistics, and
+    recompute every weight if the average document length has drifted
+    too far from the one the existing weights were computed with
+
+    Parameters:
+        cur: The database cursor used to execute the statement
+        ids: The ids of the documents to add
+        table: The table to select `word`, `document_id`, `count` from
+        drift: The relative change in the average document length above
+            which every weight is recomputed
+    """
+    log = logging.getLogger("gutensearch.load")
+
+    with phase("rank"):
+        params = {"ids": list(ids)}
+        cur.execute(
+            f"""
+            INSERT INTO document_lengths (document_id, length)
+            SELECT document_id, SUM(count)
+              FROM {table}
+             WHERE document_id = ANY(%(ids)s)
+             GROUP BY document_id
+            """,
+            params,
+        )
+        cur.execute(
+            f"""
+            INSERT INTO document_frequencies (word, documents)
+            SELECT word, COUNT(*)
+              FROM {table}
+             WHERE document_id = ANY(%(ids)s)
+             GROUP BY word
+                ON CONFLICT (word)
+                DO UPDATE SET documents = document_frequencies.documents
+                                        + EXCLUDED.documents
+            """,
+            params,
+        )
+        cur.execute(UPDATE_CORPUS_STATS)
+
+        cur.execute("SELECT average_length, weights_average_length FROM corpus_stats")
+        average, weighted = cur.fetchone()
+        if weighted == 0 or abs(average - weighted) > drift * weighted:
+            log.info(
+                f"Average document length changed from {weighted:.0f} to "
+                f"{average:.0f} words, recomputing every ranking weight"
+            )
+            write_weights(cur, table)
+        else:
+            write_weights(cur, table, ids)
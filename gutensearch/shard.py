@@ -0,0 +1,433 @@
+"""
+This module contains the intermediate storage used to decouple parsing
+documents from loading them. `gutensearch parse` writes the word counts
+of the documents to __shards__: gzip-compressed files holding the
+`word`, `document_id` and `count` columns of the `words` table for a
+few hundred documents each. Every worker process writes its own shards,
+and each finished shard is recorded in a manifest (`manifest.json`), so
+an interrupted parse resumes where it left off. `gutensearch load
+--shards` then loads the shards into any storage backend, skipping the
+documents that are already loaded, without running the tokenizer again.
+The shards can also be read directly (see `read_shard`) for offline
+analysis of the word counts.
+
+Each shard starts with the bytes `GSSHARD1`, followed by the length of
+a JSON header holding the number of documents and rows, and then each
+column in turn (little-endian):
+
+- `document_id`: the id of each document (64-bit integers)
+- `rows`: the number of words in each document (32-bit integers)
+- `count`: the count of each word (32-bit integers)
+- `word`: every word, separated by a newline (UTF-8)
+
+so the `document_id` column is run-length encoded, and the rows of
+each document are stored in the same order as `DocumentCounts`.
+"""
+
+import gzip
+import json
+import logging
+import os
+import struct
+import sys
+from array import array
+from functools import partial
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from .backend import Backend
+from .load import (
+    BATCH_SIZE,
+    QUEUE_SIZE,
+    REBUILD_RATIO,
+    DocumentFile,
+    IncrementalPlan,
+    plan_incremental,
+    scan_documents,
+)
+from .parse import DocumentCounts, parse_document_counts
+
+# default number of documents written to a single shard
+SHARD_SIZE = 500
+
+# the name of the manifest of every shard in a shard directory
+SHARD_MANIFEST = "manifest.json"
+
+SHARD_MAGIC = b"GSSHARD1"
+
+_LENGTH = struct.Struct("<I")
+
+
+class Shard(NamedTuple):
+    """
+    A shard, as recorded in the manifest of a shard directory
+
+    Parameters:
+        name: The file name of the shard
+        documents: The documents in the shard
+        rows: The number of rows in the shard
+        tokenizer: The tokenizer engine the documents were parsed with
+    """
+
+    name: str
+    documents: List[DocumentFile]
+    rows: int
+    tokenizer: str
+
+
+def _little_endian(values: "array[int]") -> bytes:
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_little_endian(typecode: str, data: bytes) -> "array[int]":
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def write_shard(path: Path, documents: Iterable[DocumentCounts]) -> int:
+    """
+    Write the word counts of the given documents to a shard. The shard is
+    first written to a temporary file, so a shard is never partially written.
+
+    Parameters:
+        path: The path to write the shard to
+        documents: The parsed documents
+
+    Returns:
+        The number of rows written
+    """
+    ids = array("q")
+    rows = array("I")
+    counts = array("I")
+    words: List[str] = []
+    for doc in documents:
+        ids.append(doc.document_id)
+        rows.append(len(doc.words))
+        counts.extend(doc.counts)
+        words.extend(doc.words)
+
+    header = json.dumps({"documents": len(ids), "rows": len(counts)}).encode()
+    tmp = path.with_name(path.name + ".tmp")
+    with gzip.open(tmp, "wb", compresslevel=6) as f:
+        f.write(SHARD_MAGIC)
+        f.write(_LENGTH.pack(len(header)))
+        f.write(header)
+        f.write(_little_endian(ids))
+        f.write(_little_endian(rows))
+        f.write(_little_endian(counts))
+        f.write("\n".join(words).encode("utf-8"))
+
+    os.replace(tmp, path)
+    return len(counts)
+
+
+def read_shard(
+    path: Path, ids: Optional[Iterable[int]] = None
+) -> Iterator[DocumentCounts]:
+    """
+    Read the word counts of the documents in a shard
+
+    Parameters:
+        path: The path to the shard
+        ids: Only read the documents with these ids, if given
+
+    Returns:
+        A generator of the documents in the shard, in the order they were written
+
+    Raises:
+        ValueError: If the file is not a shard
+    """
+    with gzip.open(path, "rb") as f:
+        data = f.read()
+
+    if not data.startswith(SHARD_MAGIC):
+        raise ValueError(f"Not a gutensearch shard: {path}")
+
+    offset = len(SHARD_MAGIC)
+    (length,) = _LENGTH.unpack_from(data, offset)
+    offset += _LENGTH.size
+    header = json.loads(data[offset : offset + length])
+    offset += length
+
+    columns = []
+    for typecode, size in (
+        ("q", header["documents"]),
+        ("I", header["documents"]),
+        ("I", header["rows"]),
+    ):
+        nbytes = array(typecode).itemsize * size
+        columns.append(_from_little_endian(typecode, data[offset : offset + nbytes]))
+        offset += nbytes
+
+    document_ids, rows, counts = columns
+    words = data[offset:].decode("utf-8").split("\n") if header["rows"] > 0 else []
+
+    wanted = None if ids is None else set(ids)
+    start = 0
+    for id_, n in zip(document_ids, rows):
+        if wanted is None or id_ in wanted:
+            yield DocumentCounts(
+                id_, words[start : start + n], counts[start : start + n]
+            )
+        start += n
+
+
+def read_shard_rows(path: Path) -> Iterator[Tuple[str, int, int]]:
+    """
+    Read the rows of a shard, as they would be stored in the `words` table
+
+    Parameters:
+        path: The path to the shard
+
+    Returns:
+        A generator of `word`, `document_id`, `count` rows
+    """
+    for doc in read_shard(path):
+        for w, c in zip(doc.words, doc.counts):
+            yield w, doc.document_id, c
+
+
+def read_shards(directory: Path) -> List[Shard]:
+    """
+    Read the manifest of every shard in a shard directory
+
+    Parameters:
+        directory: The directory holding the shards
+
+    Returns:
+        The shards, in the order they were written (empty if there is no manifest)
+    """
+    path = directory / SHARD_MANIFEST
+    if not path.exists():
+        return []
+
+    with open(path, "r") as f:
+        manifest = json.load(f)
+
+    return [
+        Shard(
+            s["name"],
+            [
+                DocumentFile(i, Path(p), size, digest)
+                for i, p, size, digest in s["documents"]
+            ],
+            s["rows"],
+            s["tokenizer"],
+        )
+        for s in manifest["shards"]
+    ]
+
+
+def save_shards(directory: Path, shards: List[Shard]) -> None:
+    """
+    Save the manifest of every shard in a shard directory, replacing
+    the previous manifest at once so it is never partially written
+
+    Parameters:
+        directory: The directory holding the shards
+        shards: The shards, in the order they were written
+    """
+    manifest = {
+        "version": 1,
+        "shards": [
+            {
+                "name": s.name,
+                "rows": s.rows,
+                "tokenizer": s.tokenizer,
+                "documents": [
+                    [f.document_id, str(f.path), f.size, f.digest] for f in s.documents
+                ],
+            }
+            for s in shards
+        ],
+    }
+
+    tmp = directory / (SHARD_MANIFEST + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, directory / SHARD_MANIFEST)
+
+
+def parse_shard(
+    task: Tuple[str, List[DocumentFile]], directory: Path, tokenizer: str = "chunked"
+) -> Shard:
+    """
+    Parse the given documents and write their word counts to a new shard.
+
+    This function is suitable to be used with multiprocessing.
+
+    Parameters:
+        task: The file name of the shard, and the documents (already
+            scanned by `parse_to_shards`)
+        directory: The directory to write the shard to
+        tokenizer: The tokenizer engine to use, see `parse_word_count`
+
+    Returns:
+        The shard, to be recorded in the manifest
+    """
+    name, files = task
+    documents = (parse_document_counts(f.path, tokenizer) for f in files)
+    rows = write_shard(directory / name, documents)
+
+    return Shard(name, files, rows, tokenizer)
+
+
+def parse_to_shards(
+    files: List[Path],
+    directory: Path,
+    processes: int = 1,
+    tokenizer: str = "chunked",
+    shard_size: int = SHARD_SIZE,
+) -> List[Shard]:
+    """
+    Parse the given documents into shards, `shard_size` documents per
+    shard, using a pool of worker processes that each write their own
+    shards. Documents that are already in a shard, unchanged, are skipped,
+    and a changed document is removed from its previous shard in the
+    manifest. The manifest is saved as soon as each shard is written.
+
+    Parameters:
+        files: The paths to the documents
+        directory: The directory to write the shards to
+        processes: The number of worker processes to parse with
+        tokenizer: The tokenizer engine to use, see `parse_word_count`
+        shard_size: The number of documents written to a single shard
+
+    Returns:
+        The shards that were written
+    """
+    log = logging.getLogger("gutensearch.shard")
+    directory.mkdir(parents=True, exist_ok=True)
+
+    shards = read_shards(directory)
+    known = {f.document_id: (f.digest, f.size) for s in shards for f in s.documents}
+
+    entries = scan_documents(files)
+    pending = [f for f in entries if known.get(f.document_id) != (f.digest, f.size)]
+    log.info(
+        f"Parsing {len(pending)} documents into shards of {shard_size} documents, "
+        f"skipping {len(entries) - len(pending)} documents already in a shard"
+    )
+    if len(pending) == 0:
+        return []
+
+    # changed documents are only read from the shard they are written to next
+    changed = {f.document_id for f in pending}
+    shards = [
+        s._replace(documents=[f for f in s.documents if f.document_id not in changed])
+        for s in shards
+    ]
+
+    # shard names carry on from the last shard written, e.g. `shard-00012.gz`
+    first = 1 + max(
+        (int(s.name.split("-")[1].split(".")[0]) for s in shards), default=-1
+    )
+    tasks = [
+        (f"shard-{first + i:05d}.gz", pending[k : k + shard_size])
+        for i, k in enumerate(range(0, len(pending), shard_size))
+    ]
+
+    parse = partial(parse_shard, directory=directory, tokenizer=tokenizer)
+    written = []
+    pool = Pool(processes) if processes > 1 else None
+    try:
+        results = (
+            pool.imap_unordered(parse, tasks) if pool is not None else map(parse, tasks)
+        )
+        for shard in results:
+            written.append(shard)
+            shards.append(shard)
+            save_shards(directory, shards)
+            log.info(
+                f"Wrote {shard.name} ({len(shard.documents)} documents, {shard.rows} rows), "
+                f"{len(written)}/{len(tasks)} shards"
+            )
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    return written
+
+
+def load_shards(
+    backend: Backend,
+    directory: Path,
+    rebuild_ratio: float = REBUILD_RATIO,
+    batch_size: int = BATCH_SIZE,
+    queue_size: int = QUEUE_SIZE,
+) -> int:
+    """
+    Load the shards of a shard directory into the storage backend,
+    skipping the documents that are already loaded, unchanged (see
+    `plan_incremental`). When the new documents are large enough for
+    the indexes to be rebuilt, everything is loaded in a single
+    transaction. Otherwise, each shard is committed on its own, so an
+    interrupted load resumes from the first shard that was not committed.
+
+    Parameters:
+        backend: The storage backend to load the shards into
+        directory: The directory holding the shards
+        rebuild_ratio: The relative size above which the indexes are rebuilt
+        batch_size: The number of rows written at a time
+        queue_size: The maximum number of batches waiting to be written
+
+    Returns:
+        The number of documents loaded
+
+    Raises:
+        ValueError: If the directory has no manifest of shards
+    """
+    log = logging.getLogger("gutensearch.shard")
+
+    # a mistyped directory would otherwise load nothing at all
+    if not (directory / SHARD_MANIFEST).exists():
+        raise ValueError(
+            f"No shards found (missing {SHARD_MANIFEST}), "
+            f"write them using gutensearch parse: {directory}"
+        )
+
+    shards = read_shards(directory)
+    entries = [f for s in shards for f in s.documents]
+    plan = plan_incremental(backend.manifest(), entries, rebuild_ratio)
+
+    planned = {f.document_id for f in plan.files}
+    replaced = set(plan.replaced)
+    pending: List[Tuple[Shard, List[DocumentFile]]] = []
+    for s in shards:
+        files = [f for f in s.documents if f.document_id in planned]
+        if len(files) > 0:
+            pending.append((s, files))
+
+    log.info(
+        f"Loading {len(plan.files)} documents ({len(plan.replaced)} changed) "
+        f"from {len(pending)} of {len(shards)} shards, "
+        f"skipping {len(entries) - len(plan.files)} unchanged documents"
+    )
+    if len(pending) == 0:
+        return 0
+
+    def documents(s: Shard, files: List[DocumentFile]) -> Iterator[DocumentCounts]:
+        return read_shard(directory / s.name, [f.document_id for f in files])
+
+    if plan.rebuild:
+        counts = (doc for s, files in pending for doc in documents(s, files))
+        backend.load_incremental(counts, plan, batch_size, queue_size)
+        return len(plan.files)
+
+    for i, (s, files) in enumerate(pending):
+        ids = {f.document_id for f in files}
+        sub = IncrementalPlan(files, sorted(ids & replaced), rebuild=False)
+        last = i == len(pending) - 1
+        backend.load_incremental(
+            documents(s, files), sub, batch_size, queue_size, analyze=last
+        )
+        log.info(f"Committed {s.name}, {i + 1}/{len(pending)} shards")
+
+    return len(plan.files)
@@ -0,0 +1,280 @@
+"""
+This module finds the documents most similar to a given document ("more
+like this"), using the embedded inverted index (see `gutensearch.index`).
+
+Each document is represented by a sparse TF-IDF vector, with one weight
+for each word it contains: the (sublinear) term frequency `1 + ln(count)`
+of the word, times its smoothed inverse document frequency (the same one
+used by `gutensearch word --rank tfidf`), so that words common to every
+book count for little. Each vector is normalized to a length of 1, so the
+similarity of two documents is the cosine of the angle between their
+vectors, i.e. the sum of the products of the weights of the words they
+share. `gutensearch build-index` stores the vectors as a sparse matrix in
+CSR layout, with one row per document:
+
+- `documents.offsets`: where the row of each document starts (`indptr`)
+- `terms.words`: the word id of each weight (`indices`)
+- `terms.weights`: the normalized weights (`data`)
+- `documents.norms`: the length of each vector before it was normalized
+
+Comparing a document with every other one would read the whole matrix,
+so the search is pruned in two steps. First, only the `SIMILAR_TERMS`
+words with the highest weights in the document are used to find
+candidate documents: the postings of each of these words are read from
+the index, and the part of the similarity they contribute is added up
+for every document they occur in. These words are mostly rare, so their
+postings are short, yet they hold most of the weight of the document.
+Then, the exact similarity of the `SIMILAR_CANDIDATES` candidates with
+the highest partial similarity is computed from their rows.
+
+If NumPy is installed, both steps are vectorized over the memory-mapped
+arrays of the index, otherwise they run in pure Python, with the same
+results.
+"""
+
+import math
+import heapq
+from bisect import bisect_left
+from collections import defaultdict
+from operator import itemgetter
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+try:
+    import numpy as np  # type: ignore
+except ImportError:  # numpy is optional, see `similar_documents`
+    np = None
+
+# the number of words (with the highest weights) of a document used to
+# find candidate documents
+SIMILAR_TERMS = 128
+
+# the number of candidate documents whose exact similarity is computed
+SIMILAR_CANDIDATES = 100
+
+
+class SimilarRecord(NamedTuple):
+    """
+    A document similar to the document searched for
+
+    Parameters:
+        document_id: The id of the document searched for
+        similar_id: The id of the similar document
+        score: The cosine similarity of the two documents, between 0 and 1
+    """
+
+    document_id: int
+    similar_id: int
+    score: float
+
+
+class TermVectors(NamedTuple):
+    """
+    The TF-IDF vectors of every document as a sparse matrix in CSR layout,
+    along with the postings of every word, as stored in the embedded
+    inverted index (see `gutensearch.index.FILES`)
+
+    Parameters:
+        ids: The id of each document (row), sorted
+        offsets: Where the row of each document starts, and where the last ends
+        words: The word id of each weight
+        weights: The normalized weight of each word in each document
+        norms: The length of the vector of each document, before it was normalized
+        postings_offsets: Where the postings of each word start, and where the last end
+        postings_documents: The document id of each posting
+        postings_counts: The count of each posting
+    """
+
+    ids: Sequence[int]
+    offsets: Sequence[int]
+    words: Sequence[int]
+    weights: Sequence[float]
+    norms: Sequence[float]
+    postings_offsets: Sequence[int]
+    postings_documents: Sequence[int]
+    postings_counts: Sequence[int]
+
+
+def inverse_document_frequency(documents: int, frequency: int) -> float:
+    """
+    The smoothed inverse document frequency of a word, which is never zero
+    (see `gutensearch.rank.IDF`)
+
+    Parameters:
+        documents: The number of documents
+        frequency: The number of documents the word occurs in
+    """
+    return math.log((1 + documents) / (1 + frequency)) + 1
+
+
+def term_weight(count: int) -> float:
+    """
+    The sublinear term frequency of a word occurring `count` times in a
+    document, so that a word occurring 1,000 times is not 1,000 times as
+    important as a word occurring once
+    """
+    return 1 + math.log(count)
+
+
+def normalize(weights: Sequence[float]) -> Tuple[List[float], float]:
+    """
+    Normalize the weights of a document to a vector of length 1
+
+    Parameters:
+        weights: The TF-IDF weights of every word in the document
+
+    Returns:
+        The normalized weights, and the length of the vector
+    """
+    norm = math.sqrt(sum(w * w for w in weights))
+    return [w / norm for w in weights], norm
+
+
+def similar_documents(
+    vectors: TermVectors,
+    id_: int,
+    limit: Optional[int] = 10,
+    terms: int = SIMILAR_TERMS,
+    candidates: int = SIMILAR_CANDIDATES,
+) -> List[SimilarRecord]:
+    """
+    Search for the documents most similar to the given document, by the
+    cosine similarity of their TF-IDF vectors
+
+    Parameters:
+        vectors: The vectors and postings of every document
+        id_: The id of the document to search for
+        limit: Return only the top `n` most similar documents
+        terms: The number of words of the document used to find candidates
+        candidates: The number of candidates whose exact similarity is computed
+
+    Returns:
+        A list of records, most similar document first
+    """
+    row = bisect_left(vectors.ids, id_)
+    if row == len(vectors.ids) or vectors.ids[row] != id_:
+        return []
+
+    candidates = max(candidates, limit or 0)
+    if np is not None:
+        scores = score_numpy(vectors, row, terms, candidates)
+    else:
+        scores = score_python(vectors, row, terms, candidates)
+
+    ranked = sorted(scores.items(), key=lambda s: (-s[1], s[0]))
+    return [SimilarRecord(id_, d, round(s, 4)) for d, s in ranked[:limit]]
+
+
+def score_python(
+    vectors: TermVectors, row: int, terms: int, candidates: int
+) -> Dict[int, float]:
+    """
+    Find the candidates similar to a document and compute their exact
+    similarity in pure Python, see `similar_documents`
+
+    Parameters:
+        vectors: The vectors and postings of every document
+        row: The row of the document to search for
+        terms: The number of words of the document used to find candidates
+        candidates: The number of candidates whose exact similarity is computed
+
+    Returns:
+        The similarity of each candidate, by document id
+    """
+    ids, offsets = vectors.ids, vectors.offsets
+    start, end = offsets[row], offsets[row + 1]
+    query = dict(zip(vectors.words[start:end], vectors.weights[start:end]))
+
+    rows = {d: r for r, d in enumerate(ids)}
+    partial: Dict[int, float] = defaultdict(float)
+    for word, weight in heapq.nlargest(terms, query.items(), key=itemgetter(1)):
+        first, last = vectors.postings_offsets[word], vectors.postings_offsets[word + 1]
+        scale = weight * inverse_document_frequency(len(ids), last - first)
+        postings = zip(
+            vectors.postings_documents[first:last], vectors.postings_counts[first:last]
+        )
+        for d, count in postings:
+            partial[d] += scale * term_weight(count) / vectors.norms[rows[d]]
+
+    partial.pop(ids[row], None)
+    shortlist = heapq.nlargest(candidates, partial.items(), key=lambda s: (s[1], -s[0]))
+
+    scores = {}
+    for d, _ in shortlist:
+        start, end = offsets[rows[d]], offsets[rows[d] + 1]
+        weights = zip(vectors.words[start:end], vectors.weights[start:end])
+        scores[d] = sum(query.get(w, 0.0) * x for w, x in weights)
+
+    return scores
+
+
+def score_numpy(
+    vectors: TermVectors, row: int, terms: int, candidates: int
+) -> Dict[int, float]:
+    """
+    Find the candidates similar to a document and compute their exact
+    similarity using NumPy, see `similar_documents`
+
+    Parameters:
+        vectors: The vectors and postings of every document
+        row: The row of the document to search for
+        terms: The number of words of the document used to find candidates
+        candidates: The number of candidates whose exact similarity is computed
+
+    Returns:
+        The similarity of each candidate, by document id
+    """
+    # the arrays of the index are wrapped without copying them
+    ids = np.asarray(vectors.ids)
+    offsets = np.asarray(vectors.offsets)
+    postings_offsets = np.asarray(vectors.postings_offsets)
+
+    start, end = offsets[row], offsets[row + 1]
+    query_words = np.asarray(vectors.words[start:end]).astype(np.int64)
+    query_weights = np.asarray(vectors.weights[start:end]).astype(np.float64)
+
+    # the same words as `score_python`, ties keeping the order of the row
+    top = np.argsort(-query_weights, kind="stable")[:terms]
+    firsts = postings_offsets[query_words[top]].astype(np.int64)
+    lasts = postings_offsets[query_words[top] + 1].astype(np.int64)
+    scales = query_weights[top] * (
+        np.log((1 + len(ids)) / (1 + (lasts - firsts).astype(np.float64))) + 1
+    )
+
+    documents = np.concatenate(
+        [np.asarray(vectors.postings_documents[f:e]) for f, e in zip(firsts, lasts)]
+    )
+    counts = np.concatenate(
+        [np.asarray(vectors.postings_counts[f:e]) for f, e in zip(firsts, lasts)]
+    )
+    rows = np.searchsorted(ids, documents)
+    contributions = (
+        np.repeat(scales, lasts - firsts)
+        * (1 + np.log(counts))
+        / np.asarray(vectors.norms)[rows]
+    )
+    partial = np.bincount(rows, weights=contributions, minlength=len(ids))
+    partial[row] = 0
+
+    # ties keep the lowest document id first, as in `score_python`
+    found = np.flatnonzero(partial)
+    shortlist = found[np.argsort(-partial[found], kind="stable")[:candidates]]
+    if len(shortlist) == 0:
+        return {}
+
+    # the exact similarity of every candidate at once, as the product of
+    # their rows with the (dense) vector of the document
+    query = np.zeros(len(postings_offsets) - 1)
+    query[query_words] = query_weights
+
+    starts = offsets[shortlist].astype(np.int64)
+    ends = offsets[shortlist + 1].astype(np.int64)
+    words = np.concatenate(
+        [np.asarray(vectors.words[s:e]) for s, e in zip(starts, ends)]
+    )
+    weights = np.concatenate(
+        [np.asarray(vectors.weights[s:e]) for s, e in zip(starts, ends)]
+    )
+    boundaries = np.concatenate(([0], np.cumsum(ends - starts)[:-1]))
+    scores = np.add.reduceat(query[words] * weights, boundaries)
+
+    return {int(ids[r]): float(s) for r, s in zip(shortlist, scores)}
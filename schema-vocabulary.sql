@@ -0,0 +1,29 @@
+CREATE TABLE IF NOT EXISTS vocabulary (
+    word_id INTEGER GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    word VARCHAR NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS words (
+    word_id INTEGER NOT NULL,
+    document_id INTEGER NOT NULL,
+    count INTEGER NOT NULL
+);
+
+-- the manifest of every loaded document, used by incremental loads
+CREATE TABLE IF NOT EXISTS documents (
+    document_id BIGINT PRIMARY KEY,
+    digest VARCHAR NOT NULL,
+    size BIGINT NOT NULL
+);
+
+-- incremented by every load, to invalidate cached search results
+CREATE TABLE IF NOT EXISTS load_generation (
+    generation BIGINT NOT NULL
+);
+
+-- indexes used to resolve word patterns such as fish%, %ing and doctor_
+CREATE INDEX IF NOT EXISTS idx_vocabulary_word ON vocabulary (word text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_vocabulary_reverse ON vocabulary (reverse(word) text_pattern_ops);
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS idx_vocabulary_trigram ON vocabulary USING GIN (word gin_trgm_ops);
\ No newline at end of file
@@ -6,4 +6,23 @@ CREATE TABLE IF NOT EXISTS words (
 
 CREATE TABLE IF NOT EXISTS distinct_words (
     word VARCHAR NOT NULL
-);
\ No newline at end of file
+);
+
+-- the manifest of every loaded document, used by incremental loads
+CREATE TABLE IF NOT EXISTS documents (
+    document_id BIGINT PRIMARY KEY,
+    digest VARCHAR NOT NULL,
+    size BIGINT NOT NULL
+);
+
+-- incremented by every load, to invalidate cached search results
+CREATE TABLE IF NOT EXISTS load_generation (
+    generation BIGINT NOT NULL
+);
+
+-- indexes used to resolve word patterns such as fish%, %ing and doctor_
+CREATE INDEX IF NOT EXISTS idx_distinct_words_word ON distinct_words (word text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_distinct_words_reverse ON distinct_words (reverse(word) text_pattern_ops);
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS idx_distinct_words_trigram ON distinct_words USING GIN (word gin_trgm_ops);
\ No newline at end of file
@@ -0,0 +1,81 @@
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pytest
+
+from benchmarks.download import check, generate_mirror, run, start_mirror
+
+# the single digit ids are kept in the `0/` directory of the mirror
+IDS = list(range(1, 31))
+
+
+@pytest.fixture(scope="module")
+def mirror() -> Iterator[Tuple[Path, Dict[int, str]]]:
+    root = Path(tempfile.mkdtemp())
+    documents = generate_mirror(root, IDS, missing=0.1, seed=0)
+    yield root, documents
+    shutil.rmtree(root)
+
+
+def download(
+    root: Path,
+    failure_rate: float = 0.0,
+    retry_after: Optional[int] = None,
+    concurrency: int = 4,
+    rate: float = 0.0,
+    backoff: float = 0.01,
+) -> Tuple[Path, List[float], float]:
+    server = start_mirror(root, 0.0, failure_rate, retry_after)
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    start = time.monotonic()
+    try:
+        path = run(url, IDS, concurrency, rate, retries=8, backoff=backoff)
+    finally:
+        server.shutdown()
+
+    return path, sorted(server.requests), time.monotonic() - start  # type: ignore
+
+
+def test_download_every_document(mirror: Tuple[Path, Dict[int, str]]) -> None:
+    root, documents = mirror
+    path, _, _ = download(root)
+
+    assert any(i < 10 for i in documents)
+    assert check(path, documents) == 0
+    shutil.rmtree(path)
+
+
+def test_retry_failed_requests(mirror: Tuple[Path, Dict[int, str]]) -> None:
+    root, documents = mirror
+    path, requests, _ = download(root, failure_rate=0.3)
+
+    # a page and a text file for each document, a page for each missing id
+    assert len(requests) > 2 * len(documents) + len(IDS) - len(documents)
+    assert check(path, documents) == 0
+    shutil.rmtree(path)
+
+
+def test_wait_as_long_as_retry_after(mirror: Tuple[Path, Dict[int, str]]) -> None:
+    root, documents = mirror
+    # the backoff alone would take at least a minute for a single retry
+    path, _, elapsed = download(root, failure_rate=0.3, retry_after=0, backoff=60)
+
+    assert check(path, documents) == 0
+    assert elapsed < 30
+    shutil.rmtree(path)
+
+
+def test_rate_limit(mirror: Tuple[Path, Dict[int, str]]) -> None:
+    root, documents = mirror
+    rate = 20
+    path, requests, elapsed = download(root, concurrency=8, rate=rate)
+
+    assert check(path, documents) == 0
+    # the bucket holds a single token, so no burst exceeds the rate
+    peak = max(sum(1 for t in requests if s <= t < s + 1) for s in requests)
+    assert peak <= rate + 1
+    assert elapsed >= (len(requests) - 1) / rate * 0.9
+    shutil.rmtree(path)
@@ -0,0 +1,91 @@
+from array import array
+from io import BytesIO
+from typing import Any, List
+
+from gutensearch.parse import DocumentCounts
+from gutensearch.pgcopy import (
+    BINARY_HEADER,
+    BINARY_TRAILER,
+    copy_binary,
+    decode_rows,
+    encode_distinct_words,
+    encode_word_positions,
+)
+from gutensearch.positions import decode_positions, encode_positions
+
+# words longer than 255 bytes, non-ASCII words and large counts and ids
+# take different paths through the encoders than the common case
+DOCUMENTS = [
+    DocumentCounts(12, ["the", "whale", "ahab"], array("I", [40, 3, 1])),
+    DocumentCounts(
+        2**40,
+        ["a", "x" * 300, "naïve", "日本語", "z" * 255, "y" * 256],
+        array("I", [1, 4095, 4096, 2**31 - 1, 0, 7]),
+    ),
+    DocumentCounts(1, [], array("I")),
+]
+
+
+def stream(data: bytes) -> bytes:
+    return BINARY_HEADER + data + BINARY_TRAILER
+
+
+def test_words_round_trip() -> None:
+    data = b"".join(doc.copy_binary() for doc in DOCUMENTS)
+    rows = [
+        (w, doc.document_id, c)
+        for doc in DOCUMENTS
+        for w, c in zip(doc.words, doc.counts)
+    ]
+
+    assert decode_rows(stream(data), ["text", "int8", "int4"]) == rows
+
+
+def test_distinct_words_round_trip() -> None:
+    words = sorted({w for doc in DOCUMENTS for w in doc.words})
+    data = encode_distinct_words(words)
+
+    assert decode_rows(stream(data), ["text"]) == [(w,) for w in words]
+
+
+def test_word_positions_round_trip() -> None:
+    words = ["call", "me", "ishmael", "é" * 200]
+    positions = [[0], [1, 9, 2**20], [2], list(range(3, 300, 7))]
+    packed = [encode_positions(p) for p in positions]
+    data = encode_word_positions(2**33, words, packed)
+
+    rows = decode_rows(stream(data), ["text", "int8", "bytea"])
+    assert [(w, i) for w, i, _ in rows] == [(w, 2**33) for w in words]
+    assert [decode_positions(p) for _, _, p in rows] == positions
+
+
+class Cursor:
+    """
+    Stands in for a database cursor, reading the `COPY` stream the
+    same way psycopg2 does, `size` bytes at a time
+    """
+
+    def __init__(self) -> None:
+        self.reads: List[int] = []
+        self.data = b""
+
+    def copy_expert(self, sql: str, f: Any, size: int) -> None:
+        while True:
+            chunk = f.read(size)
+            if len(chunk) == 0:
+                return
+            self.reads.append(len(chunk))
+            self.data += chunk
+
+
+def test_copy_binary_streams_in_chunks() -> None:
+    data = b"".join(doc.copy_binary() for doc in DOCUMENTS * 50)
+    fio = BytesIO()
+    fio.write(data)
+
+    cur = Cursor()
+    copy_binary(cur, fio, "words", size=1000)
+
+    assert cur.data == stream(data)
+    assert max(cur.reads) == 1000
+    assert len(cur.reads) == -(-len(stream(data)) // 1000)